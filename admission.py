@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from metrics import registry
+
+# 优先级（数值越小越优先）：交互式流式问答 > 普通问答 > 批量/导入/后台任务
+PRIORITY_STREAM = 0
+PRIORITY_ASK = 1
+PRIORITY_BATCH = 2
+
+class OverloadedError(Exception):
+    """上游并发已满且排队超限（或等待超时），请求被快速拒绝；retry_after为建议重试秒数"""
+
+    def __init__(self, upstream: str, retry_after: int, reason: str):
+        super().__init__(f"{upstream}上游繁忙（{reason}），请{retry_after}秒后重试")
+        self.upstream = upstream
+        self.retry_after = retry_after
+        self.reason = reason
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "granted", "abandoned", "notify")
+
+    def __init__(self, priority: int, seq: int, notify):
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.abandoned = False
+        self.notify = notify
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class AdmissionController:
+    """单个上游的准入控制：并发上限 + 按优先级排队 + 最长等待时间。
+    同时支持事件循环中的异步调用与线程池中的同步调用；
+    排队已满或等待超时时抛出OverloadedError，而不是让请求在上游429中缓慢失败。
+    """
+    # 统计等待耗时与占用时长的滑动窗口大小
+    WINDOW = 500
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait_ms: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: List[_Waiter] = []
+        self._queued = 0
+        self._seq = itertools.count()
+        self._admitted = 0
+        self._rejected = 0
+        self._waits: deque = deque(maxlen=self.WINDOW)
+        self._holds: deque = deque(maxlen=self.WINDOW)
+
+    def retry_after(self) -> int:
+        """按平均占用时长与当前排队数估算的建议重试秒数"""
+        holds = list(self._holds)
+        avg_hold = sum(holds) / len(holds) if holds else 1.0
+        return max(1, math.ceil(avg_hold * (self._queued + 1) / self.limit))
+
+    def check(self) -> None:
+        """快速预检：排队已满时直接拒绝（用于流式响应开始前）"""
+        with self._lock:
+            if self._active >= self.limit and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise OverloadedError(self.name, self.retry_after(), "queue_full")
+
+    def _try_enter(self, priority: int, notify) -> Optional[_Waiter]:
+        """有空闲名额且无人排队时直接占用并返回None，否则入队并返回等待者"""
+        with self._lock:
+            if self._active < self.limit and self._queued == 0:
+                self._active += 1
+                self._admitted += 1
+                self._waits.append(0.0)
+                return None
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise OverloadedError(self.name, self.retry_after(), "queue_full")
+            waiter = _Waiter(priority, next(self._seq), notify)
+            heapq.heappush(self._queue, waiter)
+            self._queued += 1
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """放弃等待；若名额已在此之前移交给该等待者则返回True（调用方需释放）"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.abandoned = True
+            self._queued -= 1
+            return False
+
+    def _release(self, held: float) -> None:
+        with self._lock:
+            self._holds.append(held)
+            while self._queue:
+                waiter = heapq.heappop(self._queue)
+                if waiter.abandoned:
+                    continue
+                # 名额直接移交给优先级最高的等待者，active不变
+                waiter.granted = True
+                self._queued -= 1
+                self._admitted += 1
+                break
+            else:
+                self._active -= 1
+                return
+        waiter.notify()
+
+    async def acquire(self, priority: int = PRIORITY_ASK) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        start = time.perf_counter()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        waiter = self._try_enter(priority, notify)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except BaseException as e:
+            if self._abandon(waiter):
+                if isinstance(e, asyncio.TimeoutError):
+                    # 超时与移交同时发生：名额已属于本请求
+                    self._waits.append(time.perf_counter() - start)
+                    return
+                self._release(0.0)
+            if isinstance(e, asyncio.TimeoutError):
+                with self._lock:
+                    self._rejected += 1
+                raise OverloadedError(self.name, self.retry_after(), "wait_timeout")
+            raise
+        self._waits.append(time.perf_counter() - start)
+
+    def acquire_blocking(self, priority: int = PRIORITY_BATCH, timeout: Optional[float] = None) -> None:
+        """线程池中的同步调用（导入等批量任务）：与异步路径一样受排队上限与最长等待（默认max_wait）约束，
+        超限时抛出OverloadedError，避免在持续的交互负载下无限期占用共享线程池的线程
+        """
+        event = threading.Event()
+        start = time.perf_counter()
+        waiter = self._try_enter(priority, event.set)
+        if waiter is None:
+            return
+        if not event.wait(self.max_wait if timeout is None else timeout):
+            # 超时与移交同时发生时名额已属于本调用，照常继续
+            if not self._abandon(waiter):
+                with self._lock:
+                    self._rejected += 1
+                raise OverloadedError(self.name, self.retry_after(), "wait_timeout")
+        self._waits.append(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_ASK):
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    @contextmanager
+    def blocking_slot(self, priority: int = PRIORITY_BATCH, timeout: Optional[float] = None):
+        self.acquire_blocking(priority, timeout)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "limit": self.limit,
+            "active": self._active,
+            "queue_depth": self._queued,
+            "max_queue": self.max_queue,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2) if waits else 0.0,
+        }
+
+chat_admission = AdmissionController(
+    "chat", Config.CHAT_MAX_CONCURRENCY, Config.CHAT_MAX_QUEUE, Config.CHAT_MAX_WAIT_MS
+)
+embedding_admission = AdmissionController(
+    "embedding", Config.EMBEDDING_MAX_CONCURRENCY, Config.EMBEDDING_MAX_QUEUE, Config.EMBEDDING_MAX_WAIT_MS
+)
+
+_CONTROLLERS = (chat_admission, embedding_admission)
+
+def _admission_samples(field: str):
+    return lambda: [({"upstream": c.name}, c.stats()[field]) for c in _CONTROLLERS]
+
+registry.callback("admission_active", "Upstream calls currently holding a slot", _admission_samples("active"))
+registry.callback("admission_queue_depth", "Upstream calls waiting for a slot", _admission_samples("queue_depth"))
+registry.callback("admission_rejected_total", "Upstream calls rejected by admission control", _admission_samples("rejected"), kind="counter")
@@ -0,0 +1,280 @@
+"""问答统计：按天（UTC）、模型与知识分类增量维护提问数、错误与缓存命中、点赞/点踩、token用量与请求耗时分位数。
+
+问答记录与反馈写入时在同一事务中累加到daily_stats（见qa_record_writer与batch_service），
+统计接口只读取查询范围内的聚合行，耗时与历史数据量无关；归档删除问答记录不影响已有统计。
+
+用法：
+    python analytics_service.py rebuild          # 由热表与归档全量重建统计（启用统计前已有的历史数据）
+    python analytics_service.py show --days 7
+"""
+import argparse
+import json
+import math
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config import Config, setup_logging
+from database import SessionLocal, engine
+from db_writer import db_writer
+from models import Base, DailyStat, Feedback, QARecord
+from retention_service import ArchiveStore
+
+# (日期, 模型, 分类)
+_Key = Tuple[date, str, str]
+
+_COUNTERS = ("questions", "errors", "cache_hits", "thumbs_up", "thumbs_down", "prompt_tokens", "completion_tokens", "total_tokens")
+
+
+class LatencySketch:
+    """对数分桶的分位数草图：桶边界按gamma=(1+a)/(1-a)等比增长，分位数估计的相对误差不超过a。
+    只保存非空桶的计数（毫秒级耗时通常不超过两三百个桶），相同精度的草图按桶相加即可合并。
+    """
+
+    MIN_VALUE = 1.0  # 毫秒，更小的值计入最低的桶
+
+    def __init__(self, relative_accuracy: float = 0.02, buckets: Optional[Dict[int, int]] = None):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = dict(buckets or {})
+
+    @property
+    def count(self) -> int:
+        return sum(self.buckets.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        index = math.ceil(math.log(max(value, self.MIN_VALUE)) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other: "LatencySketch") -> None:
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"a": self.relative_accuracy, "b": {str(i): c for i, c in self.buckets.items()}}
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict[str, Any]]) -> "LatencySketch":
+        if not data:
+            return cls()
+        return cls(data.get("a", 0.02), {int(i): c for i, c in data.get("b", {}).items()})
+
+
+class _Aggregate:
+    """一组统计行（或一批写入）的累加结果"""
+
+    def __init__(self):
+        self.counters = dict.fromkeys(_COUNTERS, 0)
+        self.latency = LatencySketch()
+
+    def add_row(self, row: DailyStat) -> None:
+        for name in _COUNTERS:
+            self.counters[name] += getattr(row, name) or 0
+        self.latency.merge(LatencySketch.from_json(row.latency_sketch))
+
+    def to_dict(self) -> Dict[str, Any]:
+        c = self.counters
+        votes = c["thumbs_up"] + c["thumbs_down"]
+        result = dict(c)
+        result["satisfaction"] = round(c["thumbs_up"] / votes, 4) if votes else None
+        result["error_rate"] = round(c["errors"] / c["questions"], 4) if c["questions"] else None
+        result["cache_hit_rate"] = round(c["cache_hits"] / c["questions"], 4) if c["questions"] else None
+        result["latency_ms"] = {
+            "count": self.latency.count,
+            **{f"p{int(q * 100)}": self._round(self.latency.quantile(q)) for q in (0.5, 0.9, 0.99)},
+        }
+        return result
+
+    @staticmethod
+    def _round(value: Optional[float]) -> Optional[float]:
+        return round(value, 1) if value is not None else None
+
+
+def _category(process_log: Optional[Dict[str, Any]]) -> str:
+    return ((process_log or {}).get("category") or "")
+
+
+def _model(model_used: Optional[str], process_log: Optional[Dict[str, Any]]) -> str:
+    return model_used or (process_log or {}).get("model") or ""
+
+
+def _day(created_at: Any) -> date:
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return (created_at or datetime.utcnow()).date()
+
+
+class AnalyticsService:
+    """问答统计的增量维护与查询"""
+
+    def __init__(self, max_days: int = None):
+        self.max_days = max(1, max_days or Config.ANALYTICS_MAX_DAYS)
+
+    @staticmethod
+    def _add_record(deltas: Dict[_Key, _Aggregate], created_at: Any, model_used: Optional[str],
+                    process_log: Optional[Dict[str, Any]]) -> Tuple[str, str]:
+        process_log = process_log or {}
+        dims = (_model(model_used, process_log), _category(process_log))
+        agg = deltas.setdefault((_day(created_at),) + dims, _Aggregate())
+        c = agg.counters
+        c["questions"] += 1
+        if process_log.get("status") != "success":
+            c["errors"] += 1
+        if (process_log.get("cache") or {}).get("hit"):
+            c["cache_hits"] += 1
+        c["prompt_tokens"] += process_log.get("prompt_tokens") or 0
+        c["completion_tokens"] += process_log.get("response_tokens") or 0
+        c["total_tokens"] += process_log.get("total_tokens") or 0
+        total_ms = (process_log.get("timings") or {}).get("total_ms")
+        if total_ms is not None:
+            agg.latency.add(total_ms)
+        return dims
+
+    @staticmethod
+    def _add_feedback(deltas: Dict[_Key, _Aggregate], created_at: Any, is_useful: bool, dims: Tuple[str, str]) -> None:
+        agg = deltas.setdefault((_day(created_at),) + dims, _Aggregate())
+        agg.counters["thumbs_up" if is_useful else "thumbs_down"] += 1
+
+    @staticmethod
+    def _record_dims(db, qa_record_id: int) -> Tuple[str, str]:
+        row = db.query(QARecord.model_used, QARecord.process_log).filter(QARecord.id == qa_record_id).first()
+        if row is None:
+            return "", ""
+        return _model(row.model_used, row.process_log), _category(row.process_log)
+
+    @staticmethod
+    def _upsert(db, deltas: Dict[_Key, _Aggregate]) -> None:
+        for key, agg in deltas.items():
+            row = db.get(DailyStat, key, with_for_update=True)
+            if row is None:
+                row = DailyStat(day=key[0], model=key[1], category=key[2], **dict.fromkeys(_COUNTERS, 0))
+                db.add(row)
+            for name, value in agg.counters.items():
+                if value:
+                    setattr(row, name, (getattr(row, name) or 0) + value)
+            if agg.latency.count:
+                sketch = LatencySketch.from_json(row.latency_sketch)
+                sketch.merge(agg.latency)
+                row.latency_sketch = sketch.to_json()
+            row.updated_at = datetime.utcnow()
+        # 同一写事务中后续的累加需要能通过db.get取到本次新增的行
+        db.flush()
+
+    @classmethod
+    def apply(cls, db, records: Iterable[QARecord] = (), feedback: Iterable[Feedback] = ()) -> None:
+        """写函数内调用：把本批新写入的问答记录与反馈累加到daily_stats（与写入在同一事务中提交）"""
+        if not Config.ANALYTICS_ENABLED:
+            return
+        deltas: Dict[_Key, _Aggregate] = {}
+        dims_by_id: Dict[int, Tuple[str, str]] = {}
+        for record in records:
+            dims_by_id[record.id] = cls._add_record(deltas, record.created_at, record.model_used, record.process_log)
+        for item in feedback:
+            dims = dims_by_id.get(item.qa_record_id) or cls._record_dims(db, item.qa_record_id)
+            cls._add_feedback(deltas, item.created_at, item.is_useful, dims)
+        if deltas:
+            cls._upsert(db, deltas)
+
+    def summary(self, days: int = 30, model: Optional[str] = None, category: Optional[str] = None,
+                end: Optional[date] = None) -> Dict[str, Any]:
+        """最近days天（含end当天）的汇总、逐日、按模型与按分类统计"""
+        days = min(max(1, days), self.max_days)
+        end = end or datetime.utcnow().date()
+        start = end - timedelta(days=days - 1)
+        db = SessionLocal()
+        try:
+            query = db.query(DailyStat).filter(DailyStat.day >= start, DailyStat.day <= end)
+            if model is not None:
+                query = query.filter(DailyStat.model == model)
+            if category is not None:
+                query = query.filter(DailyStat.category == category)
+            rows = query.all()
+        finally:
+            db.close()
+        totals = _Aggregate()
+        daily: Dict[date, _Aggregate] = {}
+        by_model: Dict[str, _Aggregate] = {}
+        by_category: Dict[str, _Aggregate] = {}
+        for row in rows:
+            totals.add_row(row)
+            daily.setdefault(row.day, _Aggregate()).add_row(row)
+            by_model.setdefault(row.model, _Aggregate()).add_row(row)
+            by_category.setdefault(row.category, _Aggregate()).add_row(row)
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "days": days,
+            "totals": totals.to_dict(),
+            "daily": [dict(day=(start + timedelta(days=i)).isoformat(), **(daily.get(start + timedelta(days=i)) or _Aggregate()).to_dict())
+                      for i in range(days)],
+            "by_model": sorted((dict(model=k, **v.to_dict()) for k, v in by_model.items()), key=lambda r: -r["questions"]),
+            "by_category": sorted((dict(category=k, **v.to_dict()) for k, v in by_category.items()), key=lambda r: -r["questions"]),
+        }
+
+    def rebuild(self, store: Optional[ArchiveStore] = None) -> Dict[str, int]:
+        """由热表与归档全量重建统计（在一个写事务中完成，期间其他写操作等待）"""
+        store = store or ArchiveStore(Config.ARCHIVE_DIR, Config.ARCHIVE_COMPRESSION)
+        return db_writer.call(self._rebuild, store)
+
+    def _rebuild(self, db, store: ArchiveStore) -> Dict[str, int]:
+        deltas: Dict[_Key, _Aggregate] = {}
+        archived = records = feedback = 0
+        # 归档中只有无反馈的记录；同一id可能同时留在热表（归档后删除前中断），以热表为准
+        hot_ids = {row.id for row in db.query(QARecord.id)}
+        for record in store.iter_records():
+            if record.get("id") in hot_ids:
+                continue
+            self._add_record(deltas, record.get("created_at"), record.get("model_used"), record.get("process_log"))
+            archived += 1
+        rows = db.query(QARecord.created_at, QARecord.model_used, QARecord.process_log).yield_per(1000)
+        for row in rows:
+            self._add_record(deltas, row.created_at, row.model_used, row.process_log)
+            records += 1
+        rows = (
+            db.query(Feedback.created_at, Feedback.is_useful, QARecord.model_used, QARecord.process_log)
+            .outerjoin(QARecord, QARecord.id == Feedback.qa_record_id)
+            .yield_per(1000)
+        )
+        for row in rows:
+            self._add_feedback(deltas, row.created_at, row.is_useful, (_model(row.model_used, row.process_log), _category(row.process_log)))
+            feedback += 1
+        db.query(DailyStat).delete()
+        db.flush()
+        self._upsert(db, deltas)
+        return {"rows": len(deltas), "records": records, "archived_records": archived, "feedback": feedback}
+
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="问答统计")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="由热表与归档全量重建统计")
+    show = sub.add_parser("show", help="查看最近若干天的统计")
+    show.add_argument("--days", type=int, default=7)
+    show.add_argument("--model")
+    show.add_argument("--category")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine, tables=[DailyStat.__table__])
+    service = AnalyticsService()
+    if args.command == "rebuild":
+        print(json.dumps(service.rebuild(), ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(service.summary(args.days, args.model, args.category), ensure_ascii=False, indent=2))
+    db_writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+# 检索结果签名：((knowledge_id, 版本), ...)，版本取知识条目的更新时间（无则取创建时间）
+KnowledgeKey = Tuple[Tuple[int, str], ...]
+
+class _CacheEntry:
+    __slots__ = ("eid", "embedding", "knowledge_key", "prompt_key", "answer", "qa_record_id", "created_at", "hits")
+
+    def __init__(self, eid: int, embedding: np.ndarray, knowledge_key: KnowledgeKey, prompt_key: str, answer: str, qa_record_id: Optional[int]):
+        self.eid = eid
+        self.embedding = embedding
+        self.knowledge_key = knowledge_key
+        self.prompt_key = prompt_key
+        self.answer = answer
+        self.qa_record_id = qa_record_id
+        self.created_at = time.time()
+        self.hits = 0
+
+class AnswerCache:
+    """语义答案缓存：按问题embedding的余弦相似度查找历史答案。
+    仅当检索到的知识（id与版本）和提示词完全一致时才命中，
+    因此知识条目或提示词变化后旧答案自然失效（跨进程同样成立）。
+    """
+
+    def __init__(self, threshold: float = None, max_entries: int = None, ttl_seconds: int = None):
+        self.threshold = Config.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.max_entries = Config.ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_seconds = Config.ANSWER_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+        # (knowledge_key, prompt_key) -> entry ids，查找时只与签名相同的条目比较
+        self._by_signature: Dict[Tuple[KnowledgeKey, str], List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def knowledge_key(similar_knowledges) -> KnowledgeKey:
+        """根据检索结果[(Knowledge, sim), ...]生成签名"""
+        return tuple(
+            (int(k.id), str(k.updated_at or k.created_at or ""))
+            for k, _ in similar_knowledges
+        )
+
+    @staticmethod
+    def prompt_key(prompts: Dict[str, Optional[str]]) -> str:
+        """根据提示词内容生成签名"""
+        raw = f"{prompts.get('system_prompt') or ''}\x00{prompts.get('answer_prompt') or ''}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, embedding: np.ndarray, knowledge_key: KnowledgeKey, prompt_key: str) -> Optional[Dict[str, Any]]:
+        """查找相似问题的缓存答案，未命中返回None"""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            ids = self._by_signature.get((knowledge_key, prompt_key))
+            if not ids:
+                return None
+            alive = []
+            for eid in ids:
+                entry = self._entries.get(eid)
+                if entry is None:
+                    continue
+                if self.ttl_seconds and now - entry.created_at > self.ttl_seconds:
+                    self._remove(eid)
+                    continue
+                if entry.embedding.shape == query.shape:
+                    alive.append(entry)
+            if not alive:
+                return None
+            scores = np.stack([e.embedding for e in alive]) @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+            entry = alive[best]
+            entry.hits += 1
+            # LRU：命中的条目移到末尾
+            self._entries.move_to_end(entry.eid)
+            return {
+                "answer": entry.answer,
+                "similarity": similarity,
+                "source_qa_record_id": entry.qa_record_id,
+            }
+
+    def store(self, embedding: np.ndarray, knowledge_key: KnowledgeKey, prompt_key: str, answer: str, qa_record_id: Optional[int] = None) -> None:
+        """写入缓存"""
+        normalized = self._normalize(embedding)
+        with self._lock:
+            eid = self._next_id
+            self._next_id += 1
+            self._entries[eid] = _CacheEntry(eid, normalized, knowledge_key, prompt_key, answer, qa_record_id)
+            self._by_signature.setdefault((knowledge_key, prompt_key), []).append(eid)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def invalidate_knowledge(self, knowledge_id: int) -> None:
+        """知识条目变更/删除时，移除引用该条目的缓存"""
+        with self._lock:
+            stale = [eid for eid, e in self._entries.items() if any(kid == knowledge_id for kid, _ in e.knowledge_key)]
+            for eid in stale:
+                self._remove(eid)
+
+    def clear(self) -> None:
+        """清空缓存（提示词变更时调用）"""
+        with self._lock:
+            self._entries.clear()
+            self._by_signature.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": sum(e.hits for e in self._entries.values()),
+            }
+
+    def _remove(self, eid: int) -> None:
+        entry = self._entries.pop(eid, None)
+        if entry is None:
+            return
+        sig = (entry.knowledge_key, entry.prompt_key)
+        ids = self._by_signature.get(sig)
+        if ids is not None:
+            try:
+                ids.remove(eid)
+            except ValueError:
+                pass
+            if not ids:
+                del self._by_signature[sig]
+
+# 进程内共享的缓存实例
+answer_cache = AnswerCache()
@@ -0,0 +1,35 @@
+import asyncio
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+from config import Config
+from profiling import current_profile
+
+# 无法异步化的阻塞工作（SQLite、pymilvus、LangChain会话存储等I/O）使用的有界线程池
+_io_executor = ThreadPoolExecutor(max_workers=Config.BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+# CPU密集型工作（PDF解析等）使用的小线程池，避免挤占I/O线程
+_cpu_executor = ThreadPoolExecutor(max_workers=Config.CPU_BOUND_WORKERS, thread_name_prefix="cpu-bound")
+
+def _profiled(call: Callable[[], Any]) -> Callable[[], Any]:
+    """当前请求开启剖析时，让执行该调用的线程池线程一并被采样"""
+    profile = current_profile()
+    return call if profile is None else profile.wrap(call)
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在有界I/O线程池中执行阻塞调用，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, _profiled(functools.partial(func, *args, **kwargs)))
+
+async def run_cpu_bound(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在有界CPU线程池中执行计算密集型调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cpu_executor, _profiled(functools.partial(func, *args, **kwargs)))
+
+def submit_blocking(func: Callable[..., Any], *args, **kwargs) -> Future:
+    """在有界I/O线程池中提交阻塞调用并立即返回Future（不等待结果，任意线程中均可调用）"""
+    return _io_executor.submit(func, *args, **kwargs)
+
+def shutdown_executors() -> None:
+    """关闭线程池（应用退出时调用）"""
+    _io_executor.shutdown(wait=True)
+    _cpu_executor.shutdown(wait=True)
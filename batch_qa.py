@@ -0,0 +1,65 @@
+"""批量问答命令行：提交问题列表并将结果逐行写入JSONL文件，中断后可继续。
+
+用法：
+    python batch_qa.py questions.txt --output results.jsonl
+    python batch_qa.py --resume <job_id> --output results.jsonl
+
+questions.txt 每行一个问题；也可以是JSON数组文件（.json）。
+"""
+import argparse
+import json
+import sys
+
+import httpx
+
+
+def load_questions(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return [str(q) for q in json.load(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量问答")
+    parser.add_argument("input", nargs="?", help="问题文件（每行一个问题，或JSON数组）")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--output", default="batch_results.jsonl", help="结果输出文件（追加写入）")
+    parser.add_argument("--concurrency", type=int, default=None, help="生成并发数")
+    parser.add_argument("--resume", metavar="JOB_ID", help="继续执行已有任务中未完成的问题")
+    args = parser.parse_args()
+
+    if args.resume:
+        method_args = {"url": f"/qa/batch/{args.resume}/resume"}
+    elif args.input:
+        questions = load_questions(args.input)
+        method_args = {"url": "/qa/batch", "json": {"questions": questions, "concurrency": args.concurrency}}
+    else:
+        parser.error("需要提供问题文件或 --resume JOB_ID")
+
+    done = 0
+    with httpx.Client(base_url=args.base_url, timeout=None) as client, \
+            open(args.output, "a", encoding="utf-8") as out:
+        with client.stream("POST", **method_args) as response:
+            if response.status_code != 200:
+                response.read()
+                print(f"请求失败: {response.status_code} {response.text}", file=sys.stderr)
+                sys.exit(1)
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "job":
+                    print(f"任务 {event['job_id']}：共{event['total']}题，已完成{event['completed']}，本次待处理{event['pending']}", file=sys.stderr)
+                    print(f"中断后可执行：python batch_qa.py --resume {event['job_id']} --output {args.output}", file=sys.stderr)
+                elif event["type"] == "result":
+                    out.write(json.dumps(event, ensure_ascii=False) + "\n")
+                    out.flush()
+                    done += 1
+                    print(f"[{done}] #{event['position']} {event['status']} {event['question'][:40]}", file=sys.stderr)
+                elif event["type"] == "done":
+                    print(f"任务{event['status']}：完成{event['completed']}/{event['total']}，失败{event['failed']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from admission import OverloadedError, PRIORITY_BATCH
+from analytics_service import AnalyticsService
+from async_utils import run_blocking, run_cpu_bound
+from config import Config
+from database import SessionLocal
+from db_writer import db_writer
+from metrics import RETRIEVAL_FALLBACKS
+from models import BatchJob, BatchJobItem, Knowledge, QARecord
+from qa_record_writer import qa_record_ids
+from qa_service import QAService
+
+logger = logging.getLogger(__name__)
+
+class BatchQAService:
+    """批量问答：问题一次批量embedding、一次批量向量检索与数据库查询，
+    再以有界并发生成答案；每完成一题即持久化问答记录与任务进度并产出结果，
+    中断后重新执行任务只处理尚未完成的问题。
+    批量结果用于回归集与FAQ预生成，不读取也不写入答案缓存。
+    """
+
+    def __init__(self, qa_service: QAService):
+        self.qa_service = qa_service
+        self._running: Set[str] = set()
+
+    def create_job(self, questions: List[str], concurrency: Optional[int] = None) -> BatchJob:
+        return db_writer.call(self._write_job, questions, concurrency)
+
+    @staticmethod
+    def _write_job(db, questions: List[str], concurrency: Optional[int]) -> BatchJob:
+        items = [(i, q.strip()) for i, q in enumerate(questions) if q and q.strip()]
+        job = BatchJob(
+            id=str(uuid.uuid4()),
+            status="pending",
+            total=len(items),
+            concurrency=max(1, concurrency or Config.BATCH_QA_CONCURRENCY),
+        )
+        db.add(job)
+        db.add_all(BatchJobItem(job_id=job.id, position=i, question=q) for i, q in items)
+        db.flush()
+        db.refresh(job)
+        return job
+
+    def get_job(self, db, job_id: str) -> Optional[Dict[str, Any]]:
+        job = db.query(BatchJob).filter(BatchJob.id == job_id).first()
+        if job is None:
+            return None
+        items = db.query(BatchJobItem).filter(BatchJobItem.job_id == job_id).order_by(BatchJobItem.position).all()
+        return {
+            **self._job_dict(job),
+            "items": [
+                {
+                    "position": it.position,
+                    "question": it.question,
+                    "status": it.status,
+                    "qa_record_id": it.qa_record_id,
+                    "error_message": it.error_message,
+                }
+                for it in items
+            ],
+        }
+
+    def is_running(self, job_id: str) -> bool:
+        return job_id in self._running
+
+    def claim(self, job_id: str) -> bool:
+        """占用任务，返回是否成功；任务已在执行时返回False。
+        须在事件循环中、返回流式响应之前调用：检查与登记之间没有await，并发的继续请求只有一个能占用。
+        占用由调用方以release释放——包括run_job尚未开始迭代（客户端在响应开始前断开）的情况。
+        """
+        if job_id in self._running:
+            return False
+        self._running.add(job_id)
+        return True
+
+    def release(self, job_id: str) -> None:
+        """释放claim的占用（须在run_job的事件流关闭之后调用）"""
+        self._running.discard(job_id)
+
+    @staticmethod
+    def _job_dict(job: BatchJob) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "total": job.total,
+            "completed": job.completed,
+            "failed": job.failed,
+            "concurrency": job.concurrency,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
+        }
+
+    async def run_job(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """执行任务中尚未完成的问题（调用方须先以claim占用任务，并在事件流关闭后release），依次产出事件：
+        - {"type": "job", ...}：任务信息与待处理数
+        - {"type": "result", "position", "question", "status", "qa_record"}：每题完成时（按完成顺序）
+        - {"type": "done", ...}：最终进度
+        """
+        if job_id not in self._running:
+            raise RuntimeError(f"批量任务未占用: {job_id}")
+        finished = False
+        tasks: List[asyncio.Task] = []
+        try:
+            job, pending = await db_writer.run(self._start, job_id)
+            yield {"type": "job", **job, "pending": len(pending)}
+            if pending:
+                retrieved, retrieval_log = await self._retrieve_all([q for _, _, q in pending])
+                semaphore = asyncio.Semaphore(job["concurrency"] or Config.BATCH_QA_CONCURRENCY)
+                results: asyncio.Queue = asyncio.Queue()
+
+                async def work(item: Tuple[int, int, str], similar):
+                    async with semaphore:
+                        event = await self._answer(job_id, item, similar, retrieval_log)
+                    await results.put(event)
+
+                tasks = [asyncio.ensure_future(work(item, similar)) for item, similar in zip(pending, retrieved)]
+                for _ in range(len(tasks)):
+                    yield await results.get()
+            summary = await db_writer.run(self._finish, job_id)
+            finished = True
+            yield {"type": "done", **summary}
+        finally:
+            for task in tasks:
+                task.cancel()
+            if not finished:
+                # 客户端断开或出错：未完成的问题保持pending，可重新执行任务继续；
+                # 状态经写入器更新，不在事件循环中执行数据库I/O，且不随请求取消而中止
+                await asyncio.shield(self._mark(job_id, "interrupted"))
+
+    def _start(self, db, job_id: str) -> Tuple[Dict[str, Any], List[Tuple[int, int, str]]]:
+        """写函数：标记任务开始执行并返回(任务信息, 待处理的问题)"""
+        job = db.query(BatchJob).filter(BatchJob.id == job_id).first()
+        job.status = "running"
+        # 未完成（含此前失败）的问题都会重新执行，计数从已完成数开始
+        job.completed = db.query(BatchJobItem).filter(BatchJobItem.job_id == job_id, BatchJobItem.status == "done").count()
+        job.failed = 0
+        pending = (
+            db.query(BatchJobItem.id, BatchJobItem.position, BatchJobItem.question)
+            .filter(BatchJobItem.job_id == job_id, BatchJobItem.status != "done")
+            .order_by(BatchJobItem.position)
+            .all()
+        )
+        db.flush()
+        db.refresh(job)
+        return self._job_dict(job), [tuple(row) for row in pending]
+
+    def _finish(self, db, job_id: str) -> Dict[str, Any]:
+        """写函数：按剩余问题数标记任务完成或中断"""
+        job = db.query(BatchJob).filter(BatchJob.id == job_id).first()
+        remaining = db.query(BatchJobItem).filter(BatchJobItem.job_id == job_id, BatchJobItem.status != "done").count()
+        job.status = "completed" if remaining == 0 else "interrupted"
+        db.flush()
+        db.refresh(job)
+        return self._job_dict(job)
+
+    async def _mark(self, job_id: str, status: str) -> None:
+        try:
+            await db_writer.run(self._write_status, job_id, status)
+        except Exception as e:
+            logger.warning(f"更新批量任务状态失败 job_id={job_id}: {e}")
+
+    @staticmethod
+    def _write_status(db, job_id: str, status: str) -> None:
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({BatchJob.status: status})
+
+    async def _retrieve_all(self, questions: List[str]) -> Tuple[List[List[Tuple[Knowledge, float]]], Dict[str, Any]]:
+        """批量检索：一次批量embedding + 一次批量向量检索与数据库查询；失败时逐题回退到文本匹配"""
+        qa = self.qa_service
+        retrieval_log: Dict[str, Any] = {"mode": "vector", "batch_size": len(questions)}
+        top_k = Config.RERANK_CANDIDATES if qa.rerank_service.enabled else Config.RETRIEVAL_TOP_K
+        try:
+            start = time.perf_counter()
+            while True:
+                try:
+                    embeddings = await qa.embedding_service.aget_embeddings(questions, PRIORITY_BATCH)
+                    break
+                except OverloadedError as e:
+                    await asyncio.sleep(e.retry_after)
+            retrieval_log["embedding_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            start = time.perf_counter()
+            retrieved = await run_blocking(self._search, embeddings, top_k)
+            retrieval_log["vector_search_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        except Exception as e:
+            logger.warning(f"批量embedding检索失败，使用简单文本匹配: {str(e)}")
+            retrieval_log["mode"] = "lexical_fallback"
+            retrieval_log["error_message"] = str(e)
+            RETRIEVAL_FALLBACKS.inc(len(questions))
+            retrieved = await run_blocking(self._search_by_text, questions)
+        return retrieved, retrieval_log
+
+    def _search(self, embeddings, top_k: int) -> List[List[Tuple[Knowledge, float]]]:
+        db = SessionLocal()
+        try:
+            return self.qa_service.knowledge_service.search_knowledge_by_embeddings(db, embeddings, top_k=top_k)
+        finally:
+            db.close()
+
+    def _search_by_text(self, questions: List[str]) -> List[List[Tuple[Knowledge, float]]]:
+        db = SessionLocal()
+        try:
+            return [self.qa_service._search_knowledge_by_text(db, q) for q in questions]
+        finally:
+            db.close()
+
+    async def _answer(self, job_id: str, item: Tuple[int, int, str], similar: List[Tuple[Knowledge, float]], retrieval_log: Dict[str, Any]) -> Dict[str, Any]:
+        item_id, position, question = item
+        qa = self.qa_service
+        retrieval_log = dict(retrieval_log)
+        try:
+            if qa.rerank_service.enabled:
+                similar, rerank_log = await qa.rerank_service.rerank(question, similar)
+                retrieval_log["rerank"] = rerank_log
+            context, context_log = await run_cpu_bound(qa._build_context, similar)
+            while True:
+                db = SessionLocal()
+                try:
+                    result = await qa.generate_answer(db, question, context, priority=PRIORITY_BATCH)
+                    break
+                except OverloadedError as e:
+                    # 批量任务不放弃：按建议时间等待后重新排队
+                    await asyncio.sleep(e.retry_after)
+                finally:
+                    db.close()
+            process_log = result["process_log"]
+            process_log["retrieval"] = retrieval_log
+            process_log["context"] = context_log
+            process_log["category"] = qa._primary_category(similar)
+            process_log["batch_job_id"] = job_id
+            # 问答记录id与write-behind共用同一分配器（写函数内不能再分配）
+            record_id = await qa_record_ids.allocate()
+            record = await db_writer.run(self._complete_item, job_id, item_id, record_id, question, result["answer"], process_log)
+            status = "done" if process_log.get("status") == "success" else "error"
+            return {"type": "result", "position": position, "question": question, "status": status, "qa_record": record}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"批量问答失败 job_id={job_id} position={position}: {e}")
+            await db_writer.run(self._fail_item, job_id, item_id, str(e))
+            return {"type": "result", "position": position, "question": question, "status": "error", "error_message": str(e)}
+
+    def _complete_item(self, db, job_id: str, item_id: int, record_id: int, question: str, answer: str, process_log: Dict[str, Any]) -> Dict[str, Any]:
+        """在同一事务中写入问答记录与任务进度；生成失败的问题标记为error，重新执行任务时会重试"""
+        qa_record = QARecord(id=record_id, question=question, answer=answer, model_used=process_log.get("model"), process_log=process_log)
+        db.add(qa_record)
+        db.flush()
+        AnalyticsService.apply(db, [qa_record])
+        ok = process_log.get("status") == "success"
+        db.query(BatchJobItem).filter(BatchJobItem.id == item_id).update({
+            BatchJobItem.status: "done" if ok else "error",
+            BatchJobItem.qa_record_id: qa_record.id,
+            BatchJobItem.error_message: None if ok else process_log.get("error_message"),
+            BatchJobItem.completed_at: datetime.utcnow(),
+        })
+        counter = BatchJob.completed if ok else BatchJob.failed
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({counter: counter + 1})
+        db.refresh(qa_record)
+        return self.qa_service._record_to_dict(qa_record)
+
+    def _fail_item(self, db, job_id: str, item_id: int, error_message: str) -> None:
+        db.query(BatchJobItem).filter(BatchJobItem.id == item_id).update({
+            BatchJobItem.status: "error",
+            BatchJobItem.error_message: error_message,
+            BatchJobItem.completed_at: datetime.utcnow(),
+        })
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({BatchJob.failed: BatchJob.failed + 1})
@@ -0,0 +1,78 @@
+"""并发压测：在不同并发用户数下调用问答接口，统计吞吐量与延迟。
+
+用法：
+    python benchmarks/concurrency_bench.py --base-url http://127.0.0.1:8000 --levels 1,4,16 --requests 32
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+
+
+async def _worker(client: httpx.AsyncClient, url: str, payload: dict, queue: asyncio.Queue, latencies: List[float], errors: List[str]):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        try:
+            resp = await client.post(url, json=payload)
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(str(e))
+
+
+async def run_level(base_url: str, path: str, question: str, concurrency: int, total: int) -> Dict[str, float]:
+    """以指定并发数发送total个请求"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    latencies: List[float] = []
+    errors: List[str] = []
+    payload = {"question": question}
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            _worker(client, path, payload, queue, latencies, errors) for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_p50_s": round(statistics.median(latencies), 3) if latencies else None,
+        "latency_p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="问答接口并发吞吐量测试")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/qa/ask")
+    parser.add_argument("--question", default="征收补偿标准是什么？")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="逗号分隔的并发用户数")
+    parser.add_argument("--requests", type=int, default=32, help="每个并发级别的请求总数")
+    parser.add_argument("--output", default="", help="结果JSON输出路径（可选）")
+    args = parser.parse_args()
+
+    results = []
+    for level in [int(x) for x in args.levels.split(",") if x.strip()]:
+        res = asyncio.run(run_level(args.base_url, args.path, args.question, level, args.requests))
+        print(f"并发={res['concurrency']:>3}  吞吐={res['throughput_rps']:>8} req/s  p50={res['latency_p50_s']}s  p95={res['latency_p95_s']}s  错误={res['errors']}")
+        results.append(res)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""离线端到端基准测试：启动本地上游替身与应用，测量PDF导入吞吐、问答与流式问答延迟分位数、
+并发下的首token耗时以及服务进程内存，结果写入JSON便于在不同提交之间对比。
+
+用法：
+    python benchmarks/e2e_bench.py --output bench.json
+    python benchmarks/e2e_bench.py --output bench.json --baseline bench_main.json --tolerance 0.2
+    python benchmarks/e2e_bench.py --embedding-provider ollama --latency-ms 500 --token-rate 30
+
+不需要真实的LLM、embedding服务或Milvus：应用以VECTOR_STORE=memory启动，
+数据库为临时SQLite文件。指定--baseline时，任一指标劣化超过容差即以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PROVIDERS = os.path.join(REPO_ROOT, "benchmarks", "fake_providers.py")
+
+
+def build_pdf(lines_per_page: List[List[str]]) -> bytes:
+    """手工生成仅含Helvetica文本的最小PDF（不依赖第三方库）"""
+    def escape(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects: List[bytes] = []
+    page_count = len(lines_per_page)
+    # 1: Catalog, 2: Pages, 3: Font，之后每页依次为Page与内容流
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(page_count))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, lines in enumerate(lines_per_page):
+        ops = ["BT", "/F1 10 Tf", "14 TL", "50 800 Td"]
+        for line in lines:
+            ops.append(f"({escape(line)}) Tj T*")
+        ops.append("ET")
+        content = "\n".join(ops).encode("latin-1")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_policy_pdf(articles: int, lines_per_page: int = 50) -> bytes:
+    """生成articles条"Article N"条款组成的政策文档"""
+    lines: List[str] = []
+    for n in range(1, articles + 1):
+        lines.append(f"Article {n} Compensation standard for zone {n % 17} households.")
+        lines.append(f"The subsidy for category {n % 5} is {1000 + 37 * n} yuan per square meter,")
+        lines.append(f"paid within {10 + n % 20} working days after the agreement is signed.")
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    return build_pdf(pages)
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    return {"p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+def read_rss_bytes(pid: int) -> Optional[int]:
+    """读取进程常驻内存（优先psutil，其次Linux /proc）"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler:
+    """后台线程定期采样服务进程内存，记录各阶段的峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self.phase = "startup"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = read_rss_bytes(self.pid)
+            if rss is not None:
+                self.samples[self.phase] = max(self.samples.get(self.phase, 0), rss)
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop.set()
+        self._thread.join()
+        current = read_rss_bytes(self.pid)
+        peaks = {phase: round(v / 1024 / 1024, 1) for phase, v in self.samples.items()}
+        return {
+            "peak_rss_mb": max(peaks.values()) if peaks else None,
+            "peak_rss_mb_by_phase": peaks,
+            "final_rss_mb": round(current / 1024 / 1024, 1) if current else None,
+        }
+
+
+async def bench_ingest(client: httpx.AsyncClient, articles: int) -> Dict[str, Any]:
+    pdf = make_policy_pdf(articles)
+    start = time.perf_counter()
+    resp = await client.post(
+        "/knowledge/import-pdf",
+        files={"file": ("bench_policy.pdf", pdf, "application/pdf")},
+        data={"category": "基准测试", "regex": r"Article \d+", "max_chunk_chars": "1000"},
+    )
+    elapsed = time.perf_counter() - start
+    resp.raise_for_status()
+    chunks = resp.json()["chunks_imported"]
+    return {
+        "articles": articles,
+        "pdf_bytes": len(pdf),
+        "chunks_imported": chunks,
+        "elapsed_s": round(elapsed, 3),
+        "chunks_per_s": round(chunks / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+async def _run_concurrent(concurrency: int, total: int, fn) -> float:
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await fn(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start
+
+
+def _question(i: int) -> str:
+    # 每个请求问题不同，避免命中答案缓存与并发合并
+    return f"What is the subsidy for category {i % 5} in zone {i % 17}, case {i}?"
+
+
+async def bench_ask(client: httpx.AsyncClient, concurrency: int, total: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def one(i: int):
+        start = time.perf_counter()
+        try:
+            resp = await client.post("/qa/ask", json={"question": _question(i)})
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(str(e))
+
+    elapsed = await _run_concurrent(concurrency, total, one)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "latency": percentiles(latencies),
+    }
+
+
+async def bench_stream(client: httpx.AsyncClient, concurrency: int, total: int) -> Dict[str, Any]:
+    ttfts: List[float] = []
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def one(i: int):
+        start = time.perf_counter()
+        first = None
+        try:
+            async with client.stream("POST", "/qa/ask-stream", json={"question": _question(i + 100000)}) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if first is None and line and json.loads(line).get("type") == "delta":
+                        first = time.perf_counter() - start
+            if first is not None:
+                ttfts.append(first)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(str(e))
+
+    elapsed = await _run_concurrent(concurrency, total, one)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "ttft": percentiles(ttfts),
+        "latency": percentiles(latencies),
+    }
+
+
+async def run_suite(base_url: str, args, sampler: RSSSampler) -> Dict[str, Any]:
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    limits = httpx.Limits(max_connections=max(levels) * 2, max_keepalive_connections=max(levels) * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0, limits=limits) as client:
+        sampler.phase = "ingest"
+        ingest = await bench_ingest(client, args.pdf_articles)
+        print(f"导入：{ingest['chunks_imported']}段 用时{ingest['elapsed_s']}s（{ingest['chunks_per_s']}段/s）")
+        ask, stream = [], []
+        for level in levels:
+            sampler.phase = f"ask_c{level}"
+            res = await bench_ask(client, level, args.requests)
+            print(f"问答   并发={level:>3}  p50={res['latency']['p50_ms']}ms  p99={res['latency']['p99_ms']}ms  错误={res['errors']}")
+            ask.append(res)
+        for level in levels:
+            sampler.phase = f"stream_c{level}"
+            res = await bench_stream(client, level, args.requests)
+            print(f"流式   并发={level:>3}  TTFT p50={res['ttft']['p50_ms']}ms  p99={res['ttft']['p99_ms']}ms  总耗时p50={res['latency']['p50_ms']}ms  错误={res['errors']}")
+            stream.append(res)
+        metrics = (await client.get("/stats")).json()
+    return {"ingest": ingest, "ask": ask, "stream": stream, "server_stats": metrics}
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线结果对比，返回劣化超过容差的指标说明"""
+    regressions: List[str] = []
+
+    def check(name: str, new: Optional[float], old: Optional[float], higher_is_better: bool = False):
+        if new is None or old is None or old == 0:
+            return
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{name}: {old} -> {new} ({change:+.1%})")
+
+    check("ingest.chunks_per_s", result["ingest"]["chunks_per_s"], baseline.get("ingest", {}).get("chunks_per_s"), higher_is_better=True)
+    for kind, fields in (("ask", ("latency",)), ("stream", ("ttft", "latency"))):
+        old_levels = {r["concurrency"]: r for r in baseline.get(kind, [])}
+        for res in result[kind]:
+            old = old_levels.get(res["concurrency"])
+            if not old:
+                continue
+            for field in fields:
+                for q in ("p50_ms", "p99_ms"):
+                    check(f"{kind}.c{res['concurrency']}.{field}.{q}", res[field][q], old.get(field, {}).get(q))
+    check("memory.peak_rss_mb", result["memory"]["peak_rss_mb"], baseline.get("memory", {}).get("peak_rss_mb"))
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def add_offline_args(parser: argparse.ArgumentParser) -> None:
+    """本地上游替身与应用的启动参数（e2e_bench与loadgen共用）"""
+    parser.add_argument("--embedding-provider", choices=["openai", "ollama"], default="openai")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="上游首token延迟")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="上游每秒生成token数")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="额外传给应用的环境变量")
+
+
+@contextmanager
+def offline_stack(args) -> Iterator[Tuple[str, subprocess.Popen]]:
+    """启动上游替身与应用（VECTOR_STORE=memory、临时SQLite），产出(应用base_url, 应用进程)，退出时全部关闭"""
+    provider_args = [
+        "--latency-ms", str(args.latency_ms),
+        "--token-rate", str(args.token_rate),
+        "--answer-tokens", str(args.answer_tokens),
+        "--embedding-latency-ms", str(args.embedding_latency_ms),
+    ]
+    procs: List[subprocess.Popen] = []
+    workdir = tempfile.mkdtemp(prefix="knowhub-bench-")
+    try:
+        openai_port = free_port()
+        procs.append(subprocess.Popen([sys.executable, FAKE_PROVIDERS, "--flavor", "openai", "--port", str(openai_port), *provider_args]))
+        wait_ready(f"http://127.0.0.1:{openai_port}/health")
+        openai_url = f"http://127.0.0.1:{openai_port}/v1"
+        embedding_url = openai_url
+        if args.embedding_provider == "ollama":
+            ollama_port = free_port()
+            procs.append(subprocess.Popen([sys.executable, FAKE_PROVIDERS, "--flavor", "ollama", "--port", str(ollama_port), *provider_args]))
+            wait_ready(f"http://127.0.0.1:{ollama_port}/health")
+            embedding_url = f"http://127.0.0.1:{ollama_port}/ollama/api"
+
+        app_port = free_port()
+        env = dict(
+            os.environ,
+            BASE_URL=openai_url,
+            API_KEY="bench",
+            MODEL_NAME="fake-chat",
+            EMBEDDING_BASE_URL=embedding_url,
+            EMBEDDING_API_KEY="bench",
+            EMBEDDING_MODEL="fake-embedding",
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            VECTOR_STORE="memory",
+            ANSWER_CACHE_ENABLED="false",
+            COALESCE_REQUESTS="false",
+            LLM_ENDPOINTS="",
+            LOG_LEVEL="WARNING",
+        )
+        for item in args.app_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning"],
+            cwd=workdir, env=dict(env, PYTHONPATH=REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")),
+        )
+        procs.append(app)
+        base_url = f"http://127.0.0.1:{app_port}"
+        wait_ready(f"{base_url}/stats")
+        yield base_url, app
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="用于对比的历史结果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的劣化比例（默认20%%）")
+    parser.add_argument("--levels", default="1,8,32", help="逗号分隔的并发数")
+    parser.add_argument("--requests", type=int, default=64, help="每个并发级别的请求数")
+    parser.add_argument("--pdf-articles", type=int, default=200, help="导入PDF的条款数")
+    add_offline_args(parser)
+    args = parser.parse_args()
+
+    with offline_stack(args) as (base_url, app):
+        sampler = RSSSampler(app.pid)
+        sampler.start()
+        suite = asyncio.run(run_suite(base_url, args, sampler))
+        memory = sampler.stop()
+    print(f"内存：峰值{memory['peak_rss_mb']}MB，结束时{memory['final_rss_mb']}MB")
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        **suite,
+        "memory": memory,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("settings") != result["meta"]["settings"]:
+            print("注意：基线与本次的测试参数不同，对比结果仅供参考")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"相对基线（{baseline.get('meta', {}).get('commit')}）劣化超过{args.tolerance:.0%}：")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("与基线相比未发现超出容差的劣化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""基准测试用的本地上游替身：OpenAI兼容的chat + embeddings服务，以及Ollama embedding服务。
+
+延迟与生成速度可配置，embedding按字符二元组哈希生成（相同文本得到相同向量，
+字面相近的文本相似度更高），不依赖任何外部服务。
+
+用法：
+    python benchmarks/fake_providers.py --flavor openai --port 9901 --latency-ms 300 --token-rate 50
+    python benchmarks/fake_providers.py --flavor ollama --port 9902 --embedding-latency-ms 20
+
+OpenAI替身的base_url为 http://127.0.0.1:<port>/v1；
+Ollama替身的base_url为 http://127.0.0.1:<port>/ollama/api（路径中含ollama以便按Ollama协议调用）。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class FakeSettings:
+    # 首token（非流式为整个响应）前的延迟
+    latency_ms: float = 300.0
+    # 首token之后每秒生成的token数
+    token_rate: float = 50.0
+    # 每个答案的token数
+    answer_tokens: int = 60
+    # embedding请求的固定延迟与每条输入的额外延迟
+    embedding_latency_ms: float = 20.0
+    embedding_per_item_ms: float = 0.5
+    embedding_dim: int = 256
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """按字符二元组哈希到固定维度并归一化"""
+    vector = np.zeros(dim, dtype=np.float32)
+    text = text or " "
+    for i in range(max(1, len(text) - 1)):
+        digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest, "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+
+def _answer_tokens(n: int) -> List[str]:
+    words = ["根据", "背景", "信息", "，", "补偿", "标准", "按照", "相关", "规定", "执行", "。"]
+    return [words[i % len(words)] for i in range(n)]
+
+
+async def _embedding_delay(settings: FakeSettings, count: int) -> None:
+    await asyncio.sleep((settings.embedding_latency_ms + settings.embedding_per_item_ms * count) / 1000)
+
+
+def create_openai_app(settings: FakeSettings) -> FastAPI:
+    app = FastAPI(title="fake-openai")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        await _embedding_delay(settings, len(inputs))
+        return {
+            "object": "list",
+            "model": body.get("model", "fake-embedding"),
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t, settings.embedding_dim)} for i, t in enumerate(inputs)],
+            "usage": {"prompt_tokens": sum(len(t) for t in inputs), "total_tokens": sum(len(t) for t in inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-chat")
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 2
+        tokens = _answer_tokens(min(settings.answer_tokens, int(body.get("max_tokens") or settings.answer_tokens)))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(settings.latency_ms / 1000 + len(tokens) / settings.token_rate)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(delta, finish_reason=None, with_usage=False):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if with_usage:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(settings.latency_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(1 / settings.token_rate)
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, with_usage=True)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def create_ollama_app(settings: FakeSettings) -> FastAPI:
+    app = FastAPI(title="fake-ollama")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    async def embeddings(request: Request):
+        body = await request.json()
+        await _embedding_delay(settings, 1)
+        return {"embedding": fake_embedding(body.get("prompt", ""), settings.embedding_dim)}
+
+    async def embed(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        await _embedding_delay(settings, len(inputs))
+        return {"model": body.get("model"), "embeddings": [fake_embedding(t, settings.embedding_dim) for t in inputs]}
+
+    for prefix in ("/api", "/ollama/api"):
+        app.add_api_route(f"{prefix}/embeddings", embeddings, methods=["POST"])
+        app.add_api_route(f"{prefix}/embed", embed, methods=["POST"])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地上游替身（OpenAI / Ollama）")
+    parser.add_argument("--flavor", choices=["openai", "ollama"], default="openai")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9901)
+    parser.add_argument("--latency-ms", type=float, default=FakeSettings.latency_ms)
+    parser.add_argument("--token-rate", type=float, default=FakeSettings.token_rate)
+    parser.add_argument("--answer-tokens", type=int, default=FakeSettings.answer_tokens)
+    parser.add_argument("--embedding-latency-ms", type=float, default=FakeSettings.embedding_latency_ms)
+    parser.add_argument("--embedding-per-item-ms", type=float, default=FakeSettings.embedding_per_item_ms)
+    parser.add_argument("--embedding-dim", type=int, default=FakeSettings.embedding_dim)
+    args = parser.parse_args()
+
+    settings = FakeSettings(
+        latency_ms=args.latency_ms,
+        token_rate=args.token_rate,
+        answer_tokens=args.answer_tokens,
+        embedding_latency_ms=args.embedding_latency_ms,
+        embedding_per_item_ms=args.embedding_per_item_ms,
+        embedding_dim=args.embedding_dim,
+    )
+    app = create_openai_app(settings) if args.flavor == "openai" else create_ollama_app(settings)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""负载生成：按真实问题分布向问答服务发送混合流量，用于容量评估。
+
+流量由"会话"组成：每个会话按 --mix 比例选择一种操作——
+ask / stream 为多轮对话（轮数取自 --turns，多于一轮时先 POST /sessions 取得session_id，
+轮与轮之间有思考时间），import 为上传一份小PDF，sessions 为分页列出会话。
+
+两种负载模式：
+- 闭环：--concurrency N 个虚拟用户各自连续发起会话
+- 开环：--rate R 按泊松过程每秒到达R个会话，与服务响应快慢无关（--max-inflight 限制在途会话数）
+
+用法：
+    python benchmarks/loadgen.py --base-url http://127.0.0.1:8000 --concurrency 16 --duration 60
+    python benchmarks/loadgen.py --rate 5 --duration 120 --questions questions.txt --turns 1-3
+    python benchmarks/loadgen.py --rate 5 --from-db sqlite:///./knowledge_qa.db   # 按问答记录中的问题频次抽样
+    python benchmarks/loadgen.py --offline --rate 10 --duration 30 --latency-ms 800   # 使用本地上游替身
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from e2e_bench import add_offline_args, make_policy_pdf, offline_stack, percentiles
+
+OPS = ("ask", "stream", "import", "sessions")
+
+DEFAULT_QUESTIONS = [
+    "征收补偿标准是什么？",
+    "安置房面积如何确定？",
+    "过渡期租金怎么计算？",
+    "产权调换和货币补偿有什么区别？",
+    "签约奖励的条件是什么？",
+    "评估机构如何选定？",
+]
+
+
+class OpStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.errors: Counter = Counter()
+        self.requests = 0
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        failed = sum(self.errors.values())
+        out = {
+            "requests": self.requests,
+            "errors": failed,
+            "error_rate": round(failed / self.requests, 4) if self.requests else 0.0,
+            "errors_by_kind": dict(self.errors),
+            "throughput_rps": round(len(self.latencies) / elapsed, 3) if elapsed > 0 else None,
+            "latency": percentiles(self.latencies),
+        }
+        if self.ttfts:
+            out["ttft"] = percentiles(self.ttfts)
+        return out
+
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, questions: List[str], weights: List[float], mix: Dict[str, float],
+                 turns: Tuple[int, int], think_time_ms: float, import_articles: int, seed: Optional[int] = None):
+        self.client = client
+        self.questions = questions
+        self.weights = weights
+        self.mix = mix
+        self.turns = turns
+        self.think_time_ms = think_time_ms
+        self.pdf = make_policy_pdf(import_articles)
+        self.rng = random.Random(seed)
+        self.stats: Dict[str, OpStats] = {op: OpStats() for op in OPS + ("create_session",)}
+        # 预热期间发出的请求不计入统计
+        self.recording = False
+
+    def _record(self, op: str, started: float, error: Optional[str] = None, ttft: Optional[float] = None) -> None:
+        if not self.recording:
+            return
+        stats = self.stats[op]
+        stats.requests += 1
+        if error:
+            stats.errors[error] += 1
+            return
+        stats.latencies.append(time.perf_counter() - started)
+        if ttft is not None:
+            stats.ttfts.append(ttft)
+
+    @staticmethod
+    def _error_kind(exc: Exception) -> str:
+        if isinstance(exc, httpx.HTTPStatusError):
+            return f"http_{exc.response.status_code}"
+        return type(exc).__name__
+
+    def _question(self) -> str:
+        return self.rng.choices(self.questions, weights=self.weights)[0]
+
+    async def conversation(self) -> None:
+        op = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if op == "import":
+            await self._import()
+        elif op == "sessions":
+            await self._list_sessions()
+        else:
+            turns = self.rng.randint(*self.turns)
+            session_id = await self._create_session() if turns > 1 else None
+            if turns > 1 and session_id is None:
+                return
+            for turn in range(turns):
+                if turn:
+                    await asyncio.sleep(self.rng.expovariate(1000 / self.think_time_ms) if self.think_time_ms > 0 else 0)
+                if not await (self._stream if op == "stream" else self._ask)(self._question(), session_id):
+                    return
+
+    async def _create_session(self) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            resp = await self.client.post("/sessions")
+            resp.raise_for_status()
+            self._record("create_session", started)
+            return resp.json()["session_id"]
+        except Exception as e:
+            self._record("create_session", started, error=self._error_kind(e))
+            return None
+
+    async def _ask(self, question: str, session_id: Optional[str]) -> bool:
+        started = time.perf_counter()
+        try:
+            resp = await self.client.post("/qa/ask", json={"question": question, "session_id": session_id})
+            resp.raise_for_status()
+            self._record("ask", started)
+            return True
+        except Exception as e:
+            self._record("ask", started, error=self._error_kind(e))
+            return False
+
+    async def _stream(self, question: str, session_id: Optional[str]) -> bool:
+        started = time.perf_counter()
+        ttft = None
+        try:
+            async with self.client.stream("POST", "/qa/ask-stream", json={"question": question, "session_id": session_id}) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if ttft is None and line and json.loads(line).get("type") == "delta":
+                        ttft = time.perf_counter() - started
+            self._record("stream", started, ttft=ttft)
+            return True
+        except Exception as e:
+            self._record("stream", started, error=self._error_kind(e))
+            return False
+
+    async def _import(self) -> None:
+        started = time.perf_counter()
+        try:
+            resp = await self.client.post(
+                "/knowledge/import-pdf",
+                files={"file": ("loadgen.pdf", self.pdf, "application/pdf")},
+                data={"category": "负载测试", "regex": r"Article \d+"},
+            )
+            resp.raise_for_status()
+            self._record("import", started)
+        except Exception as e:
+            self._record("import", started, error=self._error_kind(e))
+
+    async def _list_sessions(self) -> None:
+        started = time.perf_counter()
+        try:
+            resp = await self.client.get("/sessions", params={"limit": 20})
+            resp.raise_for_status()
+            self._record("sessions", started)
+        except Exception as e:
+            self._record("sessions", started, error=self._error_kind(e))
+
+
+async def run_closed(gen: LoadGenerator, concurrency: int, deadline: float) -> Dict[str, Any]:
+    async def user():
+        while time.monotonic() < deadline:
+            await gen.conversation()
+
+    await asyncio.gather(*[user() for _ in range(concurrency)])
+    return {}
+
+
+async def run_open(gen: LoadGenerator, rate: float, deadline: float, max_inflight: int, drain_timeout: float) -> Dict[str, Any]:
+    inflight: set = set()
+    arrivals = 0
+    dropped = 0
+    next_arrival = time.monotonic()
+    while True:
+        next_arrival += gen.rng.expovariate(rate)
+        if next_arrival >= deadline:
+            break
+        await asyncio.sleep(max(0.0, next_arrival - time.monotonic()))
+        arrivals += 1
+        if len(inflight) >= max_inflight:
+            # 在途会话已达上限：记为丢弃，不再排队（保持开环特性）
+            dropped += 1
+            continue
+        task = asyncio.ensure_future(gen.conversation())
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    if inflight:
+        _, pending = await asyncio.wait(inflight, timeout=drain_timeout)
+        for task in pending:
+            task.cancel()
+    return {"arrivals": arrivals, "dropped": dropped, "offered_rate": rate}
+
+
+def load_questions(path: Optional[str], db_url: Optional[str], limit: int) -> Tuple[List[str], List[float]]:
+    """问题及其抽样权重：文件中每行（或JSON数组每项）权重为1；数据库中按问题出现次数加权"""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                questions = [str(q) for q in json.load(f)]
+            else:
+                questions = [line.strip() for line in f if line.strip()]
+        return questions, [1.0] * len(questions)
+    if db_url:
+        from sqlalchemy import create_engine, text
+        engine = create_engine(db_url)
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT question, COUNT(*) AS n FROM qa_records "
+                "WHERE question IS NOT NULL AND question NOT LIKE '[图片问答]%' "
+                "GROUP BY question ORDER BY n DESC LIMIT :limit"
+            ), {"limit": limit}).all()
+        engine.dispose()
+        if rows:
+            return [r[0] for r in rows], [float(r[1]) for r in rows]
+        print("问答记录为空，使用内置问题", file=sys.stderr)
+    return list(DEFAULT_QUESTIONS), [1.0] * len(DEFAULT_QUESTIONS)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPS:
+            raise SystemExit(f"未知的操作类型: {name}（可选：{', '.join(OPS)}）")
+        mix[name] = float(weight or 1)
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n时长 {report['elapsed_s']}s  总请求 {report['total']['requests']}  吞吐 {report['total']['throughput_rps']} req/s  错误率 {report['total']['error_rate']:.2%}")
+    if report.get("open_loop"):
+        ol = report["open_loop"]
+        print(f"开环：到达 {ol['arrivals']} 个会话（{ol['offered_rate']}/s），因在途上限丢弃 {ol['dropped']} 个")
+    header = f"{'op':<16}{'req':>7}{'err%':>8}{'rps':>9}{'p50ms':>10}{'p90ms':>10}{'p99ms':>10}{'ttft50':>9}{'ttft99':>9}"
+    print(header)
+    print("-" * len(header))
+    for op, s in report["ops"].items():
+        if not s["requests"]:
+            continue
+        ttft = s.get("ttft", {})
+        print(
+            f"{op:<16}{s['requests']:>7}{s['error_rate'] * 100:>7.1f}%{s['throughput_rps']:>9}"
+            f"{str(s['latency']['p50_ms']):>10}{str(s['latency']['p90_ms']):>10}{str(s['latency']['p99_ms']):>10}"
+            f"{str(ttft.get('p50_ms', '-')):>9}{str(ttft.get('p99_ms', '-')):>9}"
+        )
+        if s["errors_by_kind"]:
+            print(f"{'':<16}错误：{s['errors_by_kind']}")
+
+
+async def run(base_url: str, args) -> Dict[str, Any]:
+    questions, weights = load_questions(args.questions, args.from_db, args.db_limit)
+    low, _, high = args.turns.partition("-")
+    turns = (int(low), int(high or low))
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        gen = LoadGenerator(client, questions, weights, parse_mix(args.mix), turns, args.think_time_ms, args.import_articles, args.seed)
+        if args.warmup > 0:
+            warmup_deadline = time.monotonic() + args.warmup
+            if args.rate:
+                await run_open(gen, args.rate, warmup_deadline, args.max_inflight, args.drain_timeout)
+            else:
+                await run_closed(gen, args.concurrency, warmup_deadline)
+        gen.recording = True
+        started = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        if args.rate:
+            open_loop = await run_open(gen, args.rate, deadline, args.max_inflight, args.drain_timeout)
+        else:
+            open_loop = await run_closed(gen, args.concurrency, deadline)
+        elapsed = time.perf_counter() - started
+
+    ops = {op: s.summary(elapsed) for op, s in gen.stats.items()}
+    total_requests = sum(s.requests for s in gen.stats.values())
+    total_errors = sum(sum(s.errors.values()) for s in gen.stats.values())
+    total_ok = sum(len(s.latencies) for s in gen.stats.values())
+    return {
+        "base_url": base_url,
+        "mode": "open" if args.rate else "closed",
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "question_pool": len(questions),
+        "elapsed_s": round(elapsed, 2),
+        "total": {
+            "requests": total_requests,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+            "throughput_rps": round(total_ok / elapsed, 3) if elapsed > 0 else None,
+        },
+        "open_loop": open_loop or None,
+        "ops": ops,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="问答服务混合流量负载生成")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--offline", action="store_true", help="启动本地上游替身与应用后对其施压（忽略--base-url）")
+    parser.add_argument("--duration", type=float, default=60.0, help="统计时长（秒）")
+    parser.add_argument("--warmup", type=float, default=0.0, help="预热时长（秒），期间的请求不计入统计")
+    parser.add_argument("--concurrency", type=int, default=8, help="闭环模式的虚拟用户数")
+    parser.add_argument("--rate", type=float, default=0.0, help="开环模式每秒到达的会话数（>0时启用开环）")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="开环模式的最大在途会话数")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="结束后等待在途会话完成的最长时间")
+    parser.add_argument("--mix", default="ask=0.45,stream=0.45,sessions=0.08,import=0.02", help="操作比例")
+    parser.add_argument("--turns", default="1-3", help="每个问答会话的轮数范围，如1-3")
+    parser.add_argument("--think-time-ms", type=float, default=1000.0, help="多轮会话中轮间平均思考时间")
+    parser.add_argument("--questions", help="问题文件（每行一个，或JSON数组）")
+    parser.add_argument("--from-db", metavar="DATABASE_URL", help="从qa_records按问题频次抽样")
+    parser.add_argument("--db-limit", type=int, default=1000, help="从数据库读取的不同问题数上限")
+    parser.add_argument("--import-articles", type=int, default=5, help="import操作上传PDF的条款数")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--max-connections", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="", help="结果JSON输出路径（可选）")
+    add_offline_args(parser)
+    args = parser.parse_args()
+
+    if args.offline:
+        with offline_stack(args) as (base_url, _):
+            report = asyncio.run(run(base_url, args))
+    else:
+        report = asyncio.run(run(args.base_url, args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
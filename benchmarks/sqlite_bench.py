@@ -0,0 +1,206 @@
+"""SQLite并发写入基准：对比默认设置、WAL参数与WAL+串行写入器在并发问答写入下的吞吐、延迟与锁错误。
+
+每次"问答轮次"写入一条问答记录（含约2KB的process_log）、两条会话消息并更新会话目录，
+与线上每轮问答的写入量一致；同时有若干读线程持续分页查询会话列表。
+
+三种模式：
+- default：原有配置（rollback日志、synchronous=FULL），每个写线程各自提交
+- wal：WAL、synchronous=NORMAL、页缓存/mmap与busy_timeout，每个写线程各自提交
+- wal+writer：WAL参数 + 串行写入器（单线程组提交）
+
+用法：
+    python benchmarks/sqlite_bench.py --writers 32 --turns 50 --readers 4
+    python benchmarks/sqlite_bench.py --modes default,wal+writer --output sqlite_bench.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import create_db_engine  # noqa: E402
+from db_writer import DBWriter  # noqa: E402
+from e2e_bench import percentiles  # noqa: E402
+from models import Base, ChatMessageRecord, ChatSession, QARecord  # noqa: E402
+
+MODES = ("default", "wal", "wal+writer")
+
+PROCESS_LOG = {
+    "model": "bench-model",
+    "status": "success",
+    "retrieval": {"mode": "vector", "hits": [{"id": i, "similarity": 0.8 - i * 0.01} for i in range(10)]},
+    "context": {"included": list(range(5)), "tokens": 1500},
+    "timings": {"spans_ms": {stage: 12.5 for stage in ("embedding", "vector_search", "db_fetch", "context", "llm")}},
+    "padding": "x" * 1500,
+}
+
+
+def write_turn(db, writer_id: int, turn: int) -> int:
+    """一轮问答的写入：问答记录 + 两条会话消息 + 会话目录"""
+    session_id = f"bench-{writer_id}"
+    record = QARecord(question=f"问题{writer_id}-{turn}", answer="答案" * 100, model_used="bench-model", process_log=PROCESS_LOG)
+    db.add(record)
+    db.add_all([
+        ChatMessageRecord(session_id=session_id, message=json.dumps({"type": "human", "data": {"content": record.question}}, ensure_ascii=False)),
+        ChatMessageRecord(session_id=session_id, message=json.dumps({"type": "ai", "data": {"content": record.answer}}, ensure_ascii=False)),
+    ])
+    now = datetime.utcnow()
+    row = db.get(ChatSession, session_id)
+    if row is None:
+        row = ChatSession(session_id=session_id, created_at=now, message_count=0, title=record.question)
+        db.add(row)
+    row.last_active_at = now
+    row.message_count = (row.message_count or 0) + 2
+    db.flush()
+    return record.id
+
+
+def make_engine(mode: str, path: str):
+    url = f"sqlite:///{path}"
+    if mode == "default":
+        # 与调整前的database.py一致
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_db_engine(url, tuned=True)
+
+
+def run_mode(mode: str, args, workdir: str) -> Dict[str, Any]:
+    path = os.path.join(workdir, f"{mode.replace('+', '_')}.db")
+    engine = make_engine(mode, path)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    writer = None
+    if mode == "wal+writer":
+        writer = DBWriter(sessionmaker(bind=engine, autoflush=False, expire_on_commit=False),
+                          serialized=True, max_batch=args.batch_max, immediate=True)
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    read_latencies: List[float] = []
+    lock = threading.Lock()
+    stop_readers = threading.Event()
+
+    def direct_write(writer_id: int, turn: int) -> None:
+        db = Session()
+        try:
+            write_turn(db, writer_id, turn)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def writer_loop(writer_id: int) -> None:
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            try:
+                if writer is not None:
+                    writer.call(write_turn, writer_id, turn)
+                else:
+                    direct_write(writer_id, turn)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                kind = "database is locked" if "locked" in str(e) else type(e).__name__
+                with lock:
+                    errors[kind] = errors.get(kind, 0) + 1
+
+    def reader_loop() -> None:
+        while not stop_readers.is_set():
+            start = time.perf_counter()
+            db = Session()
+            try:
+                db.execute(select(ChatSession).order_by(ChatSession.last_active_at.desc()).limit(50)).all()
+                db.execute(select(QARecord.id, QARecord.question).order_by(QARecord.id.desc()).limit(20)).all()
+                with lock:
+                    read_latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                kind = "read: " + ("database is locked" if "locked" in str(e) else type(e).__name__)
+                with lock:
+                    errors[kind] = errors.get(kind, 0) + 1
+            finally:
+                db.close()
+            time.sleep(args.read_interval_ms / 1000)
+
+    readers = [threading.Thread(target=reader_loop, daemon=True) for _ in range(args.readers)]
+    for t in readers:
+        t.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.writers) as pool:
+        list(pool.map(writer_loop, range(args.writers)))
+    elapsed = time.perf_counter() - started
+    stop_readers.set()
+    for t in readers:
+        t.join()
+    if writer is not None:
+        writer.close()
+    engine.dispose()
+
+    total = args.writers * args.turns
+    return {
+        "mode": mode,
+        "turns": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_second": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "write_latency": percentiles(latencies),
+        "read_latency": percentiles(read_latencies),
+        "reads": len(read_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite并发写入基准")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--writers", type=int, default=32, help="并发写线程数（模拟并发用户）")
+    parser.add_argument("--turns", type=int, default=50, help="每个写线程写入的问答轮次数")
+    parser.add_argument("--readers", type=int, default=4, help="并发读线程数")
+    parser.add_argument("--read-interval-ms", type=float, default=5.0)
+    parser.add_argument("--batch-max", type=int, default=128, help="串行写入器每次提交合并的最大写操作数")
+    parser.add_argument("--dir", default="", help="数据库文件目录（默认临时目录；fsync开销取决于所在磁盘）")
+    parser.add_argument("--output", default="", help="结果JSON输出路径（可选）")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            raise SystemExit(f"未知模式: {mode}（可选：{', '.join(MODES)}）")
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="knowhub-sqlite-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = []
+        for mode in modes:
+            result = run_mode(mode, args, workdir)
+            results.append(result)
+            print(
+                f"{mode:<12} {result['turns_per_second']:>8} 轮/s  写入p50 {result['write_latency']['p50_ms']}ms "
+                f"p99 {result['write_latency']['p99_ms']}ms  读取p99 {result['read_latency']['p99_ms']}ms  "
+                f"成功 {result['ok']}/{result['turns']}  错误 {result['errors'] or '-'}"
+            )
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
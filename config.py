@@ -2,8 +2,6 @@ import os
 from typing import Optional
 import logging
 
-# 配置日志
-logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
 class Config:
@@ -12,21 +10,154 @@ class Config:
     API_KEY: str = os.getenv("API_KEY", "")
     MODEL_NAME: str = os.getenv("MODEL_NAME", "deepseek/deepseek-r1")
     IMAGE_MODEL_NAME: str = os.getenv("IMAGE_MODEL_NAME", "gpt-4o-mini")
-    
+    # 图片问答预处理：最长边像素、压缩后的体积目标（字节）与按内容哈希缓存的图片数（需安装Pillow才会缩放压缩）
+    IMAGE_MAX_EDGE: int = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+    IMAGE_TARGET_BYTES: int = int(os.getenv("IMAGE_TARGET_BYTES", "400000"))
+    IMAGE_CACHE_ENTRIES: int = int(os.getenv("IMAGE_CACHE_ENTRIES", "64"))
+
+    # 多端点LLM路由：LLM_ENDPOINTS为JSON数组，如
+    # [{"name": "a", "base_url": "...", "api_key": "...", "model": "..."}]，为空时仅使用BASE_URL/MODEL_NAME；
+    # 流式调用首token超过LLM_HEDGE_TTFT_MS（0表示不对冲）时向下一个端点发起对冲请求
+    LLM_ENDPOINTS: str = os.getenv("LLM_ENDPOINTS", "")
+    LLM_HEALTH_WINDOW: int = int(os.getenv("LLM_HEALTH_WINDOW", "50"))
+    LLM_HEDGE_TTFT_MS: int = int(os.getenv("LLM_HEDGE_TTFT_MS", "3000"))
+    LLM_BREAKER_FAILURES: int = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+    LLM_BREAKER_COOLDOWN_SECONDS: float = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
     # Embedding模型配置
     EMBEDDING_BASE_URL: str = os.getenv("EMBEDDING_BASE_URL", "https://api.openai.com/v1")
     EMBEDDING_API_KEY: str = os.getenv("EMBEDDING_API_KEY", "")
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "bge-m3:latest")
+    # 批量embedding时每次上游调用的最大条数
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
     
     # 数据库配置
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./knowledge_qa.db")
 
+    # SQLite参数：日志模式、同步级别、页缓存（KB）、内存映射大小（字节）与锁等待超时（毫秒）
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", "268435456"))
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    # 串行写入：问答记录、反馈、会话消息等高频写操作由单个写线程执行并合并提交（auto：仅SQLite启用 / true / false），
+    # 以及每次提交合并的最大写操作数与凑批的最长等待（毫秒，0表示只合并已排队的写操作）
+    DB_SERIALIZED_WRITES: str = os.getenv("DB_SERIALIZED_WRITES", "auto").lower()
+    DB_WRITE_BATCH_MAX: int = int(os.getenv("DB_WRITE_BATCH_MAX", "128"))
+    DB_WRITE_BATCH_WAIT_MS: float = float(os.getenv("DB_WRITE_BATCH_WAIT_MS", "0"))
+
+    # 问答记录异步落库（write-behind）：记录id预先分配，入队后即返回，由后台线程批量写入；
+    # 队列上限、每批条数、凑批等待（毫秒）、数据库不可用时的溢出文件与重试间隔，以及每次预留的id段大小
+    QA_RECORD_WRITE_BEHIND: bool = os.getenv("QA_RECORD_WRITE_BEHIND", "true").lower() == "true"
+    QA_RECORD_QUEUE_MAX: int = int(os.getenv("QA_RECORD_QUEUE_MAX", "10000"))
+    QA_RECORD_FLUSH_BATCH: int = int(os.getenv("QA_RECORD_FLUSH_BATCH", "200"))
+    QA_RECORD_FLUSH_INTERVAL_MS: float = float(os.getenv("QA_RECORD_FLUSH_INTERVAL_MS", "50"))
+    QA_RECORD_SPILL_PATH: str = os.getenv("QA_RECORD_SPILL_PATH", "./qa_records.spill.jsonl")
+    QA_RECORD_RETRY_SECONDS: float = float(os.getenv("QA_RECORD_RETRY_SECONDS", "5"))
+    QA_RECORD_ID_BLOCK: int = int(os.getenv("QA_RECORD_ID_BLOCK", "1000"))
+
+    # 问答统计：随问答记录与反馈写入增量更新按天/模型/分类的聚合，以及统计接口最多查询的天数
+    ANALYTICS_ENABLED: bool = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+    ANALYTICS_MAX_DAYS: int = int(os.getenv("ANALYTICS_MAX_DAYS", "366"))
+
+    # 问答记录保留：超过QA_RETENTION_DAYS天且无反馈的记录移入压缩归档（0表示不归档），以及归档任务的执行间隔与每批处理的记录数
+    QA_RETENTION_DAYS: int = int(os.getenv("QA_RETENTION_DAYS", "0"))
+    RETENTION_INTERVAL_SECONDS: int = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+    RETENTION_BATCH_SIZE: int = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+    # 归档目录与压缩格式（zstd需安装zstandard，未安装时使用gzip）
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "./archive")
+    ARCHIVE_COMPRESSION: str = os.getenv("ARCHIVE_COMPRESSION", "zstd").lower()
+    # 每轮归档后增量回收的最大空闲页数（数据库需为auto_vacuum=INCREMENTAL）
+    RETENTION_VACUUM_PAGES: int = int(os.getenv("RETENTION_VACUUM_PAGES", "4096"))
+
     # Milvus配置
     MILVUS_HOST: str = os.getenv("MILVUS_HOST", "localhost")
     MILVUS_PORT: str = os.getenv("MILVUS_PORT", "19530")
     MILVUS_COLLECTION: str = os.getenv("MILVUS_COLLECTION", "knowledge_embeddings")
     MILVUS_INDEX_TYPE: str = os.getenv("MILVUS_INDEX_TYPE", "HNSW")
     MILVUS_METRIC_TYPE: str = os.getenv("MILVUS_METRIC_TYPE", "COSINE")
+    # 检索时的搜索宽度：HNSW索引的ef与IVF索引的nprobe（越大召回越高、延迟越大）
+    MILVUS_SEARCH_EF: int = int(os.getenv("MILVUS_SEARCH_EF", "128"))
+    MILVUS_SEARCH_NPROBE: int = int(os.getenv("MILVUS_SEARCH_NPROBE", "16"))
+    # Milvus连接超时（秒）与连接失败后的重试间隔（秒）：不可用期间检索直接回退为文本匹配
+    MILVUS_CONNECT_TIMEOUT: float = float(os.getenv("MILVUS_CONNECT_TIMEOUT", "3"))
+    MILVUS_RETRY_SECONDS: float = float(os.getenv("MILVUS_RETRY_SECONDS", "10"))
+    # 向量存储：milvus / memory（进程内暴力检索，用于离线基准测试与本地调试，重启后需重新导入）
+    VECTOR_STORE: str = os.getenv("VECTOR_STORE", "milvus")
+    
+    # 检索与重排序：未启用重排时向量检索取RETRIEVAL_TOP_K条；
+    # 启用后先过量召回RERANK_CANDIDATES条，经重排只保留RERANK_TOP_K条
+    RETRIEVAL_TOP_K: int = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+    # 检索模式：vector（仅向量）/ hybrid（向量与词面检索结果按RRF融合）
+    RETRIEVAL_MODE: str = os.getenv("RETRIEVAL_MODE", "vector")
+    HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", "60"))
+    # hybrid模式下词面检索从数据库召回的最大候选数
+    HYBRID_LEXICAL_CANDIDATES: int = int(os.getenv("HYBRID_LEXICAL_CANDIDATES", "200"))
+    RERANKER: str = os.getenv("RERANKER", "none")  # none / lexical / cross-encoder / http
+    RERANKER_MODEL: str = os.getenv("RERANKER_MODEL", "BAAI/bge-reranker-base")
+    RERANKER_BASE_URL: str = os.getenv("RERANKER_BASE_URL", "")
+    RERANKER_API_KEY: str = os.getenv("RERANKER_API_KEY", "")
+    RERANK_CANDIDATES: int = int(os.getenv("RERANK_CANDIDATES", "20"))
+    RERANK_TOP_K: int = int(os.getenv("RERANK_TOP_K", "3"))
+    RERANK_BATCH_SIZE: int = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    RERANK_TIMEOUT_MS: int = int(os.getenv("RERANK_TIMEOUT_MS", "300"))
+    
+    # 上下文组装：检索知识注入提示词的token预算与相似度下限
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    CONTEXT_MIN_SIMILARITY: float = float(os.getenv("CONTEXT_MIN_SIMILARITY", "0.3"))
+    
+    # 提示词布局：cache（稳定的系统消息前缀在前、易变的背景信息与问题在后，利于上游前缀缓存）/ legacy
+    PROMPT_LAYOUT: str = os.getenv("PROMPT_LAYOUT", "cache").lower()
+    
+    # 会话记忆：内存中缓存的最近活跃会话数（0表示不缓存）
+    MEMORY_CACHE_SESSIONS: int = int(os.getenv("MEMORY_CACHE_SESSIONS", "1000"))
+    
+    # 会话目录：闲置超过TTL天数的会话将被清理（0表示不清理），以及清理任务的执行间隔
+    SESSION_TTL_DAYS: int = int(os.getenv("SESSION_TTL_DAYS", "30"))
+    SESSION_EXPIRE_INTERVAL_SECONDS: int = int(os.getenv("SESSION_EXPIRE_INTERVAL_SECONDS", "3600"))
+    
+    # 会话历史：最近N轮原文保留，更早的轮次折叠为滚动摘要
+    HISTORY_RECENT_TURNS: int = int(os.getenv("HISTORY_RECENT_TURNS", "4"))
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+    HISTORY_SUMMARY_MAX_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "500"))
+    SUMMARY_MODEL_NAME: str = os.getenv("SUMMARY_MODEL_NAME", "") or MODEL_NAME
+    # tiktoken编码名（可选），为空时按模型名自动选择
+    TOKENIZER_ENCODING: str = os.getenv("TOKENIZER_ENCODING", "")
+    
+    # 设置缓存：检查设置版本行的最小间隔（秒）
+    SETTINGS_VERSION_CHECK_SECONDS: float = float(os.getenv("SETTINGS_VERSION_CHECK_SECONDS", "2"))
+    
+    # 语义答案缓存
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+    ANSWER_CACHE_TTL_SECONDS: int = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+    
+    # 并发合并：相同问题（与会话无关的相同上下文、相同提示词）的并发请求共享一次embedding与生成
+    COALESCE_REQUESTS: bool = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+    
+    # 并发配置：阻塞I/O与CPU密集型任务的线程池大小
+    BLOCKING_IO_WORKERS: int = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+    CPU_BOUND_WORKERS: int = int(os.getenv("CPU_BOUND_WORKERS", "2"))
+    
+    # 批量问答：默认的生成并发数与单个任务的最大问题数
+    BATCH_QA_CONCURRENCY: int = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))
+    BATCH_QA_MAX_QUESTIONS: int = int(os.getenv("BATCH_QA_MAX_QUESTIONS", "5000"))
+    
+    # 准入控制：chat与embedding上游各自的并发上限、排队上限与最长排队等待（毫秒），超限时返回429
+    CHAT_MAX_CONCURRENCY: int = int(os.getenv("CHAT_MAX_CONCURRENCY", "16"))
+    CHAT_MAX_QUEUE: int = int(os.getenv("CHAT_MAX_QUEUE", "64"))
+    CHAT_MAX_WAIT_MS: int = int(os.getenv("CHAT_MAX_WAIT_MS", "5000"))
+    EMBEDDING_MAX_CONCURRENCY: int = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "32"))
+    EMBEDDING_MAX_QUEUE: int = int(os.getenv("EMBEDDING_MAX_QUEUE", "128"))
+    EMBEDDING_MAX_WAIT_MS: int = int(os.getenv("EMBEDDING_MAX_WAIT_MS", "2000"))
+    
+    # 管理接口令牌（请求头X-Admin-Token），为空时关闭管理接口与请求剖析
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    # 请求剖析：采样间隔（毫秒）、剖析文件目录与保留的最近剖析数
+    PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "./profiles")
+    PROFILE_MAX_ENTRIES: int = int(os.getenv("PROFILE_MAX_ENTRIES", "200"))
     
     # 应用配置
     APP_TITLE: str = "本地知识库问答系统"
@@ -36,12 +167,18 @@ class Config:
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     LOG_FORMAT: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
-# 添加配置输出用于调试
-logger.info("Configuration loaded:")
-logger.info(f"  BASE_URL: {Config.BASE_URL}")
-logger.info(f"  EMBEDDING_BASE_URL: {Config.EMBEDDING_BASE_URL}")
-logger.info(f"  EMBEDDING_MODEL: {Config.EMBEDDING_MODEL}")
-logger.info(f"  MILVUS_HOST: {Config.MILVUS_HOST}")
-logger.info(f"  MILVUS_PORT: {Config.MILVUS_PORT}")
-logger.info(f"  MILVUS_COLLECTION: {Config.MILVUS_COLLECTION}")
-logger.info(f"  IMAGE_MODEL_NAME: {Config.IMAGE_MODEL_NAME}")
+def setup_logging() -> None:
+    """配置日志（由应用与命令行入口调用，导入config不再产生副作用）"""
+    logging.basicConfig(level=Config.LOG_LEVEL, format=Config.LOG_FORMAT)
+
+def log_config() -> None:
+    """输出主要配置，便于排查连接问题"""
+    logger.info("Configuration loaded:")
+    logger.info(f"  BASE_URL: {Config.BASE_URL}")
+    logger.info(f"  EMBEDDING_BASE_URL: {Config.EMBEDDING_BASE_URL}")
+    logger.info(f"  EMBEDDING_MODEL: {Config.EMBEDDING_MODEL}")
+    logger.info(f"  VECTOR_STORE: {Config.VECTOR_STORE}")
+    logger.info(f"  MILVUS_HOST: {Config.MILVUS_HOST}")
+    logger.info(f"  MILVUS_PORT: {Config.MILVUS_PORT}")
+    logger.info(f"  MILVUS_COLLECTION: {Config.MILVUS_COLLECTION}")
+    logger.info(f"  IMAGE_MODEL_NAME: {Config.IMAGE_MODEL_NAME}")
@@ -0,0 +1,220 @@
+"""服务容器：各服务为进程内共享的单例，首次使用时才创建（并导入所依赖的重型模块）。
+
+导入main.py不再连接Milvus或创建上游客户端：应用启动后由后台预热依次创建服务并连接向量库，
+预热期间到达的请求（存活/就绪检查除外）等待服务创建完成，不在事件循环中创建服务；
+Milvus不可用时检索回退为文本匹配，其他功能不受影响。
+某个服务创建失败（如缺少必需配置）时失败被缓存，之后的访问直接抛出ServiceUnavailableError（接口返回503），
+不会在请求中重新创建；不依赖它的服务照常可用。
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from async_utils import run_blocking
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceUnavailableError(RuntimeError):
+    """服务创建失败（已缓存）：接口返回503，需修正配置后重启"""
+
+    def __init__(self, service: str, error: BaseException):
+        super().__init__(f"{service}初始化失败: {error}")
+        self.service = service
+        self.error = str(error)
+
+
+class _Lazy:
+    """延迟初始化的共享实例：首次访问时在容器锁内创建，之后直接从实例属性读取（不加锁）"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+
+    def __get__(self, container, owner=None):
+        if container is None:
+            return self
+        # 已创建的实例位于实例字典中，通常不会再进入__get__；此处兜底，避免与正在创建其他服务的线程争锁
+        value = container.__dict__.get(self.name)
+        if value is not None:
+            return value
+        failure = container._failures.get(self.name)
+        if failure is not None:
+            raise ServiceUnavailableError(self.name, failure) from failure
+        with container._lock:
+            if self.name not in container.__dict__:
+                if self.name in container._failures:
+                    failure = container._failures[self.name]
+                    raise ServiceUnavailableError(self.name, failure) from failure
+                start = time.perf_counter()
+                try:
+                    container.__dict__[self.name] = self.factory(container)
+                except Exception as e:
+                    container._failures[self.name] = e
+                    raise
+                logger.debug(f"已初始化 {self.name}（{(time.perf_counter() - start) * 1000:.0f}ms）")
+            return container.__dict__[self.name]
+
+
+class Container:
+    """共享服务单例：问答服务与知识库管理共用同一个KnowledgeService、EmbeddingService与向量库连接"""
+
+    def __init__(self):
+        # 可重入：创建问答服务时会依次创建其依赖
+        self._lock = threading.RLock()
+        self._warmed_up = False
+        self._warm_up_error: Optional[str] = None
+        self._services_task: Optional[asyncio.Future] = None
+        # 创建失败的服务及其异常（不再重试）
+        self._failures: Dict[str, BaseException] = {}
+
+    @_Lazy
+    def embedding_service(self):
+        from embedding_service import EmbeddingService
+        return EmbeddingService()
+
+    @_Lazy
+    def vector_store(self):
+        from vector_store import create_vector_store
+        return create_vector_store()
+
+    @_Lazy
+    def knowledge_service(self):
+        from knowledge_service import KnowledgeService
+        return KnowledgeService(embedding_service=self.embedding_service, vector_store=self.vector_store)
+
+    @_Lazy
+    def memory_service(self):
+        from memory_service import MemoryService
+        return MemoryService()
+
+    @_Lazy
+    def settings_service(self):
+        from settings_service import SettingsService
+        return SettingsService()
+
+    @_Lazy
+    def qa_service(self):
+        from qa_service import QAService
+        return QAService(
+            embedding_service=self.embedding_service,
+            knowledge_service=self.knowledge_service,
+            memory_service=self.memory_service,
+            settings_service=self.settings_service,
+        )
+
+    @_Lazy
+    def batch_service(self):
+        from batch_service import BatchQAService
+        return BatchQAService(self.qa_service)
+
+    @_Lazy
+    def retention_service(self):
+        from retention_service import RetentionService
+        return RetentionService()
+
+    @_Lazy
+    def analytics_service(self):
+        from analytics_service import AnalyticsService
+        return AnalyticsService()
+
+    def initialized(self, name: str) -> bool:
+        return name in self.__dict__
+
+    @staticmethod
+    def init_database() -> None:
+        """创建数据库表（已有库补建新增的索引）"""
+        from models import Base
+        from retention_service import RetentionService
+        Base.metadata.create_all(bind=engine)
+        RetentionService.ensure_indexes()
+
+    def create_services(self) -> None:
+        """创建全部服务（阻塞，在后台线程中调用）；各服务分别创建，一个失败不影响其余服务"""
+        start = time.perf_counter()
+        errors = []
+        for name, attr in vars(type(self)).items():
+            if not isinstance(attr, _Lazy):
+                continue
+            try:
+                getattr(self, name)
+            except ServiceUnavailableError:
+                # 依赖的服务已创建失败，原因已记录
+                continue
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+                logger.warning(f"创建服务{name}失败: {e}")
+        self._warm_up_error = "; ".join(errors) or None
+        self._warmed_up = True
+        logger.info(f"服务创建完成（{(time.perf_counter() - start) * 1000:.0f}ms）")
+
+    def connect_backends(self) -> None:
+        """加载本地重排模型与tokenizer编码并尝试连接向量库（阻塞）；失败只记录，重排与检索各自回退并按需重试"""
+        if self.initialized("qa_service"):
+            from token_counter import warm_up as warm_up_tokenizer
+            # 重排模型与tokenizer编码在此加载，不占用请求的延迟（tokenizer首次加载可能需要下载编码文件）
+            self.qa_service.rerank_service.warm_up()
+            warm_up_tokenizer(self.qa_service.context_packer.model, self.qa_service.history_service.model)
+        if not self.initialized("vector_store"):
+            return
+        vector_store = self.vector_store.ping()
+        if vector_store["status"] != "ok":
+            logger.warning(f"向量库暂不可用，检索将回退为文本匹配: {vector_store.get('error')}")
+
+    def start_warm_up(self) -> asyncio.Future:
+        """在事件循环中启动后台预热：先创建服务，再加载重排模型与连接向量库；返回整个预热的任务"""
+        self._services_task = asyncio.ensure_future(run_blocking(self.create_services))
+
+        async def warm_up():
+            await self._services_task
+            await run_blocking(self.connect_backends)
+        return asyncio.ensure_future(warm_up())
+
+    async def wait_services(self) -> None:
+        """服务创建完成前到达的请求在此等待，而不是在事件循环中加锁创建服务（会阻塞整个事件循环）"""
+        if not self._warmed_up and self._services_task is not None:
+            await asyncio.shield(self._services_task)
+
+    def readiness(self) -> Dict[str, Any]:
+        """就绪检查：数据库可用且服务已初始化即可接收流量；向量库不可用时为degraded（检索回退为文本匹配）"""
+        warmed_up, warm_up_error = self._warmed_up, self._warm_up_error
+        checks: Dict[str, Any] = {}
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            checks["database"] = {"status": "ok"}
+        except Exception as e:
+            checks["database"] = {"status": "unavailable", "error": str(e)}
+        checks["services"] = {
+            "status": "starting" if not warmed_up else ("error" if warm_up_error else "ok"),
+            **({"error": warm_up_error} if warm_up_error else {}),
+        }
+        if self.initialized("vector_store"):
+            checks["vector_store"] = self.vector_store.ping()
+        else:
+            checks["vector_store"] = {"status": "not_initialized"}
+        if self.initialized("qa_service"):
+            endpoints = self.qa_service.router.stats()
+            open_circuits = [e["name"] for e in endpoints if e["circuit_open"]]
+            rerank_service = self.qa_service.rerank_service
+            if rerank_service.enabled:
+                checks["reranker"] = {"status": "ok" if rerank_service.reranker.ready else "loading", "name": rerank_service.reranker.name}
+            checks["llm"] = {"status": "degraded" if open_circuits and len(open_circuits) == len(endpoints) else "ok",
+                             "circuit_open": open_circuits}
+        ready = checks["database"]["status"] == "ok" and warmed_up and self.initialized("qa_service")
+        degraded = any(c.get("status") not in ("ok",) for c in checks.values())
+        return {"ready": ready, "status": "ok" if not degraded else ("degraded" if ready else "not_ready"), "checks": checks}
+
+    async def aclose(self) -> None:
+        """关闭已创建服务的异步客户端（未创建的不会为关闭而创建）"""
+        if self.initialized("qa_service"):
+            await self.qa_service.aclose()
+
+
+container = Container()
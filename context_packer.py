@@ -0,0 +1,137 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from models import Knowledge
+from token_counter import count_tokens, truncate_to_tokens
+
+# 导入PDF时生成的标题格式："{filename} - 段落 {i}"
+_CHUNK_TITLE_PATTERN = re.compile(r"^(?P<doc>.+) - 段落 (?P<index>\d+)$")
+# 合并相邻段落时检测首尾重叠的最大字符数
+_MAX_OVERLAP_CHARS = 200
+
+class _Block:
+    """上下文中的一个片段，可能由同一文档的多个相邻段落合并而成"""
+
+    def __init__(self, knowledge: Knowledge, similarity: float):
+        match = _CHUNK_TITLE_PATTERN.match(knowledge.title or "")
+        self.doc = match.group("doc") if match else None
+        self.first_index = self.last_index = int(match.group("index")) if match else None
+        self.title = knowledge.title
+        self.content = knowledge.content or ""
+        self.ids = [knowledge.id]
+        self.similarity = similarity
+
+    def can_merge(self, other: "_Block") -> bool:
+        return (
+            self.doc is not None and self.doc == other.doc
+            and other.first_index == self.last_index + 1
+        )
+
+    def merge(self, other: "_Block") -> None:
+        self.content = self.content + "\n" + _strip_overlap(self.content, other.content)
+        self.last_index = other.last_index
+        self.ids.extend(other.ids)
+        self.similarity = max(self.similarity, other.similarity)
+        self.title = f"{self.doc} - 段落 {self.first_index}-{self.last_index}"
+
+    def sort_key(self) -> Tuple:
+        """稳定顺序：PDF段落按(文档, 段落序号)，其余按知识id"""
+        if self.doc is not None:
+            return (0, self.doc, self.first_index)
+        return (1, "", min(self.ids))
+
+    def render(self, content: Optional[str] = None) -> str:
+        return f"标题: {self.title}\n内容: {self.content if content is None else content}"
+
+def _strip_overlap(previous: str, following: str) -> str:
+    """去掉following开头与previous结尾重复的部分"""
+    limit = min(len(previous), len(following), _MAX_OVERLAP_CHARS)
+    for size in range(limit, 0, -1):
+        if previous.endswith(following[:size]):
+            return following[size:].lstrip()
+    return following
+
+class ContextPacker:
+    """检索结果的上下文组装：按相似度下限过滤、合并同一文档的相邻/重叠段落，
+    并在token预算内按相关性从高到低装入，超出部分截断或丢弃。
+    """
+    # 截断后剩余token少于该值时不再装入残片
+    MIN_TRIMMED_TOKENS = 50
+
+    def __init__(self, token_budget: int = None, min_similarity: float = None, model: str = None, stable_order: bool = False):
+        self.token_budget = Config.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+        self.min_similarity = Config.CONTEXT_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self.model = model or Config.MODEL_NAME
+        # 为True时装入的片段按(文档, 段落序号/知识id)输出，而不是按相似度，
+        # 使相同的检索结果总是得到相同的上下文文本
+        self.stable_order = stable_order
+
+    def pack(self, similar_knowledges: List[Tuple[Knowledge, float]]) -> Tuple[str, Dict[str, Any]]:
+        """返回(上下文文本, 组装日志)"""
+        log: Dict[str, Any] = {"token_budget": self.token_budget, "included": [], "dropped": []}
+
+        # 1. 相似度下限（全部为0表示文本匹配回退，无相似度可比较，不做过滤）
+        scored = any(sim > 0 for _, sim in similar_knowledges)
+        candidates: List[Tuple[Knowledge, float]] = []
+        for k, sim in similar_knowledges:
+            if scored and sim < self.min_similarity:
+                log["dropped"].append({"id": k.id, "similarity": round(float(sim), 4), "reason": "below_similarity_floor"})
+            else:
+                candidates.append((k, sim))
+
+        # 2. 去除内容被其他命中完全包含的重复段落
+        kept: List[Tuple[Knowledge, float]] = []
+        for i, (k, sim) in enumerate(candidates):
+            content = k.content or ""
+            duplicate_of = next(
+                (o.id for j, (o, _) in enumerate(candidates)
+                 if j != i and content in (o.content or "") and (len(o.content or "") > len(content) or j < i)),
+                None
+            )
+            if duplicate_of is not None:
+                log["dropped"].append({"id": k.id, "similarity": round(float(sim), 4), "reason": "duplicate", "duplicate_of": duplicate_of})
+            else:
+                kept.append((k, sim))
+
+        # 3. 合并同一文档的相邻段落
+        blocks = [_Block(k, float(sim)) for k, sim in kept]
+        blocks.sort(key=lambda b: (b.doc is None, b.doc or "", b.first_index or 0))
+        merged: List[_Block] = []
+        for block in blocks:
+            if merged and merged[-1].can_merge(block):
+                merged[-1].merge(block)
+            else:
+                merged.append(block)
+        merged.sort(key=lambda b: b.similarity, reverse=True)
+
+        # 4. 按相关性装入预算，超出时截断最后一个片段，其余丢弃
+        parts: List[Tuple[Tuple, str]] = []
+        used = 0
+        for block in merged:
+            text = block.render()
+            tokens = count_tokens(text, self.model)
+            remaining = self.token_budget - used
+            if tokens <= remaining:
+                parts.append((block.sort_key(), text))
+                used += tokens
+                log["included"].append({"ids": block.ids, "similarity": round(block.similarity, 4), "tokens": tokens, "truncated": False})
+                continue
+            header_tokens = count_tokens(block.render(""), self.model)
+            if remaining - header_tokens >= self.MIN_TRIMMED_TOKENS:
+                trimmed = block.render(truncate_to_tokens(block.content, remaining - header_tokens, self.model))
+                tokens = count_tokens(trimmed, self.model)
+                parts.append((block.sort_key(), trimmed))
+                used += tokens
+                log["included"].append({"ids": block.ids, "similarity": round(block.similarity, 4), "tokens": tokens, "truncated": True})
+            else:
+                for kid in block.ids:
+                    log["dropped"].append({"id": kid, "similarity": round(block.similarity, 4), "reason": "over_budget"})
+
+        log["tokens"] = used
+        if self.stable_order:
+            parts.sort(key=lambda part: part[0])
+        context = "\n\n".join(text for _, text in parts)
+        if not context:
+            context = "未找到相关背景信息。"
+        return context, log
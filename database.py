@@ -1,12 +1,45 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import Config
 
-engine = create_engine(
-    Config.DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # 仅用于SQLite
-)
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """每个新连接上设置SQLite参数：WAL下读写互不阻塞，synchronous=NORMAL只在检查点时fsync"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}")
+        # 新库（尚未建表）启用增量空间回收，删除后的空闲页可分批归还；已有库需VACUUM一次才会生效
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute(f"PRAGMA journal_mode={Config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+        # 负数表示以KB为单位
+        cursor.execute(f"PRAGMA cache_size=-{int(Config.SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+def create_db_engine(url: str = None, tuned: bool = True) -> Engine:
+    """创建数据库引擎；SQLite连接按配置设置WAL等参数（tuned=False时保持SQLite默认设置，用于基准对比）"""
+    url = url or Config.DATABASE_URL
+    if not is_sqlite(url):
+        return create_engine(url, pool_pre_ping=True)
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": Config.SQLITE_BUSY_TIMEOUT_MS / 1000},  # 仅用于SQLite
+        # 每个I/O线程可各持一个连接，避免在连接池上排队
+        pool_size=Config.BLOCKING_IO_WORKERS + 4,
+    )
+    if tuned:
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+# 所有服务共用同一个引擎与连接池
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -17,4 +50,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
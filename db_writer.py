@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from async_utils import run_blocking
+from config import Config
+from database import engine, is_sqlite
+from metrics import DB_WRITE_BATCH_SIZE, DB_WRITE_COMMIT_SECONDS, DB_WRITE_RETRIES, registry
+from profiling import current_profile
+
+logger = logging.getLogger(__name__)
+
+# (写函数, 结果Future)
+_Job = Tuple[Callable[[Session], Any], Future]
+
+
+class DBWriter:
+    """串行写入器：写操作由单个后台线程按提交顺序执行。
+
+    写线程每次取出已排队的全部写操作（最多max_batch个）在一个事务中执行并只提交一次（组提交），
+    并发写入只需一次fsync，且不会在SQLite的写锁上相互等待或报"database is locked"。
+    批内某个写操作出错时整批回滚，再逐个在独立事务中重做，只有出错的那个失败。
+    写函数形如 func(db, *args)，在写线程的会话中执行，不要自行提交；返回的ORM对象在提交后仍可读取已加载的属性。
+
+    serialized=False（非SQLite数据库）时不经过写线程，直接在调用线程中以独立事务执行。
+    """
+
+    def __init__(self, session_factory: sessionmaker, serialized: bool, max_batch: int = 128,
+                 max_wait_ms: float = 0.0, immediate: bool = False):
+        self._session_factory = session_factory
+        self.serialized = serialized
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        # SQLite：以BEGIN IMMEDIATE开始写事务，先读后写的事务不会因锁升级失败
+        self.immediate = immediate
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """提交写操作，返回concurrent.futures.Future"""
+        def call(db: Session):
+            return func(db, *args, **kwargs)
+        profile = current_profile()
+        if profile is not None:
+            call = self._profiled(profile, call)
+        future: Future = Future()
+        if self.serialized and threading.current_thread() is not self._thread:
+            # 检查关闭标志与入队在同一把锁内：close()之后入队的写操作不会因写线程已退出而永远等待
+            with self._lock:
+                if not self._closed:
+                    self._ensure_started()
+                    self._queue.put((call, future))
+                    return future
+        # 未启用串行写入、写入器已关闭（应用退出过程中的写入），或写函数内部再次写入：直接执行
+        self._run_isolated([(call, future)])
+        return future
+
+    def call(self, func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """同步执行写操作（用于线程池中的阻塞代码）"""
+        return self.submit(func, *args, **kwargs).result(timeout)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """异步执行写操作：串行模式下等待写线程完成，不占用I/O线程池"""
+        if not self.serialized:
+            return await run_blocking(self.call, func, *args, **kwargs)
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """停止接收新的写操作，等待已排队的写操作全部提交"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                # 结束标记排在关闭前入队的全部写操作之后
+                self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout)
+
+    @staticmethod
+    def _profiled(profile, call: Callable[[Session], Any]) -> Callable[[Session], Any]:
+        def wrapped(db: Session):
+            with profile.attach():
+                return call(db)
+        return wrapped
+
+    def _ensure_started(self) -> None:
+        """调用方须持有self._lock"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._run_batch(batch)
+        # 关闭时处理剩余写操作
+        leftover = []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                leftover.append(job)
+        if leftover:
+            self._run_batch(leftover)
+
+    def _begin(self, db: Session) -> None:
+        if self.immediate:
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _run_batch(self, batch: List[_Job]) -> None:
+        batch = [(call, future) for call, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        db = self._session_factory()
+        try:
+            self._begin(db)
+            results = [call(db) for call, _ in batch]
+            start = time.perf_counter()
+            db.commit()
+            DB_WRITE_COMMIT_SECONDS.observe(time.perf_counter() - start)
+        except Exception as e:
+            db.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            logger.warning(f"批量写入失败，逐条重试（{len(batch)}条）: {e}")
+            DB_WRITE_RETRIES.inc()
+            results = None
+        finally:
+            db.close()
+        if results is None:
+            self._run_isolated(batch, started=True)
+            return
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run_isolated(self, batch: List[_Job], started: bool = False) -> None:
+        for call, future in batch:
+            if not started and not future.set_running_or_notify_cancel():
+                continue
+            db = self._session_factory()
+            try:
+                self._begin(db)
+                result = call(db)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                db.close()
+
+
+def _serialized() -> bool:
+    if Config.DB_SERIALIZED_WRITES == "auto":
+        return is_sqlite(Config.DATABASE_URL)
+    return Config.DB_SERIALIZED_WRITES == "true"
+
+
+db_writer = DBWriter(
+    sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False),
+    serialized=_serialized(),
+    max_batch=Config.DB_WRITE_BATCH_MAX,
+    max_wait_ms=Config.DB_WRITE_BATCH_WAIT_MS,
+    immediate=is_sqlite(Config.DATABASE_URL),
+)
+
+registry.callback("db_write_queue_depth", "Write operations waiting for the serialized writer", lambda: [({}, float(db_writer.pending()))])
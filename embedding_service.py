@@ -1,31 +1,58 @@
 import openai
+from typing import List
 import numpy as np
 from config import Config
 import pickle
 import logging
 import httpx
+from admission import embedding_admission, PRIORITY_ASK, PRIORITY_BATCH
+from metrics import UPSTREAM_ERRORS
 
-# 配置日志
-logging.basicConfig(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 class EmbeddingService:
     """Embedding服务"""
     
     def __init__(self):
-        """初始化Embedding客户端"""
-        self.client = openai.OpenAI(
-            base_url=Config.EMBEDDING_BASE_URL,
-            api_key=Config.EMBEDDING_API_KEY
-        )
+        """Embedding客户端在首次使用时创建：缺少EMBEDDING_API_KEY等配置时服务照常创建，
+        调用时才失败（问答检索回退为文本匹配），Ollama端点不需要OpenAI客户端
+        """
         self.model = Config.EMBEDDING_MODEL
         self.base_url = Config.EMBEDDING_BASE_URL
+        self._client: openai.OpenAI = None
+        self._async_client: openai.AsyncOpenAI = None
+        self._http: httpx.AsyncClient = None
+
+    @property
+    def client(self) -> openai.OpenAI:
+        if self._client is None:
+            self._client = openai.OpenAI(
+                base_url=Config.EMBEDDING_BASE_URL,
+                api_key=Config.EMBEDDING_API_KEY
+            )
+        return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(
+                base_url=Config.EMBEDDING_BASE_URL,
+                api_key=Config.EMBEDDING_API_KEY
+            )
+        return self._async_client
+    
+    def _is_ollama(self) -> bool:
+        return "ollama" in self.base_url or "11434" in self.base_url
     
     def get_embedding(self, text: str) -> np.ndarray:
-        """获取文本的embedding向量"""
+        """获取文本的embedding向量（同步调用用于导入等批量任务，按批量优先级排队）"""
+        with embedding_admission.blocking_slot(PRIORITY_BATCH):
+            return self._get_embedding(text)
+    
+    def _get_embedding(self, text: str) -> np.ndarray:
         try:
             # 检查是否是Ollama端点
-            if "ollama" in self.base_url or "11434" in self.base_url:
+            if self._is_ollama():
                 return self._get_ollama_embedding(text)
             else:
                 # 使用OpenAI格式
@@ -39,6 +66,7 @@ class EmbeddingService:
                 return np.array(embedding, dtype=np.float32)
         except Exception as e:
             logger.error(f"获取embedding时出错: {str(e)}")
+            UPSTREAM_ERRORS.inc(upstream="embedding", endpoint=self.model)
             raise
     
     def _get_ollama_embedding(self, text: str) -> np.ndarray:
@@ -64,6 +92,84 @@ class EmbeddingService:
             logger.error(f"获取Ollama embedding时出错: {str(e)}")
             raise
     
+    async def aget_embedding(self, text: str, priority: int = PRIORITY_ASK) -> np.ndarray:
+        """异步获取文本的embedding向量（问答路径使用，不阻塞事件循环）"""
+        async with embedding_admission.slot(priority):
+            return await self._aget_embedding(text)
+    
+    async def _aget_embedding(self, text: str) -> np.ndarray:
+        try:
+            if self._is_ollama():
+                return await self._aget_ollama_embedding(text)
+            response = await self.async_client.embeddings.create(
+                model=self.model,
+                input=text
+            )
+            if not response.data:
+                raise Exception("No embedding data received")
+            return np.array(response.data[0].embedding, dtype=np.float32)
+        except Exception as e:
+            logger.error(f"获取embedding时出错: {str(e)}")
+            UPSTREAM_ERRORS.inc(upstream="embedding", endpoint=self.model)
+            raise
+    
+    async def _aget_ollama_embedding(self, text: str) -> np.ndarray:
+        """异步获取Ollama格式的embedding向量，复用同一个httpx.AsyncClient连接池"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=30.0)
+        response = await self._http.post(
+            f"{self.base_url}/embeddings",
+            json={"model": self.model, "prompt": text}
+        )
+        response.raise_for_status()
+        data = response.json()
+        if "embedding" not in data:
+            raise Exception("No embedding data received from Ollama")
+        return np.array(data["embedding"], dtype=np.float32)
+    
+    async def aget_embeddings(self, texts: List[str], priority: int = PRIORITY_BATCH) -> List[np.ndarray]:
+        """批量获取embedding：每EMBEDDING_BATCH_SIZE条一次上游调用（每批占用一个并发名额）"""
+        batch_size = max(1, Config.EMBEDDING_BATCH_SIZE)
+        out: List[np.ndarray] = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            async with embedding_admission.slot(priority):
+                try:
+                    if self._is_ollama():
+                        out.extend(await self._aget_ollama_embeddings(batch))
+                    else:
+                        response = await self.async_client.embeddings.create(model=self.model, input=batch)
+                        if len(response.data) != len(batch):
+                            raise Exception("Embedding count does not match input count")
+                        # 按index排序，保证与输入顺序一致
+                        out.extend(np.array(d.embedding, dtype=np.float32) for d in sorted(response.data, key=lambda d: d.index))
+                except Exception:
+                    UPSTREAM_ERRORS.inc(upstream="embedding", endpoint=self.model)
+                    raise
+        return out
+    
+    async def _aget_ollama_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Ollama批量接口（/api/embed，input为列表）"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=30.0)
+        response = await self._http.post(
+            f"{self.base_url}/embed",
+            json={"model": self.model, "input": texts}
+        )
+        response.raise_for_status()
+        embeddings = response.json().get("embeddings")
+        if not embeddings or len(embeddings) != len(texts):
+            raise Exception("No embedding data received from Ollama")
+        return [np.array(e, dtype=np.float32) for e in embeddings]
+    
+    async def aclose(self) -> None:
+        """关闭异步HTTP连接"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._async_client is not None:
+            await self._async_client.close()
+    
     def encode_embedding(self, embedding: np.ndarray) -> bytes:
         """将numpy数组编码为字节"""
         return pickle.dumps(embedding)
@@ -0,0 +1,328 @@
+"""检索质量与延迟评估：从问答记录、点赞反馈与人工标注构建查询集，在不同检索配置下回放
+QAService.search_knowledge，并排对比 recall@k、MRR、检索延迟分位数与上下文token成本。
+
+用法：
+    python evaluate.py --top-k 3,5,10 --modes vector,hybrid --rerankers none,lexical
+    python evaluate.py --labels labels.jsonl --ef 32,64,128 --output eval.json
+    VECTOR_STORE=memory python evaluate.py --top-k 5   # 不连接Milvus，知识条目向量经缓存计算后载入内存
+
+查询集来源：
+- --labels：JSONL，每行 {"question": "...", "relevant_ids": [1, 2]}
+- 点赞（is_useful=true）的问答记录：该回答上下文中实际使用的知识条目视为相关
+- 其余问答记录中的问题：无相关性标注，只参与延迟与token成本统计
+
+问题与知识条目的embedding按(模型, 文本)缓存在本地SQLite文件中，重复评估不再调用embedding服务。
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from admission import PRIORITY_ASK, PRIORITY_BATCH
+from async_utils import run_blocking
+from config import Config, setup_logging
+from database import SessionLocal
+from models import Feedback, Knowledge, QARecord
+from qa_service import QAService
+from rerank_service import RerankService
+
+
+class EmbeddingDiskCache:
+    """按(模型, 文本)缓存embedding的本地SQLite文件"""
+
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (self._key(text),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_many(self, texts: List[str], vectors: List[np.ndarray]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(self._key(t), np.asarray(v, dtype=np.float32).tobytes()) for t, v in zip(texts, vectors)],
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+async def embed_all(qa: QAService, cache: EmbeddingDiskCache, texts: List[str]) -> List[np.ndarray]:
+    """缓存未命中的文本一次批量计算并写入缓存"""
+    vectors: Dict[str, np.ndarray] = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        vector = cache.get(text)
+        if vector is None:
+            missing.append(text)
+        else:
+            vectors[text] = vector
+    if missing:
+        computed = await qa.embedding_service.aget_embeddings(missing, PRIORITY_BATCH)
+        cache.put_many(missing, computed)
+        vectors.update(zip(missing, computed))
+    return [vectors[t] for t in texts]
+
+
+def use_cached_embeddings(qa: QAService, cache: EmbeddingDiskCache) -> None:
+    """问答检索路径的embedding改为先查本地缓存"""
+    original = qa.embedding_service.aget_embedding
+
+    async def cached(text: str, priority: int = PRIORITY_ASK) -> np.ndarray:
+        vector = cache.get(text)
+        if vector is None:
+            vector = await original(text, priority)
+            cache.put_many([text], [vector])
+        return vector
+
+    qa.embedding_service.aget_embedding = cached
+
+
+async def load_memory_index(qa: QAService, cache: EmbeddingDiskCache) -> int:
+    """VECTOR_STORE=memory时：按与导入相同的文本（标题 + 内容）计算知识条目向量并载入内存索引"""
+    db = SessionLocal()
+    try:
+        rows = db.query(Knowledge.id, Knowledge.title, Knowledge.content).all()
+    finally:
+        db.close()
+    texts = [f"{title} {content}" for _, title, content in rows]
+    vectors = await embed_all(qa, cache, texts)
+    for (kid, _, _), vector in zip(rows, vectors):
+        qa.knowledge_service.vector_store.index(kid, vector)
+    return len(rows)
+
+
+def _normalize(question: str) -> str:
+    return " ".join((question or "").split()).lower()
+
+
+def build_query_set(labels_path: Optional[str], use_feedback: bool, log_limit: int) -> List[Dict[str, Any]]:
+    """合并三类查询来源，同一问题只保留一次（人工标注 > 点赞反馈 > 普通记录）"""
+    queries: Dict[str, Dict[str, Any]] = {}
+    if labels_path:
+        with open(labels_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                queries.setdefault(_normalize(item["question"]), {
+                    "question": item["question"], "relevant_ids": [int(i) for i in item.get("relevant_ids", [])], "source": "labels",
+                })
+
+    db = SessionLocal()
+    try:
+        if use_feedback:
+            rows = (
+                db.query(QARecord.question, QARecord.process_log)
+                .join(Feedback, Feedback.qa_record_id == QARecord.id)
+                .filter(Feedback.is_useful.is_(True))
+                .all()
+            )
+            for question, process_log in rows:
+                included = ((process_log or {}).get("context") or {}).get("included") or []
+                relevant = sorted({kid for block in included for kid in block.get("ids", [])})
+                if relevant:
+                    queries.setdefault(_normalize(question), {"question": question, "relevant_ids": relevant, "source": "feedback"})
+        if log_limit > 0:
+            rows = db.query(QARecord.question).order_by(QARecord.id.desc()).limit(log_limit).all()
+            for (question,) in rows:
+                if question and not question.startswith("[图片问答]"):
+                    queries.setdefault(_normalize(question), {"question": question, "relevant_ids": [], "source": "logs"})
+    finally:
+        db.close()
+    return list(queries.values())
+
+
+@contextmanager
+def override_config(**values):
+    previous = {key: getattr(Config, key) for key in values}
+    for key, value in values.items():
+        setattr(Config, key, value)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            setattr(Config, key, value)
+
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+
+async def evaluate_config(qa: QAService, queries: List[Dict[str, Any]], setting: Dict[str, Any], price_per_mtok: float) -> Dict[str, Any]:
+    top_k = setting["top_k"]
+    store = qa.knowledge_service.vector_store
+    if hasattr(store, "search_ef"):
+        store.search_ef = setting["ef"]
+        store.search_nprobe = setting["nprobe"]
+    await qa.rerank_service.aclose()
+    qa.rerank_service = RerankService(reranker_name=setting["reranker"], top_k=top_k)
+    # 本地模型在计时前加载；加载失败时该配置实际测的是向量检索顺序，结果中记录回退次数
+    load_error = await run_blocking(qa.rerank_service.warm_up)
+    if load_error:
+        print(f"警告：重排序器 {setting['reranker']} 不可用，该配置回退为向量检索顺序：{load_error}")
+
+    latencies: List[float] = []
+    context_tokens: List[int] = []
+    recalls: List[float] = []
+    reciprocal_ranks: List[float] = []
+    hits: List[int] = []
+    with override_config(
+        RETRIEVAL_TOP_K=top_k,
+        RETRIEVAL_MODE=setting["mode"],
+        RERANK_CANDIDATES=max(Config.RERANK_CANDIDATES, top_k),
+        COALESCE_REQUESTS=False,
+    ):
+        db = SessionLocal()
+        try:
+            for query in queries:
+                start = time.perf_counter()
+                results = await qa.search_knowledge(db, query["question"])
+                latencies.append(time.perf_counter() - start)
+                _, context_log = qa._build_context(results)
+                context_tokens.append(context_log.get("tokens", 0))
+
+                relevant = set(query["relevant_ids"])
+                if not relevant:
+                    continue
+                ids = [k.id for k, _ in results[:top_k]]
+                recalls.append(len(relevant & set(ids)) / len(relevant))
+                rank = next((i for i, kid in enumerate(ids, start=1) if kid in relevant), None)
+                reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+                hits.append(1 if rank else 0)
+        finally:
+            db.close()
+
+    latencies.sort()
+    avg_tokens = sum(context_tokens) / len(context_tokens) if context_tokens else 0.0
+    return {
+        **setting,
+        "queries": len(queries),
+        "labeled_queries": len(recalls),
+        "recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None,
+        "mrr": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 4) if reciprocal_ranks else None,
+        "hit_rate": round(sum(hits) / len(hits), 4) if hits else None,
+        "latency_p50_ms": _percentile(latencies, 0.5),
+        "latency_p95_ms": _percentile(latencies, 0.95),
+        "latency_p99_ms": _percentile(latencies, 0.99),
+        "avg_context_tokens": round(avg_tokens, 1),
+        "rerank_fallbacks": qa.rerank_service.fallbacks,
+        "context_cost_per_1k_queries": round(avg_tokens * 1000 / 1e6 * price_per_mtok, 4) if price_per_mtok else None,
+    }
+
+
+def _ints(value: str) -> List[int]:
+    return [int(x) for x in value.split(",") if x.strip()]
+
+
+def _names(value: str) -> List[str]:
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    header = f"{'mode':<7}{'reranker':<14}{'top_k':>6}{'ef':>6}{'nprobe':>8}{'recall@k':>10}{'MRR':>8}{'hit':>7}{'p50ms':>9}{'p95ms':>9}{'ctx_tok':>9}"
+    print(header)
+    print("-" * len(header))
+
+    def fmt(value, width):
+        return f"{'-' if value is None else value:>{width}}"
+    for r in results:
+        print(
+            f"{r['mode']:<7}{r['reranker']:<14}{r['top_k']:>6}{r['ef']:>6}{r['nprobe']:>8}"
+            f"{fmt(r['recall_at_k'], 10)}{fmt(r['mrr'], 8)}{fmt(r['hit_rate'], 7)}"
+            f"{fmt(r['latency_p50_ms'], 9)}{fmt(r['latency_p95_ms'], 9)}{fmt(r['avg_context_tokens'], 9)}"
+        )
+    for r in results:
+        if r.get("rerank_fallbacks"):
+            print(f"注意：{r['mode']}/{r['reranker']}/top_k={r['top_k']} 有{r['rerank_fallbacks']}次重排回退为向量检索顺序")
+
+
+async def run(args) -> Dict[str, Any]:
+    queries = build_query_set(args.labels, not args.no_feedback, args.log_limit)
+    if args.max_queries:
+        queries = queries[:args.max_queries]
+    if not queries:
+        raise SystemExit("没有可用的查询：请先产生问答记录，或通过 --labels 提供标注文件")
+    sources: Dict[str, int] = {}
+    for q in queries:
+        sources[q["source"]] = sources.get(q["source"], 0) + 1
+    print(f"查询集：{len(queries)}条 {sources}")
+
+    qa = QAService()
+    cache = EmbeddingDiskCache(args.embedding_cache, Config.EMBEDDING_MODEL)
+    try:
+        if Config.VECTOR_STORE == "memory":
+            print(f"已载入内存向量索引：{await load_memory_index(qa, cache)}条")
+        # 预先计算（或从缓存读取）全部问题的embedding，评估过程中不再调用embedding服务
+        await embed_all(qa, cache, [q["question"] for q in queries])
+        use_cached_embeddings(qa, cache)
+
+        settings = [
+            {"mode": mode, "reranker": reranker, "top_k": top_k, "ef": ef, "nprobe": nprobe}
+            for mode, reranker, top_k, ef, nprobe in itertools.product(
+                _names(args.modes), _names(args.rerankers), _ints(args.top_k), _ints(args.ef), _ints(args.nprobe)
+            )
+        ]
+        results = []
+        for setting in settings:
+            results.append(await evaluate_config(qa, queries, setting, args.price_per_mtok))
+        print_table(results)
+        print(f"embedding缓存：命中{cache.hits}，未命中{cache.misses}")
+        return {
+            "vector_store": Config.VECTOR_STORE,
+            "index_type": Config.MILVUS_INDEX_TYPE,
+            "query_sources": sources,
+            "results": results,
+        }
+    finally:
+        cache.close()
+        await qa.aclose()
+
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="检索质量与延迟评估")
+    parser.add_argument("--labels", help="人工标注的相关知识条目（JSONL）")
+    parser.add_argument("--no-feedback", action="store_true", help="不使用点赞反馈构建标注")
+    parser.add_argument("--log-limit", type=int, default=500, help="最多使用的最近问答记录数（0为不使用）")
+    parser.add_argument("--max-queries", type=int, default=0)
+    parser.add_argument("--top-k", default=str(Config.RETRIEVAL_TOP_K), help="逗号分隔，如3,5,10")
+    parser.add_argument("--modes", default="vector,hybrid", help="vector / hybrid")
+    parser.add_argument("--rerankers", default="none", help="none / lexical / cross-encoder / http")
+    parser.add_argument("--ef", default=str(Config.MILVUS_SEARCH_EF), help="HNSW索引的ef（逗号分隔）")
+    parser.add_argument("--nprobe", default=str(Config.MILVUS_SEARCH_NPROBE), help="IVF索引的nprobe（逗号分隔）")
+    parser.add_argument("--price-per-mtok", type=float, default=0.0, help="每百万提示词token价格，用于估算上下文成本")
+    parser.add_argument("--embedding-cache", default="eval_embeddings.db")
+    parser.add_argument("--output", default="", help="结果JSON输出路径（可选）")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,8 @@ if "session_id" not in st.session_state:
     st.session_state.session_id = ""
 if "sessions" not in st.session_state:
     st.session_state.sessions = []
+if "session_titles" not in st.session_state:
+    st.session_state.session_titles = {}
 if "system_prompt" not in st.session_state:
     st.session_state.system_prompt = ""
 if "answer_prompt" not in st.session_state:
@@ -54,9 +56,13 @@ def load_knowledges():
 # 新增：会话管理与Prompt设置API
 def load_sessions():
     try:
-        resp = requests.get(f"{API_BASE_URL}/sessions")
+        resp = requests.get(f"{API_BASE_URL}/sessions", params={"limit": 50})
         if resp.status_code == 200:
-            st.session_state.sessions = resp.json().get("sessions", [])
+            data = resp.json()
+            st.session_state.sessions = data.get("sessions", [])
+            st.session_state.session_titles = {
+                item["session_id"]: item.get("title") for item in data.get("items", [])
+            }
         else:
             st.session_state.sessions = []
     except Exception as e:
@@ -122,6 +128,25 @@ def save_prompt_settings(system_prompt: str, answer_prompt: str):
         st.error(f"更新Prompt设置失败: {str(e)}")
 
 
+def load_analytics(days: int):
+    try:
+        resp = requests.get(f"{API_BASE_URL}/analytics", params={"days": days})
+        if resp.status_code == 200:
+            return resp.json()
+        st.warning("无法加载使用统计")
+    except Exception as e:
+        st.error(f"加载使用统计失败: {str(e)}")
+    return None
+
+
+def _format_rate(value):
+    return "-" if value is None else f"{value * 100:.1f}%"
+
+
+def _format_ms(value):
+    return "-" if value is None else f"{value:.0f} ms"
+
+
 def create_knowledge(title: str, content: str, category: str):
     try:
         response = requests.post(f"{API_BASE_URL}/knowledge/", json={
@@ -179,13 +204,17 @@ with tab1:
     # 会话管理
     session_cols = st.columns([2, 1, 1])
     with session_cols[0]:
-        # 构建选项（后端返回 sessions: List[str]）
+        # 构建选项（后端按最近活跃时间倒序返回会话）
         existing_ids = st.session_state.sessions
         session_options = [""] + existing_ids
         index = 0
         if st.session_state.session_id in existing_ids:
             index = existing_ids.index(st.session_state.session_id) + 1
-        selected = st.selectbox("选择会话", options=session_options, index=index)
+        titles = st.session_state.session_titles
+        selected = st.selectbox(
+            "选择会话", options=session_options, index=index,
+            format_func=lambda sid: "" if not sid else (f"{titles[sid]} ({sid[:8]})" if titles.get(sid) else sid)
+        )
         st.session_state.session_id = selected or ""
         st.caption(f"当前会话: {st.session_state.session_id or '未选择'}")
     with session_cols[1]:
@@ -227,25 +256,30 @@ with tab1:
         # 如果正在回答或有新问题需要处理
         if st.session_state.is_answering and st.session_state.current_question:
             try:
-                # 先调用非流式API获取详细信息（包括检索到的知识和过程日志）
-                response = requests.post(f"{API_BASE_URL}/qa/ask", 
-                                       json={"question": st.session_state.current_question, "session_id": st.session_state.session_id or ""})
-                if response.status_code == 200:
-                    qa_data = response.json()
-                    st.session_state.current_qa_id = qa_data["id"]
-                    st.session_state.process_log = qa_data["process_log"]
-                    st.session_state.retrieved_knowledges = qa_data.get("retrieved_knowledges", [])
-                # 使用流式请求显示回答
+                # 单次流式请求：先返回检索结果，再返回答案增量，最后返回问答记录与过程日志
                 with requests.post(f"{API_BASE_URL}/qa/ask-stream", 
                                   json={"question": st.session_state.current_question, "session_id": st.session_state.session_id or ""}, 
                                   stream=True) as r:
+                    if r.status_code == 429:
+                        raise Exception(f"服务繁忙，请{r.headers.get('Retry-After', '稍')}秒后重试")
                     r.raise_for_status()
                     
                     # 实时更新回答
-                    for chunk in r.iter_content(chunk_size=1, decode_unicode=True):
-                        if chunk:
-                            full_answer += chunk
+                    for line in r.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        event_type = event.get("type")
+                        if event_type == "retrieval":
+                            st.session_state.retrieved_knowledges = event.get("retrieved_knowledges", [])
+                        elif event_type == "delta":
+                            full_answer += event.get("content", "")
                             answer_placeholder.markdown(full_answer + "▌")
+                        elif event_type == "error":
+                            st.warning(event.get("message", "获取回答失败"))
+                        elif event_type == "done":
+                            st.session_state.current_qa_id = event.get("id")
+                            st.session_state.process_log = event.get("process_log", {})
                     
                     # 完成后移除光标符号
                     answer_placeholder.markdown(full_answer)
@@ -282,7 +316,7 @@ with tab1:
     with st.expander("图片理解问答"):
         img_col1, img_col2 = st.columns([2, 1])
         with img_col1:
-            image_file = st.file_uploader("上传图片", type=["png", "jpg", "jpeg"], key="image_file_qa")
+            image_file = st.file_uploader("上传图片", type=["png", "jpg", "jpeg", "webp", "gif", "bmp"], key="image_file_qa")
         with img_col2:
             image_question = st.text_input("图片问题", value="请描述这张图片", key="image_question")
         # 在折叠面板内即时展示答案的占位
@@ -292,24 +326,32 @@ with tab1:
             if st.button("提交图片问答", use_container_width=True):
                 if image_file is not None and image_question.strip():
                     try:
-                        mime = "image/png"
-                        if image_file.type in ["image/jpg", "image/jpeg"]:
-                            mime = "image/jpeg"
-                        files = {"image": (image_file.name, image_file.getvalue(), mime)}
+                        # 原样上传，格式识别与缩放压缩在后端完成
+                        files = {"image": (image_file.name, image_file.getvalue(), image_file.type or "application/octet-stream")}
                         data = {"question": image_question, "session_id": st.session_state.session_id or ""}
-                        resp = requests.post(f"{API_BASE_URL}/qa/ask-image", files=files, data=data)
-                        if resp.status_code == 200:
-                            data = resp.json()
-                            st.session_state.current_answer = data.get("answer", "")
-                            st.session_state.process_log = data.get("process_log", {})
+                        answer = ""
+                        with requests.post(f"{API_BASE_URL}/qa/ask-image-stream", files=files, data=data, stream=True) as r:
+                            if r.status_code == 429:
+                                raise Exception(f"服务繁忙，请{r.headers.get('Retry-After', '稍')}秒后重试")
+                            r.raise_for_status()
+                            for line in r.iter_lines(decode_unicode=True):
+                                if not line:
+                                    continue
+                                event = json.loads(line)
+                                if event.get("type") == "delta":
+                                    answer += event.get("content", "")
+                                    image_answer_placeholder.markdown(f"**回答：**\n\n{answer}▌")
+                                elif event.get("type") == "error":
+                                    st.warning(event.get("message", "图片问答失败"))
+                                elif event.get("type") == "done":
+                                    answer = event.get("answer", answer)
+                                    st.session_state.process_log = event.get("process_log", {})
+                        st.session_state.current_answer = answer
+                        if answer:
+                            image_answer_placeholder.markdown(f"**回答：**\n\n{answer}")
                             st.success("图片问答完成")
-                            # 即时在折叠面板内展示答案（非流式）
-                            if st.session_state.current_answer:
-                                image_answer_placeholder.markdown(f"**回答：**\n\n{st.session_state.current_answer}")
-                            else:
-                                image_answer_placeholder.info("后端未返回答案内容。")
                         else:
-                            st.error("图片问答失败")
+                            image_answer_placeholder.info("后端未返回答案内容。")
                     except Exception as e:
                         st.error(f"图片问答失败: {str(e)}")
                 else:
@@ -525,6 +567,41 @@ with tab3:
     - LLM接口：OpenAI兼容接口
     """)
 
+    # 使用统计（预先聚合的按天统计）
+    st.subheader("使用统计")
+    days = st.selectbox("统计范围", options=[7, 30, 90], index=1, format_func=lambda d: f"最近{d}天")
+    analytics = load_analytics(days)
+    if analytics:
+        totals = analytics["totals"]
+        metric_cols = st.columns(6)
+        metric_cols[0].metric("提问数", totals["questions"])
+        metric_cols[1].metric("满意率", _format_rate(totals["satisfaction"]), help=f"👍 {totals['thumbs_up']} / 👎 {totals['thumbs_down']}")
+        metric_cols[2].metric("错误率", _format_rate(totals["error_rate"]))
+        metric_cols[3].metric("缓存命中率", _format_rate(totals["cache_hit_rate"]))
+        metric_cols[4].metric("Token总量", f"{totals['total_tokens']:,}")
+        metric_cols[5].metric("耗时P50 / P99", f"{_format_ms(totals['latency_ms']['p50'])} / {_format_ms(totals['latency_ms']['p99'])}")
+        daily = analytics["daily"]
+        st.line_chart(
+            [{"日期": d["day"], "提问数": d["questions"], "点赞": d["thumbs_up"], "点踩": d["thumbs_down"]} for d in daily],
+            x="日期", y=["提问数", "点赞", "点踩"],
+        )
+        st.caption(f"{analytics['start']} ~ {analytics['end']}（UTC日期）")
+        breakdown_cols = st.columns(2)
+        for col, key, label in ((breakdown_cols[0], "by_model", "model"), (breakdown_cols[1], "by_category", "category")):
+            with col:
+                st.markdown("**按模型**" if key == "by_model" else "**按分类**")
+                st.dataframe([
+                    {
+                        label: row[label] or "(未知)",
+                        "提问数": row["questions"],
+                        "点赞": row["thumbs_up"],
+                        "点踩": row["thumbs_down"],
+                        "满意率": _format_rate(row["satisfaction"]),
+                        "Token": row["total_tokens"],
+                        "P90耗时": _format_ms(row["latency_ms"]["p90"]),
+                    } for row in analytics[key]
+                ], use_container_width=True, hide_index=True)
+
     # 新增：Prompt设置
     with st.expander("Prompt设置"):
         load_prompt_settings()
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from admission import chat_admission, PRIORITY_BATCH
+from async_utils import run_blocking
+from config import Config
+from database import SessionLocal
+from db_writer import db_writer
+from memory_service import MemoryService
+from models import SessionSummary
+from token_counter import count_tokens, truncate_to_tokens, MESSAGE_OVERHEAD_TOKENS
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = "你是对话摘要助手。请将对话压缩为简洁的中文摘要，保留用户关心的问题、关键事实、数字和已给出的结论，不要添加新信息。"
+
+class HistoryService:
+    """会话历史组装：最近N轮原文保留，更早的轮次由后台折叠为滚动摘要，
+    使每轮注入提示词的历史token数有上限。
+    """
+
+    def __init__(self, memory_service: MemoryService, client):
+        self.memory_service = memory_service
+        self.client = client
+        self.model = Config.SUMMARY_MODEL_NAME
+        self.recent_messages = max(0, Config.HISTORY_RECENT_TURNS) * 2
+        self.token_budget = Config.HISTORY_TOKEN_BUDGET
+        self.summary_max_tokens = Config.HISTORY_SUMMARY_MAX_TOKENS
+        self._summarizing: Set[str] = set()
+
+    @staticmethod
+    def _to_chat_message(msg) -> Dict[str, str]:
+        role = "user" if msg.type == "human" else ("assistant" if msg.type == "ai" else "system")
+        content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content)
+        return {"role": role, "content": content}
+
+    def build_history(self, db: Session, session_id: str) -> List[Dict[str, str]]:
+        """构建注入提示词的历史消息：[摘要] + 尚未折叠进摘要的消息（在token预算内从新到旧保留）。
+        后台摘要滞后时，超出最近N轮但尚未摘要的消息仍以原文保留，不会从历史中丢失。
+        """
+        messages = self.memory_service.get_messages(session_id)
+        if not messages:
+            return []
+        history: List[Dict[str, str]] = []
+        budget = self.token_budget
+
+        summarized = 0
+        row = db.query(SessionSummary).filter(SessionSummary.session_id == session_id).first()
+        if row and row.summary and row.summarized_messages:
+            summarized = min(row.summarized_messages, len(messages))
+            summary = truncate_to_tokens(row.summary, self.summary_max_tokens, self.model)
+            history.append({"role": "system", "content": f"此前对话摘要：\n{summary}"})
+            budget -= count_tokens(summary, self.model) + MESSAGE_OVERHEAD_TOKENS
+
+        kept: List[Dict[str, str]] = []
+        for msg in reversed(messages[summarized:]):
+            chat_msg = self._to_chat_message(msg)
+            cost = count_tokens(chat_msg["content"], self.model) + MESSAGE_OVERHEAD_TOKENS
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append(chat_msg)
+        # 保证以用户消息开头，避免孤立的助手回复
+        kept.reverse()
+        while kept and kept[0]["role"] == "assistant":
+            kept.pop(0)
+        return history + kept
+
+    def schedule_summary(self, session_id: Optional[str]) -> None:
+        """一轮对话写入后调用：若有超出最近N轮且尚未摘要的消息，则在后台更新摘要"""
+        if not session_id or session_id in self._summarizing:
+            return
+        self._summarizing.add(session_id)
+        task = asyncio.get_running_loop().create_task(self._summarize(session_id))
+        task.add_done_callback(lambda _: self._summarizing.discard(session_id))
+
+    async def _summarize(self, session_id: str) -> None:
+        try:
+            pending = await run_blocking(self._load_pending, session_id)
+            if pending is None:
+                return
+            previous, to_fold, fold_upto = pending
+            transcript = "\n".join(
+                f"{'用户' if m['role'] == 'user' else '助手'}：{m['content']}" for m in to_fold
+            )
+            user_content = (f"已有摘要：\n{previous}\n\n" if previous else "") + f"新增对话：\n{transcript}\n\n请输出更新后的完整摘要。"
+            # 后台摘要按批量优先级排队，让位于交互式问答
+            async with chat_admission.slot(PRIORITY_BATCH):
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_content},
+                    ],
+                    temperature=0.2,
+                    max_tokens=self.summary_max_tokens,
+                )
+            summary = (response.choices[0].message.content or "").strip()
+            if summary:
+                await db_writer.run(self._save_summary, session_id, summary, fold_upto)
+        except Exception as e:
+            logger.warning(f"更新会话摘要失败 session_id={session_id}: {e}")
+
+    def _load_pending(self, session_id: str):
+        """返回(已有摘要, 待折叠消息, 折叠后的消息数)；无需更新时返回None"""
+        messages = self.memory_service.get_messages(session_id)
+        fold_upto = len(messages) - self.recent_messages
+        if fold_upto <= 0:
+            return None
+        db = SessionLocal()
+        try:
+            row = db.query(SessionSummary).filter(SessionSummary.session_id == session_id).first()
+            summarized = row.summarized_messages if row and row.summarized_messages else 0
+            if summarized >= fold_upto:
+                return None
+            previous = row.summary if row else None
+        finally:
+            db.close()
+        to_fold = [self._to_chat_message(m) for m in messages[summarized:fold_upto]]
+        return previous, to_fold, fold_upto
+
+    @staticmethod
+    def _save_summary(db, session_id: str, summary: str, summarized_messages: int) -> None:
+        row = db.query(SessionSummary).filter(SessionSummary.session_id == session_id).first()
+        if row is None:
+            row = SessionSummary(session_id=session_id)
+            db.add(row)
+        row.summary = summary
+        row.summarized_messages = summarized_messages
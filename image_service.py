@@ -0,0 +1,127 @@
+import base64
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow为可选依赖，未安装时只做格式识别、不做缩放压缩
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# 文件头魔数 → MIME类型
+_MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+# 多模态接口普遍直接接受的格式，其余格式一律转码为JPEG
+_PASSTHROUGH_MIMES = {"image/png", "image/jpeg", "image/webp", "image/gif"}
+
+def detect_mime(data: bytes) -> Optional[str]:
+    """按文件头识别图片真实格式，无法识别时返回None"""
+    for magic, mime in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+class ImagePreprocessor:
+    """图片问答的预处理：识别真实格式、按最长边缩放、按体积目标重新压缩，
+    并按内容哈希缓存处理结果（同一图片再次提问时直接复用data URL）。
+    """
+    # 逐级降低的JPEG压缩质量
+    JPEG_QUALITIES = (85, 75, 65, 55)
+    # 最低质量仍超出体积目标时，每轮继续缩小的比例与最多轮数
+    DOWNSCALE_FACTOR = 0.75
+    MAX_DOWNSCALE_ROUNDS = 4
+
+    def __init__(self, max_edge: int = None, target_bytes: int = None, cache_entries: int = None):
+        self.max_edge = Config.IMAGE_MAX_EDGE if max_edge is None else max_edge
+        self.target_bytes = Config.IMAGE_TARGET_BYTES if target_bytes is None else target_bytes
+        self.cache_entries = Config.IMAGE_CACHE_ENTRIES if cache_entries is None else cache_entries
+        self._cache: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, data: bytes) -> Tuple[str, Dict[str, Any]]:
+        """返回(data URL, 预处理日志)；CPU密集，应在CPU线程池中调用"""
+        start = time.perf_counter()
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None:
+                self._cache.move_to_end(digest)
+        if cached is not None:
+            data_url, info = cached
+            return data_url, dict(info, cache_hit=True, prepare_ms=round((time.perf_counter() - start) * 1000, 2))
+
+        mime = detect_mime(data)
+        info: Dict[str, Any] = {"sha256": digest, "original_bytes": len(data), "original_mime": mime}
+        if Image is not None:
+            try:
+                payload, mime = self._transcode(data, mime, info)
+            except Exception as e:
+                logger.warning(f"图片预处理失败，使用原图: {e}")
+                payload = data
+        else:
+            payload = data
+        mime = mime or "image/png"
+        info.update({"mime": mime, "prepared_bytes": len(payload)})
+        data_url = f"data:{mime};base64," + base64.b64encode(payload).decode("ascii")
+
+        if self.cache_entries > 0:
+            with self._lock:
+                self._cache[digest] = (data_url, info)
+                self._cache.move_to_end(digest)
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+        return data_url, dict(info, cache_hit=False, prepare_ms=round((time.perf_counter() - start) * 1000, 2))
+
+    def _transcode(self, data: bytes, mime: Optional[str], info: Dict[str, Any]) -> Tuple[bytes, Optional[str]]:
+        image = Image.open(io.BytesIO(data))
+        info["original_size"] = list(image.size)
+        # 已在尺寸与体积目标内且格式可直接使用：原样发送
+        if mime in _PASSTHROUGH_MIMES and max(image.size) <= self.max_edge and len(data) <= self.target_bytes:
+            info["size"] = list(image.size)
+            return data, mime
+
+        # 手机拍摄的照片按EXIF方向摆正；带透明通道的图铺白底后转JPEG
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        if max(image.size) > self.max_edge:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+
+        payload = b""
+        for _ in range(self.MAX_DOWNSCALE_ROUNDS + 1):
+            for quality in self.JPEG_QUALITIES:
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=quality, optimize=True)
+                payload = buffer.getvalue()
+                if len(payload) <= self.target_bytes:
+                    break
+            if len(payload) <= self.target_bytes:
+                break
+            image = image.resize((max(1, int(image.width * self.DOWNSCALE_FACTOR)), max(1, int(image.height * self.DOWNSCALE_FACTOR))), Image.LANCZOS)
+        info["size"] = list(image.size)
+        info["jpeg_quality"] = quality
+        return payload, "image/jpeg"
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._cache), "max_entries": self.cache_entries, "pillow": Image is not None}
@@ -1,4 +1,5 @@
 from sqlalchemy.orm import Session
+from config import setup_logging
 from database import SessionLocal, engine
 from models import Base, Knowledge
 from knowledge_service import KnowledgeService
@@ -40,4 +41,5 @@ def init_db():
     print("数据库初始化完成，示例数据已添加")
 
 if __name__ == "__main__":
+    setup_logging()
     init_db()
\ No newline at end of file
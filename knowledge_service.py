@@ -1,19 +1,25 @@
+from sqlalchemy import case, or_
 from sqlalchemy.orm import Session
 from models import Knowledge
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from embedding_service import EmbeddingService
 import numpy as np
-from vector_store import MilvusVectorStore
-import pdfplumber
+from vector_store import create_vector_store
 import io
 import re
+import time
+from answer_cache import answer_cache
+from config import Config
+from db_writer import db_writer
+from rerank_service import lexical_terms
 
 class KnowledgeService:
     """知识库管理服务"""
     
-    def __init__(self):
-        self.embedding_service = EmbeddingService()
-        self.vector_store = MilvusVectorStore()
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None, vector_store=None):
+        """未传入时各自创建（应用内通过container共享同一实例）"""
+        self.embedding_service = embedding_service or EmbeddingService()
+        self.vector_store = vector_store or create_vector_store()
     
     def create_knowledge(self, db: Session, title: str, content: str, category: str) -> Knowledge:
         """创建知识库条目并索引到Milvus"""
@@ -25,15 +31,8 @@ class KnowledgeService:
         except Exception as e:
             print(f"Warning: Failed to generate embedding: {e}")
         
-        db_knowledge = Knowledge(
-            title=title, 
-            content=content, 
-            category=category,
-            embedding=None  # 向量改用Milvus存储
-        )
-        db.add(db_knowledge)
-        db.commit()
-        db.refresh(db_knowledge)
+        # 经串行写入器写入（embedding已在事务外生成）
+        db_knowledge = db_writer.call(self._insert_knowledge, title, content, category)
         
         # 索引到Milvus
         try:
@@ -44,6 +43,19 @@ class KnowledgeService:
         
         return db_knowledge
 
+    @staticmethod
+    def _insert_knowledge(db: Session, title: str, content: str, category: str) -> Knowledge:
+        db_knowledge = Knowledge(
+            title=title, 
+            content=content, 
+            category=category,
+            embedding=None  # 向量改用Milvus存储
+        )
+        db.add(db_knowledge)
+        db.flush()
+        db.refresh(db_knowledge)
+        return db_knowledge
+
     def get_knowledge(self, db: Session, knowledge_id: int) -> Optional[Knowledge]:
         """根据ID获取知识库条目"""
         return db.query(Knowledge).filter(Knowledge.id == knowledge_id).first()
@@ -60,33 +72,49 @@ class KnowledgeService:
                         content: str = None, category: str = None) -> Optional[Knowledge]:
         """更新知识库条目并更新Milvus索引"""
         db_knowledge = db.query(Knowledge).filter(Knowledge.id == knowledge_id).first()
-        if db_knowledge:
-            if title is not None:
-                db_knowledge.title = title
-            if content is not None:
-                db_knowledge.content = content
-            if category is not None:
-                db_knowledge.category = category
-                
-            # 如果标题或内容有更新，重新生成embedding并更新Milvus
-            if title is not None or content is not None:
-                text_for_embedding = f"{db_knowledge.title} {db_knowledge.content}"
-                try:
-                    embedding = self.embedding_service.get_embedding(text_for_embedding)
-                    db_knowledge.embedding = None  # 不再在DB中存储
-                    db.commit()
-                    db.refresh(db_knowledge)
-                    # 更新Milvus索引（先删后插避免重复）
-                    try:
-                        self.vector_store.delete_by_id(db_knowledge.id)
-                    except Exception:
-                        pass
-                    self.vector_store.index(db_knowledge.id, embedding)
-                except Exception as e:
-                    print(f"Warning: Failed to generate embedding: {e}")
-            else:
-                db.commit()
-                db.refresh(db_knowledge)
+        if not db_knowledge:
+            return None
+        # 引用该条目的缓存答案失效
+        answer_cache.invalidate_knowledge(knowledge_id)
+
+        # 如果标题或内容有更新，先在事务外重新生成embedding
+        embedding = None
+        if title is not None or content is not None:
+            text_for_embedding = f"{db_knowledge.title if title is None else title} {db_knowledge.content if content is None else content}"
+            try:
+                embedding = self.embedding_service.get_embedding(text_for_embedding)
+            except Exception as e:
+                print(f"Warning: Failed to generate embedding: {e}")
+
+        db_knowledge = db_writer.call(self._write_update, knowledge_id, title, content, category)
+        if db_knowledge is not None and embedding is not None:
+            # 更新Milvus索引（先删后插避免重复）
+            try:
+                self.vector_store.delete_by_id(db_knowledge.id)
+            except Exception:
+                pass
+            try:
+                self.vector_store.index(db_knowledge.id, embedding)
+            except Exception as e:
+                print(f"Warning: Failed to upsert into Milvus: {e}")
+        return db_knowledge
+
+    @staticmethod
+    def _write_update(db: Session, knowledge_id: int, title: Optional[str], content: Optional[str],
+                      category: Optional[str]) -> Optional[Knowledge]:
+        db_knowledge = db.get(Knowledge, knowledge_id)
+        if db_knowledge is None:
+            return None
+        if title is not None:
+            db_knowledge.title = title
+        if content is not None:
+            db_knowledge.content = content
+        if category is not None:
+            db_knowledge.category = category
+        if title is not None or content is not None:
+            db_knowledge.embedding = None  # 不再在DB中存储
+        db.flush()
+        db.refresh(db_knowledge)
         return db_knowledge
 
     def delete_knowledge(self, db: Session, knowledge_id: int) -> bool:
@@ -94,31 +122,78 @@ class KnowledgeService:
         db_knowledge = db.query(Knowledge).filter(Knowledge.id == knowledge_id).first()
         if not db_knowledge:
             return False
+        answer_cache.invalidate_knowledge(knowledge_id)
         try:
             self.vector_store.delete_by_id(knowledge_id)
         except Exception:
             pass
-        db.delete(db_knowledge)
-        db.commit()
-        return True
+        return db_writer.call(self._write_delete, knowledge_id)
+
+    @staticmethod
+    def _write_delete(db: Session, knowledge_id: int) -> bool:
+        deleted = db.query(Knowledge).filter(Knowledge.id == knowledge_id).delete(synchronize_session=False)
+        return deleted > 0
     
-    def search_knowledge_by_embedding(self, db: Session, query_embedding: np.ndarray, top_k: int = 5) -> List[tuple]:
+    def search_knowledge_by_embedding(self, db: Session, query_embedding: np.ndarray, top_k: int = 5, timings: Optional[Dict[str, float]] = None) -> List[tuple]:
         """基于Milvus搜索最相关的知识库条目，返回[(Knowledge, similarity), ...]"""
-        results: List[Tuple[int, float]] = self.vector_store.search(query_embedding, top_k=top_k)
-        out: List[Tuple[Knowledge, float]] = []
-        for kid, score in results:
-            knowledge = db.query(Knowledge).filter(Knowledge.id == kid).first()
-            if knowledge:
-                # 将相似度限制在0-1之间（COSINE通常0~1，按需调整）
-                sim = max(0.0, min(1.0, score))
-                out.append((knowledge, sim))
+        return self.search_knowledge_by_embeddings(db, [query_embedding], top_k=top_k, timings=timings)[0]
+
+    def search_knowledge_by_embeddings(self, db: Session, query_embeddings: List[np.ndarray], top_k: int = 5, timings: Optional[Dict[str, float]] = None) -> List[List[tuple]]:
+        """批量检索：一次Milvus请求、一次数据库查询，按输入顺序返回每个查询的[(Knowledge, similarity), ...]；
+        传入timings时写入向量检索与数据库取回的耗时（秒）
+        """
+        start = time.perf_counter()
+        results: List[List[Tuple[int, float]]] = self.vector_store.search_batch(query_embeddings, top_k=top_k)
+        if timings is not None:
+            timings["vector_search"] = time.perf_counter() - start
+        ids = {kid for hits in results for kid, _ in hits}
+        if not ids:
+            return [[] for _ in query_embeddings]
+        # 一次查询取回全部命中条目，按向量检索顺序输出
+        start = time.perf_counter()
+        rows = db.query(Knowledge).filter(Knowledge.id.in_(ids)).all()
+        if timings is not None:
+            timings["db_fetch"] = time.perf_counter() - start
+        by_id = {k.id: k for k in rows}
+        out: List[List[Tuple[Knowledge, float]]] = []
+        for hits in results:
+            matched: List[Tuple[Knowledge, float]] = []
+            for kid, score in hits:
+                knowledge = by_id.get(kid)
+                if knowledge:
+                    # 将相似度限制在0-1之间（COSINE通常0~1，按需调整）
+                    sim = max(0.0, min(1.0, score))
+                    matched.append((knowledge, sim))
+            out.append(matched)
         return out
 
+    def search_knowledge_by_terms(self, db: Session, query: str, top_k: int = 5) -> List[Tuple[Knowledge, float]]:
+        """词面检索：以查询的二元组与英文单词从数据库召回候选，按命中查询词项的比例打分，返回[(Knowledge, score), ...]"""
+        terms = lexical_terms(query)
+        # 单个汉字过于宽泛，只用多字符词项召回
+        recall_terms = [t for t in terms if len(t) > 1] or list(terms)
+        if not recall_terms:
+            return []
+        filters = [Knowledge.title.contains(t) | Knowledge.content.contains(t) for t in recall_terms]
+        # 候选按命中的召回词项数在SQL中排序后再截断，匹配条目超过候选上限时不会丢掉最相关的条目
+        matched = sum(case((f, 1), else_=0) for f in filters)
+        rows = (
+            db.query(Knowledge)
+            .filter(or_(*filters))
+            .order_by(matched.desc(), Knowledge.id)
+            .limit(Config.HYBRID_LEXICAL_CANDIDATES)
+            .all()
+        )
+        scored = [(k, len(terms & lexical_terms(f"{k.title} {k.content}")) / len(terms)) for k in rows]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:top_k]
+
     def parse_pdf(self, file_bytes: bytes, regex: Optional[str] = None, max_chunk_chars: int = 2000) -> List[str]:
         """解析PDF文本并按规则切分为段落。
         - 若提供regex，则按该正则作为“段落标题”进行切分（如：第XXX条）
         - 若未提供regex，则自动检测包含“第...条”的模式，否则退回空行切分
         """
+        import pdfplumber  # 只有导入PDF时才需要
         with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
             full_text_parts: List[str] = []
             for page in pdf.pages:
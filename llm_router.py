@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import openai
+
+from config import Config
+from metrics import UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+class LLMEndpoint:
+    """一个OpenAI兼容的上游端点及其滑动窗口健康统计"""
+    # 错误率为100%时计入评分的惩罚秒数
+    ERROR_PENALTY_SECONDS = 10.0
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str, window: int):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.client = openai.AsyncOpenAI(base_url=base_url, api_key=api_key)
+        # 最近window次调用：(是否成功, 总耗时秒, 首token耗时秒或None)
+        self._samples: deque = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        # 对冲中落败被取消的次数（不计入健康窗口）
+        self._abandoned = 0
+
+    def record_success(self, latency: float, ttft: Optional[float] = None) -> None:
+        self._samples.append((True, latency, ttft))
+        self._consecutive_failures = 0
+
+    def record_abandoned(self) -> None:
+        """对冲中落败被取消：结果未知，既不算成功也不算失败，不计入健康窗口"""
+        self._abandoned += 1
+
+    def record_failure(self, latency: float) -> None:
+        self._samples.append((False, latency, None))
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= Config.LLM_BREAKER_FAILURES:
+            # 连续失败后暂时熔断，冷却期内优先级降到最低
+            self._open_until = time.monotonic() + Config.LLM_BREAKER_COOLDOWN_SECONDS
+
+    @property
+    def circuit_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    def stats(self) -> Dict[str, Any]:
+        samples = list(self._samples)
+        ok = [s for s in samples if s[0]]
+        ttfts = [s[2] for s in ok if s[2] is not None]
+        return {
+            "name": self.name,
+            "model": self.model,
+            "requests": len(samples),
+            "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+            "avg_latency_ms": round(sum(s[1] for s in ok) / len(ok) * 1000, 2) if ok else None,
+            "avg_ttft_ms": round(sum(ttfts) / len(ttfts) * 1000, 2) if ttfts else None,
+            "abandoned": self._abandoned,
+            "circuit_open": self.circuit_open,
+        }
+
+    def score(self) -> float:
+        """健康评分（秒，越低越好）：平均首token耗时（无则用总耗时）加上按错误率计的惩罚；无样本时视为最优"""
+        samples = list(self._samples)
+        if not samples:
+            return 0.0
+        ok = [s for s in samples if s[0]]
+        error_rate = 1 - len(ok) / len(samples)
+        ttfts = [s[2] for s in ok if s[2] is not None]
+        if ttfts:
+            base = sum(ttfts) / len(ttfts)
+        elif ok:
+            base = sum(s[1] for s in ok) / len(ok)
+        else:
+            base = max(s[1] for s in samples)
+        return base + error_rate * self.ERROR_PENALTY_SECONDS
+
+def _load_endpoints() -> List[LLMEndpoint]:
+    """从LLM_ENDPOINTS（JSON数组）加载端点，未配置时使用BASE_URL/API_KEY/MODEL_NAME"""
+    window = Config.LLM_HEALTH_WINDOW
+    if Config.LLM_ENDPOINTS:
+        try:
+            items = json.loads(Config.LLM_ENDPOINTS)
+            endpoints = [
+                LLMEndpoint(
+                    name=item.get("name") or f"endpoint-{i}",
+                    base_url=item["base_url"],
+                    api_key=item.get("api_key", ""),
+                    model=item.get("model") or Config.MODEL_NAME,
+                    window=window,
+                )
+                for i, item in enumerate(items)
+            ]
+            if endpoints:
+                return endpoints
+        except Exception as e:
+            logger.error(f"解析LLM_ENDPOINTS失败，使用默认端点: {e}")
+    return [LLMEndpoint("default", Config.BASE_URL, Config.API_KEY, Config.MODEL_NAME, window)]
+
+class LLMRouter:
+    """多端点LLM路由：按滑动窗口内的首token耗时/延迟/错误率选择最健康的端点，
+    首token前出错自动切换下一个端点；流式调用超过首token期限时发起对冲请求，取先返回者。
+    路由决策写入调用方传入的route_log。
+    """
+
+    def __init__(self, endpoints: List[LLMEndpoint] = None):
+        self.endpoints = endpoints or _load_endpoints()
+        self.hedge_after = Config.LLM_HEDGE_TTFT_MS / 1000 if Config.LLM_HEDGE_TTFT_MS > 0 else None
+
+    @property
+    def primary(self) -> LLMEndpoint:
+        return self.endpoints[0]
+
+    def ordered(self) -> List[LLMEndpoint]:
+        """按健康度排序（熔断中的端点排在最后，同分时保持配置顺序）"""
+        return sorted(self.endpoints, key=lambda e: (e.circuit_open, e.score()))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [e.stats() for e in self.endpoints]
+
+    async def _race(self, open_fn, route_log: Dict[str, Any], hedge_after: Optional[float] = None):
+        """按健康度依次尝试端点：出错时切换下一个（failover），
+        指定hedge_after时，超过该期限仍未返回则并行向下一个端点发起对冲请求（hedge），取先成功者。
+        返回(端点, open_fn结果, 开始时间)
+        """
+        candidates = self.ordered()
+        attempts = route_log.setdefault("attempts", [])
+        pending: Dict[asyncio.Task, Tuple[LLMEndpoint, float]] = {}
+        launched = 0
+        last_error: Optional[BaseException] = None
+
+        def launch(reason: str) -> None:
+            nonlocal launched
+            endpoint = candidates[launched]
+            launched += 1
+            task = asyncio.ensure_future(open_fn(endpoint))
+            pending[task] = (endpoint, time.perf_counter())
+            attempts.append({"endpoint": endpoint.name, "reason": reason})
+
+        winner = None
+        launch("primary")
+        try:
+            while pending and winner is None:
+                can_hedge = hedge_after is not None and launched < len(candidates)
+                done, _ = await asyncio.wait(pending, timeout=hedge_after if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过首token期限仍无输出：向下一个端点发起对冲请求
+                    route_log["hedged"] = True
+                    launch("hedge")
+                    continue
+                for task in done:
+                    endpoint, started = pending.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        latency = time.perf_counter() - started
+                        endpoint.record_failure(latency)
+                        UPSTREAM_ERRORS.inc(upstream="chat", endpoint=endpoint.name)
+                        attempts.append({"endpoint": endpoint.name, "status": "error", "latency_ms": round(latency * 1000, 2), "error": str(error)})
+                        logger.warning(f"LLM端点 {endpoint.name} 在首token前失败: {error}")
+                        last_error = error
+                        if not pending and launched < len(candidates):
+                            # 首token前失败：切换到下一个端点
+                            launch("failover")
+                    elif winner is None:
+                        winner = (endpoint, task.result(), started)
+                    else:
+                        # 同时完成的落后一方直接丢弃
+                        await self._discard(task.result())
+        finally:
+            for task, (endpoint, started) in pending.items():
+                task.cancel()
+                if winner is not None:
+                    endpoint.record_abandoned()
+                    attempts.append({"endpoint": endpoint.name, "status": "abandoned",
+                                     "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)})
+        if winner is None:
+            raise last_error or RuntimeError("没有可用的LLM端点")
+        endpoint = winner[0]
+        route_log["endpoint"] = endpoint.name
+        route_log["model"] = endpoint.model
+        return winner
+
+    @staticmethod
+    async def _discard(result: Any) -> None:
+        if isinstance(result, tuple):
+            await result[0].close()
+
+    async def complete(self, messages: List[Dict[str, Any]], route_log: Dict[str, Any], **kwargs) -> Tuple[Any, LLMEndpoint]:
+        """非流式调用，返回(响应, 实际使用的端点)。
+        open_fn要等待完整回答，耗时与回答长度相关而非首token耗时，因此只做failover不做对冲，
+        否则较长的回答都会被重复请求一次。
+        """
+        async def open_fn(endpoint: LLMEndpoint):
+            return await endpoint.client.chat.completions.create(model=endpoint.model, messages=messages, **kwargs)
+
+        endpoint, response, started = await self._race(open_fn, route_log)
+        latency = time.perf_counter() - started
+        endpoint.record_success(latency)
+        route_log["attempts"].append({"endpoint": endpoint.name, "status": "success", "latency_ms": round(latency * 1000, 2)})
+        return response, endpoint
+
+    @staticmethod
+    async def _open_stream(endpoint: LLMEndpoint, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]):
+        """打开流并读取到第一个内容token为止，返回(stream, 迭代器, 已读取的chunk)"""
+        stream = await endpoint.client.chat.completions.create(model=endpoint.model, messages=messages, stream=True, **kwargs)
+        iterator = stream.__aiter__()
+        buffered = []
+        try:
+            while True:
+                chunk = await iterator.__anext__()
+                buffered.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except StopAsyncIteration:
+            pass
+        except BaseException:
+            await stream.close()
+            raise
+        return stream, iterator, buffered
+
+    async def stream(self, messages: List[Dict[str, Any]], route_log: Dict[str, Any], **kwargs) -> AsyncIterator[Any]:
+        """流式调用，逐个产出上游chunk；首token之后的错误不再切换端点，直接抛出"""
+        # _open_stream读到首个内容token即返回，对冲期限对应的正是首token耗时
+        endpoint, (stream, iterator, buffered), started = await self._race(
+            lambda e: self._open_stream(e, messages, kwargs), route_log, self.hedge_after
+        )
+        ttft = time.perf_counter() - started
+        route_log["ttft_ms"] = round(ttft * 1000, 2)
+        try:
+            for chunk in buffered:
+                yield chunk
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            endpoint.record_failure(time.perf_counter() - started)
+            UPSTREAM_ERRORS.inc(upstream="chat", endpoint=endpoint.name)
+            route_log["attempts"].append({"endpoint": endpoint.name, "status": "error", "phase": "streaming", "error": str(e)})
+            raise
+        finally:
+            await stream.close()
+        endpoint.record_success(time.perf_counter() - started, ttft)
+        route_log["attempts"].append({"endpoint": endpoint.name, "status": "success", "ttft_ms": round(ttft * 1000, 2)})
+
+    async def aclose(self) -> None:
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
@@ -1,55 +1,158 @@
-from fastapi import FastAPI, Depends, HTTPException, Response, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from typing import List, AsyncGenerator
+from typing import List, Optional, AsyncGenerator
+from contextlib import asynccontextmanager
+import itertools
 import json
+import os
 import asyncio
+import logging
 import uuid
 
-from database import engine, get_db
-from models import Base
-from schemas import KnowledgeCreate, KnowledgeResponse, QARequest, QAResponse, QAResult, FeedbackCreate, PDFImportResult, PDFParseResult, ChunksImportRequest, SessionResponse, SessionListResponse, PromptSettings
-from knowledge_service import KnowledgeService
-from qa_service import QAService
-from settings_service import SettingsService
-from memory_service import MemoryService
-from datetime import datetime
+from config import Config, log_config, setup_logging
+from database import get_db
+from schemas import KnowledgeCreate, KnowledgeResponse, QARequest, QAResponse, QAResult, FeedbackCreate, PDFImportResult, PDFParseResult, ChunksImportRequest, SessionResponse, SessionListResponse, PromptSettings, BatchQARequest
+from container import container, ServiceUnavailableError
+from async_utils import run_blocking, run_cpu_bound, shutdown_executors
+from db_writer import db_writer
+from qa_record_writer import qa_record_writer
+from admission import chat_admission, embedding_admission, OverloadedError
+from metrics import prompt_cache_stats, render_prometheus
+from profiling import RequestProfile, admin_token_valid, profile_store, start_profile
+from datetime import date, datetime
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+setup_logging()
+
+# 服务由container在首次使用时创建（启动后在后台预热），导入本模块不连接Milvus或上游服务
+
+async def expire_sessions_periodically():
+    """定期清理闲置超过TTL的会话"""
+    while True:
+        try:
+            await run_blocking(lambda: container.memory_service.expire_idle_sessions())
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"清理过期会话失败: {e}")
+        await asyncio.sleep(Config.SESSION_EXPIRE_INTERVAL_SECONDS)
+
+async def archive_records_periodically():
+    """定期归档超过保留期的问答记录并增量回收空间"""
+    while True:
+        try:
+            await run_blocking(lambda: container.retention_service.run_once())
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"归档问答记录失败: {e}")
+        await asyncio.sleep(Config.RETENTION_INTERVAL_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_config()
+    # 创建数据库表（已有库补建新增的索引）
+    container.init_database()
+    # 在后台创建服务并连接向量库，应用立即开始接收请求（/readyz在服务创建完成后返回就绪）
+    warm_up_task = container.start_warm_up()
+    expire_task = asyncio.create_task(expire_sessions_periodically()) if Config.SESSION_TTL_DAYS > 0 else None
+    retention_task = asyncio.create_task(archive_records_periodically()) if Config.QA_RETENTION_DAYS > 0 else None
+    # 重放上次遗留的问答记录溢出文件并预留id
+    qa_record_writer.start()
+    yield
+    for task in (expire_task, retention_task):
+        if task is not None:
+            task.cancel()
+    await asyncio.gather(warm_up_task, return_exceptions=True)
+    # 关闭异步客户端，写完排队的问答记录与其他写操作，再关闭线程池
+    await container.aclose()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, qa_record_writer.close)
+    await loop.run_in_executor(None, db_writer.close)
+    shutdown_executors()
+
+# 不依赖服务的接口，预热期间直接响应
+_NO_SERVICE_PATHS = {"/", "/healthz", "/readyz", "/metrics"}
+
+class WaitForServicesMiddleware:
+    """服务创建完成前到达的请求先等待预热中的服务创建，避免在事件循环中同步创建服务而阻塞所有请求"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in _NO_SERVICE_PATHS:
+            await container.wait_services()
+        await self.app(scope, receive, send)
 
 # 创建FastAPI应用
-app = FastAPI(title="本地知识库问答系统", version="1.0.0")
+app = FastAPI(title="本地知识库问答系统", version="1.0.0", lifespan=lifespan)
+app.add_middleware(WaitForServicesMiddleware)
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """上游过载：快速返回429并给出Retry-After"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "upstream": exc.upstream, "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(request: Request, exc: ServiceUnavailableError):
+    """服务创建失败（如缺少必需配置）：返回503与失败原因，不在请求中重新创建"""
+    return JSONResponse(status_code=503, content={"detail": str(exc), "service": exc.service})
+
+def _require_admin(request: Request) -> None:
+    if not admin_token_valid(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="需要有效的X-Admin-Token（未配置ADMIN_TOKEN时管理接口关闭）")
+
+def _start_profile(request: Request, endpoint: str) -> Optional[RequestProfile]:
+    """请求头X-Profile: 1（或查询参数profile=1）且携带管理员令牌时，对本次请求做采样剖析；未要求时返回None"""
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    if not flag or flag.lower() in ("0", "false"):
+        return None
+    _require_admin(request)
+    return start_profile(endpoint)
 
-# 初始化服务
-knowledge_service = KnowledgeService()
-qa_service = QAService()
-settings_service = SettingsService()
-memory_service = MemoryService()
+async def _save_profile(profile: RequestProfile, qa_record_id: Optional[int] = None, status: str = "ok") -> None:
+    try:
+        await run_blocking(profile_store.save, profile, qa_record_id, status)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"保存请求剖析失败: {e}")
 
 @app.get("/")
 async def root():
     return {"message": "欢迎使用本地知识库问答系统"}
 
+# 存活与就绪检查
+@app.get("/healthz")
+async def healthz():
+    """存活检查：进程与事件循环正常即返回200，不检查外部依赖"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """就绪检查：数据库可用且服务已完成预热时返回200（向量库或LLM端点不可用时status为degraded），否则返回503"""
+    result = await run_blocking(container.readiness)
+    return JSONResponse(status_code=200 if result["ready"] else 503, content=result)
+
 # 知识库管理接口
 @app.post("/knowledge/", response_model=KnowledgeResponse)
 async def create_knowledge(knowledge: KnowledgeCreate, db: Session = Depends(get_db)):
     """创建知识库条目"""
-    db_knowledge = knowledge_service.create_knowledge(
-        db, knowledge.title, knowledge.content, knowledge.category
+    db_knowledge = await run_blocking(
+        container.knowledge_service.create_knowledge, db, knowledge.title, knowledge.content, knowledge.category
     )
     return db_knowledge
 
 @app.get("/knowledge/", response_model=List[KnowledgeResponse])
 async def read_knowledges(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """获取知识库条目列表"""
-    knowledges = knowledge_service.get_knowledges(db, skip=skip, limit=limit)
+    knowledges = await run_blocking(container.knowledge_service.get_knowledges, db, skip=skip, limit=limit)
     return knowledges
 
 @app.get("/knowledge/{knowledge_id}", response_model=KnowledgeResponse)
 async def read_knowledge(knowledge_id: int, db: Session = Depends(get_db)):
     """获取指定知识库条目"""
-    db_knowledge = knowledge_service.get_knowledge(db, knowledge_id)
+    db_knowledge = await run_blocking(container.knowledge_service.get_knowledge, db, knowledge_id)
     if db_knowledge is None:
         raise HTTPException(status_code=404, detail="Knowledge not found")
     return db_knowledge
@@ -57,8 +160,8 @@ async def read_knowledge(knowledge_id: int, db: Session = Depends(get_db)):
 @app.put("/knowledge/{knowledge_id}", response_model=KnowledgeResponse)
 async def update_knowledge(knowledge_id: int, knowledge: KnowledgeCreate, db: Session = Depends(get_db)):
     """更新知识库条目"""
-    db_knowledge = knowledge_service.update_knowledge(
-        db, knowledge_id, knowledge.title, knowledge.content, knowledge.category
+    db_knowledge = await run_blocking(
+        container.knowledge_service.update_knowledge, db, knowledge_id, knowledge.title, knowledge.content, knowledge.category
     )
     if db_knowledge is None:
         raise HTTPException(status_code=404, detail="Knowledge not found")
@@ -67,7 +170,7 @@ async def update_knowledge(knowledge_id: int, knowledge: KnowledgeCreate, db: Se
 @app.delete("/knowledge/{knowledge_id}")
 async def delete_knowledge(knowledge_id: int, db: Session = Depends(get_db)):
     """删除知识库条目"""
-    result = knowledge_service.delete_knowledge(db, knowledge_id)
+    result = await run_blocking(container.knowledge_service.delete_knowledge, db, knowledge_id)
     if not result:
         raise HTTPException(status_code=404, detail="Knowledge not found")
     return {"message": "Knowledge deleted successfully"}
@@ -76,83 +179,324 @@ async def delete_knowledge(knowledge_id: int, db: Session = Depends(get_db)):
 @app.post("/knowledge/parse-pdf", response_model=PDFParseResult)
 async def parse_pdf(file: UploadFile = File(...), regex: str = Form(""), max_chunk_chars: int = Form(2000)):
     data = await file.read()
-    chunks = knowledge_service.parse_pdf(file_bytes=data, regex=regex or None, max_chunk_chars=int(max_chunk_chars))
+    chunks = await run_cpu_bound(container.knowledge_service.parse_pdf, file_bytes=data, regex=regex or None, max_chunk_chars=int(max_chunk_chars))
     return {"filename": file.filename, "chunk_count": len(chunks), "chunks": chunks}
 
 # 上传并导入PDF（直接导入）
 @app.post("/knowledge/import-pdf", response_model=PDFImportResult)
-async def import_pdf(file: UploadFile = File(...), category: str = Form("文档导入"), max_chunk_chars: int = Form(1000), regex: str = Form(""), db: Session = Depends(get_db)):
+async def import_pdf(request: Request, response: Response, file: UploadFile = File(...), category: str = Form("文档导入"), max_chunk_chars: int = Form(1000), regex: str = Form(""), db: Session = Depends(get_db)):
     """上传并导入PDF，按段落切分并索引到Milvus（支持正则）"""
     data = await file.read()
-    result = knowledge_service.import_pdf(db, file_bytes=data, filename=file.filename, category=category, max_chunk_chars=int(max_chunk_chars), regex=regex or None)
-    return result
+    profile = _start_profile(request, "knowledge.import-pdf")
+    if profile is None:
+        return await _import_pdf(db, file.filename, data, category, max_chunk_chars, regex)
+    response.headers["X-Profile-Id"] = profile.id
+    status = "error"
+    try:
+        with profile.activate():
+            result = await _import_pdf(db, file.filename, data, category, max_chunk_chars, regex)
+        status = "ok"
+        return result
+    finally:
+        await _save_profile(profile, status=status)
+
+async def _import_pdf(db: Session, filename: str, data: bytes, category: str, max_chunk_chars: int, regex: str):
+    # PDF解析为CPU密集型，embedding与入库为阻塞I/O，分别放到对应线程池
+    chunks = await run_cpu_bound(container.knowledge_service.parse_pdf, file_bytes=data, regex=regex or None, max_chunk_chars=int(max_chunk_chars))
+    return await run_blocking(container.knowledge_service.import_chunks, db, filename=filename, chunks=chunks, category=category)
 
 # 导入人工编辑后的段落
 @app.post("/knowledge/import-chunks", response_model=PDFImportResult)
-async def import_chunks(payload: ChunksImportRequest, db: Session = Depends(get_db)):
-    result = knowledge_service.import_chunks(db, filename=payload.filename, chunks=payload.chunks, category=payload.category)
-    return result
+async def import_chunks(payload: ChunksImportRequest, request: Request, response: Response, db: Session = Depends(get_db)):
+    profile = _start_profile(request, "knowledge.import-chunks")
+    if profile is None:
+        return await run_blocking(container.knowledge_service.import_chunks, db, filename=payload.filename, chunks=payload.chunks, category=payload.category)
+    response.headers["X-Profile-Id"] = profile.id
+    status = "error"
+    try:
+        with profile.activate():
+            result = await run_blocking(container.knowledge_service.import_chunks, db, filename=payload.filename, chunks=payload.chunks, category=payload.category)
+        status = "ok"
+        return result
+    finally:
+        await _save_profile(profile, status=status)
 
 # 问答接口（支持session_id）
 @app.post("/qa/ask", response_model=QAResult)
-async def ask_question(qa_request: QARequest, db: Session = Depends(get_db)):
+async def ask_question(qa_request: QARequest, request: Request, response: Response, db: Session = Depends(get_db)):
     """提问并获取答案（支持会话记忆）"""
-    qa_result = qa_service.ask_question(db, qa_request.question, session_id=qa_request.session_id)
-    return qa_result
+    profile = _start_profile(request, "qa.ask")
+    if profile is None:
+        return await container.qa_service.ask_question(db, qa_request.question, session_id=qa_request.session_id)
+    # 剖析结果按问答记录id关联，响应头X-Profile-Id给出剖析id
+    response.headers["X-Profile-Id"] = profile.id
+    qa_result = None
+    try:
+        with profile.activate():
+            qa_result = await container.qa_service.ask_question(db, qa_request.question, session_id=qa_request.session_id)
+        return qa_result
+    finally:
+        await _save_profile(profile, qa_record_id=qa_result["id"] if qa_result else None, status="ok" if qa_result else "error")
 
 @app.post("/qa/ask-stream")
-async def ask_question_stream(qa_request: QARequest, db: Session = Depends(get_db)):
-    """流式提问并获取答案（支持会话记忆）"""
-    async def generate_stream():
-        # 生成流式响应
-        for chunk in qa_service.ask_question_stream(db, qa_request.question, session_id=qa_request.session_id):
-            yield chunk
-            
-    return StreamingResponse(generate_stream(), media_type="text/plain")
+async def ask_question_stream(qa_request: QARequest, request: Request, db: Session = Depends(get_db)):
+    """流式提问并获取答案（支持会话记忆）
+    以NDJSON逐行返回事件：retrieval（检索结果）→ delta（答案增量）→ done（问答记录与过程日志），生成失败时done之前有error事件
+    """
+    profile = _start_profile(request, "qa.ask-stream")
+    events = container.qa_service.ask_question_stream(db, qa_request.question, session_id=qa_request.session_id)
+    if profile is None:
+        # 先取出首个事件：检索与准入预检在响应开始前完成，过载时由异常处理返回429
+        first = await events.__anext__()
+
+        async def generate_stream():
+            yield json.dumps(jsonable_encoder(first), ensure_ascii=False) + "\n"
+            async for event in events:
+                yield json.dumps(jsonable_encoder(event), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(generate_stream(), media_type="application/x-ndjson")
+
+    # 剖析覆盖首个事件之前的检索与整个流式生成过程，直到done事件（问答记录已持久化）
+    try:
+        with profile.activate():
+            first = await events.__anext__()
+    except BaseException:
+        await _save_profile(profile, status="error")
+        raise
+
+    async def generate_profiled_stream():
+        qa_record_id = None
+        try:
+            yield json.dumps(jsonable_encoder(first), ensure_ascii=False) + "\n"
+            with profile.activate():
+                async for event in events:
+                    if event.get("type") == "done":
+                        qa_record_id = event.get("id")
+                    yield json.dumps(jsonable_encoder(event), ensure_ascii=False) + "\n"
+        finally:
+            await _save_profile(profile, qa_record_id=qa_record_id, status="ok" if qa_record_id else "error")
+
+    return StreamingResponse(generate_profiled_stream(), media_type="application/x-ndjson", headers={"X-Profile-Id": profile.id})
+
+# 批量问答接口
+class BatchStreamingResponse(StreamingResponse):
+    """已占用（claim）的批量任务的NDJSON事件流。
+    占用在响应结束时释放，而不是在事件流内部：客户端在响应开始前断开或首次发送失败时，
+    事件流从未开始迭代，其finally不会执行，占用也就不会随之释放
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.events = container.batch_service.run_job(job_id)
+
+        async def generate_stream():
+            async for event in self.events:
+                yield json.dumps(jsonable_encoder(event), ensure_ascii=False) + "\n"
+        super().__init__(generate_stream(), media_type="application/x-ndjson", headers={"X-Batch-Job-Id": job_id})
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 不随请求取消而中止：先关闭事件流（已开始时执行run_job的收尾，标记中断），再释放占用
+            await asyncio.shield(self._close())
+
+    async def _close(self):
+        try:
+            await self.body_iterator.aclose()
+            await self.events.aclose()
+        finally:
+            container.batch_service.release(self.job_id)
+
+@app.post("/qa/batch")
+async def create_batch(payload: BatchQARequest):
+    """创建批量问答任务并以NDJSON流式返回：job（任务信息）→ result（每题完成时）→ done（最终进度）。
+    连接中断后可通过 /qa/batch/{job_id}/resume 继续未完成的问题
+    """
+    if len(payload.questions) > Config.BATCH_QA_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"单个批量任务最多{Config.BATCH_QA_MAX_QUESTIONS}个问题")
+    job = await run_blocking(container.batch_service.create_job, payload.questions, payload.concurrency)
+    container.batch_service.claim(job.id)
+    return BatchStreamingResponse(job.id)
+
+@app.post("/qa/batch/{job_id}/resume")
+async def resume_batch(job_id: str, db: Session = Depends(get_db)):
+    """继续执行批量任务中尚未完成（或失败）的问题"""
+    job = await run_blocking(container.batch_service.get_job, db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    # 在返回响应前占用任务，并发的继续请求中只有一个会执行；占用在响应结束时释放
+    if not container.batch_service.claim(job_id):
+        raise HTTPException(status_code=409, detail="Batch job is already running")
+    return BatchStreamingResponse(job_id)
+
+@app.get("/qa/batch/{job_id}")
+async def get_batch(job_id: str, db: Session = Depends(get_db)):
+    """查询批量任务进度与每题状态"""
+    job = await run_blocking(container.batch_service.get_job, db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
 
 # 图片理解接口
 @app.post("/qa/ask-image", response_model=QAResponse)
 async def ask_image(question: str = Form("请描述这张图片"), image: UploadFile = File(...), session_id: str = Form("") , db: Session = Depends(get_db)):
     data = await image.read()
-    res = qa_service.ask_image_question(db, question=question, image_bytes=data, session_id=(session_id or None))
+    res = await container.qa_service.ask_image_question(db, question=question, image_bytes=data, session_id=(session_id or None))
     # 兼容QAResponse结构（无retrieved_knowledges）
     return {
         "id": 0,
         "question": question,
         "answer": res["answer"],
         "created_at": datetime.utcnow(),
-        "model_used": qa_service.image_model,
+        "model_used": container.qa_service.image_model,
         "process_log": res["process_log"],
         "人工介入": False,
     }
 
+@app.post("/qa/ask-image-stream")
+async def ask_image_stream(question: str = Form("请描述这张图片"), image: UploadFile = File(...), session_id: str = Form(""), db: Session = Depends(get_db)):
+    """流式图片理解问答，以NDJSON逐行返回事件：image（预处理结果）→ delta（答案增量）→ done（完整答案与过程日志）"""
+    data = await image.read()
+    events = container.qa_service.ask_image_question_stream(db, question=question, image_bytes=data, session_id=(session_id or None))
+    first = await events.__anext__()
+
+    async def generate_stream():
+        yield json.dumps(jsonable_encoder(first), ensure_ascii=False) + "\n"
+        async for event in events:
+            yield json.dumps(jsonable_encoder(event), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate_stream(), media_type="application/x-ndjson")
+
 # 反馈接口
 @app.post("/qa/feedback")
-async def add_feedback(feedback: FeedbackCreate, db: Session = Depends(get_db)):
+async def add_feedback(feedback: FeedbackCreate):
     """添加反馈"""
-    qa_service.add_feedback(db, feedback.qa_record_id, feedback.is_useful, feedback.comment)
+    await container.qa_service.add_feedback(feedback.qa_record_id, feedback.is_useful, feedback.comment)
     return {"message": "Feedback added successfully"}
 
 # 会话管理接口
 @app.post("/sessions", response_model=SessionResponse)
 async def create_session():
     sid = str(uuid.uuid4())
+    await run_blocking(container.memory_service.create_session, sid)
     return {"session_id": sid}
 
 @app.get("/sessions", response_model=SessionListResponse)
-async def list_sessions():
-    return {"sessions": memory_service.list_sessions()}
+async def list_sessions(limit: int = 50, before: Optional[datetime] = None, before_id: Optional[str] = None):
+    """按最近活跃时间倒序分页列出会话，before/before_id为上一页返回的next_before/next_before_id游标"""
+    limit = max(1, min(limit, 200))
+    items, cursor = await run_blocking(container.memory_service.list_sessions, limit=limit, before=before, before_id=before_id)
+    next_before, next_before_id = cursor or (None, None)
+    return {"sessions": [s.session_id for s in items], "items": items, "next_before": next_before, "next_before_id": next_before_id}
 
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
-    memory_service.clear_session(session_id)
+    await run_blocking(container.memory_service.clear_session, session_id)
     return {"message": "Session cleared"}
 
 # Prompt设置接口
 @app.get("/settings/prompt", response_model=PromptSettings)
 async def get_prompt_settings(db: Session = Depends(get_db)):
-    return settings_service.get_prompt_settings(db)
+    return await run_blocking(container.settings_service.get_prompt_settings, db)
 
 @app.put("/settings/prompt", response_model=PromptSettings)
 async def update_prompt_settings(payload: PromptSettings, db: Session = Depends(get_db)):
-    return settings_service.update_prompt_settings(db, payload.system_prompt, payload.answer_prompt)
\ No newline at end of file
+    return await run_blocking(container.settings_service.update_prompt_settings, db, payload.system_prompt, payload.answer_prompt)
+# 运行状态
+@app.get("/stats")
+async def stats():
+    """准入控制（并发、排队深度、等待耗时、拒绝数）、LLM端点健康、答案缓存、提示词前缀缓存命中与并发合并的运行统计"""
+    return {
+        "admission": {"chat": chat_admission.stats(), "embedding": embedding_admission.stats()},
+        "llm_endpoints": container.qa_service.router.stats(),
+        "answer_cache": container.qa_service.answer_cache.stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "coalescing": container.qa_service.coalescing_stats(),
+    }
+
+# 问答统计
+@app.get("/analytics")
+async def analytics(days: int = 30, model: Optional[str] = None, category: Optional[str] = None):
+    """最近days天按天、模型与分类的提问数、点赞/点踩、token用量与耗时分位数（读取预先聚合的统计，与历史数据量无关）"""
+    return await run_blocking(container.analytics_service.summary, days, model, category)
+
+# Prometheus指标
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus文本格式：问答各阶段耗时、首token耗时与生成速度直方图，
+    答案缓存命中、检索回退、上游错误与token用量计数，以及准入控制的排队状态
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# 问答记录归档（需X-Admin-Token）
+@app.get("/qa/archive")
+async def read_archive(request: Request, start: Optional[date] = None, end: Optional[date] = None, q: Optional[str] = None,
+                       record_id: Optional[int] = None, limit: int = 100, offset: int = 0):
+    """按日期范围读取已归档的问答记录，可按关键词（问题或答案包含）与记录id过滤"""
+    _require_admin(request)
+
+    def read():
+        items = []
+        for i, record in enumerate(container.retention_service.store.iter_records(start, end, keyword=q, record_id=record_id)):
+            if i < offset:
+                continue
+            items.append(record)
+            if len(items) >= limit:
+                break
+        return items
+
+    return {"records": await run_blocking(read), "offset": offset, "limit": limit}
+
+@app.get("/qa/archive/export")
+async def export_archive(request: Request, start: Optional[date] = None, end: Optional[date] = None, q: Optional[str] = None):
+    """以NDJSON流式导出日期范围内的归档记录"""
+    _require_admin(request)
+    records = container.retention_service.store.iter_records(start, end, keyword=q)
+
+    async def generate_stream():
+        # 分块在线程池中解压读取，不阻塞事件循环
+        while True:
+            chunk = await run_blocking(lambda: list(itertools.islice(records, 500)))
+            if not chunk:
+                break
+            yield "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in chunk)
+
+    filename = f"qa_records_{start or 'all'}_{end or 'all'}.jsonl"
+    return StreamingResponse(generate_stream(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/admin/retention")
+async def retention_status(request: Request):
+    """保留策略、归档分区与数据库空闲页状态"""
+    _require_admin(request)
+    return await run_blocking(container.retention_service.status)
+
+@app.post("/admin/retention/run")
+async def run_retention(request: Request):
+    """立即执行一轮归档与空间回收"""
+    _require_admin(request)
+    return await run_blocking(container.retention_service.run_once)
+
+# 请求剖析管理接口（需X-Admin-Token）
+@app.get("/admin/profiles")
+async def list_profiles(request: Request, limit: int = 50, qa_record_id: Optional[int] = None):
+    """按时间倒序列出最近的请求剖析，可按问答记录id过滤"""
+    _require_admin(request)
+    return {"profiles": await run_blocking(profile_store.list, limit, qa_record_id)}
+
+@app.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, request: Request, format: str = "speedscope"):
+    """下载剖析文件：speedscope（可在speedscope.app中打开）或collapsed（折叠栈，可用于flamegraph.pl）"""
+    _require_admin(request)
+    path = profile_store.artifact_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if format == "speedscope" else "text/plain; charset=utf-8"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+# LLM端点健康状态
+@app.get("/llm/endpoints")
+async def llm_endpoints():
+    """各LLM端点滑动窗口内的请求数、错误率、平均延迟/首token耗时与熔断状态"""
+    return {"endpoints": container.qa_service.router.stats()}
@@ -1,52 +1,228 @@
-from typing import List
-from langchain_community.chat_message_histories import SQLChatMessageHistory
-from langchain_core.messages import BaseMessage
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Tuple
+from sqlalchemy import select, inspect, func, or_, and_
+from sqlalchemy.orm import Session
 from config import Config
+from database import engine, SessionLocal
+from db_writer import db_writer
+from models import ChatMessageRecord, ChatSession, SessionSummary
+
+class ChatMessage:
+    """轻量会话消息（type为"human"/"ai"/"system"）"""
+    __slots__ = ("type", "content")
+
+    def __init__(self, type: str, content: Any):
+        self.type = type
+        self.content = content
+
+    def to_json(self) -> str:
+        # 与LangChain message_to_dict格式兼容
+        return json.dumps({"type": self.type, "data": {"content": self.content, "type": self.type}}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "ChatMessage":
+        data = json.loads(raw)
+        return cls(data.get("type", "human"), data.get("data", {}).get("content", ""))
 
 class MemoryService:
-    """LangChain基于SQLite的会话记忆服务，按session_id管理对话历史。"""
+    """基于SQLite的会话记忆服务，按session_id管理对话历史与会话目录。
+    复用应用的共享数据库引擎（连接池），并在内存中缓存最近活跃会话的消息（写穿透）。
+    缓存为进程内缓存：多进程部署时同一会话应路由到同一进程，或将MEMORY_CACHE_SESSIONS设为0。
+    """
+    _table_ready = False
+    _table_lock = threading.Lock()
+    # 会话标题取首条用户消息的前若干字
+    TITLE_MAX_CHARS = 30
+    # 每批清理的过期会话数
+    EXPIRE_BATCH_SIZE = 500
+
     def __init__(self):
-        # 使用同一SQLite数据库存储会话历史
-        # SQLChatMessageHistory 会自动创建所需的表
-        self.connection_string = Config.DATABASE_URL
+        self.max_cached_sessions = Config.MEMORY_CACHE_SESSIONS
+        self._cache: "OrderedDict[str, List[ChatMessage]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 写入计数：读取期间若有写入发生，则不缓存可能过期的读取结果
+        self._writes = 0
+        self._ensure_table()
+
+    @classmethod
+    def _ensure_table(cls) -> None:
+        """确保消息表、会话目录及索引存在（旧库由LangChain创建时无索引）；
+        首次创建会话目录时根据已有消息回填。
+        """
+        with cls._table_lock:
+            if cls._table_ready:
+                return
+            catalog_existed = inspect(engine).has_table(ChatSession.__tablename__)
+            for table in (ChatMessageRecord.__table__, ChatSession.__table__):
+                table.create(bind=engine, checkfirst=True)
+                for index in table.indexes:
+                    index.create(bind=engine, checkfirst=True)
+            if not catalog_existed:
+                cls._backfill_catalog()
+            cls._table_ready = True
+
+    @classmethod
+    def _backfill_catalog(cls) -> None:
+        db_writer.call(cls._write_backfill)
+
+    @staticmethod
+    def _write_backfill(db: Session) -> None:
+        now = datetime.utcnow()
+        rows = db.execute(
+            select(ChatMessageRecord.session_id, func.count(ChatMessageRecord.id))
+            .group_by(ChatMessageRecord.session_id)
+        ).all()
+        db.add_all([
+            ChatSession(session_id=sid, created_at=now, last_active_at=now, message_count=count)
+            for sid, count in rows if sid
+        ])
+
+    def create_session(self, session_id: str) -> None:
+        """在会话目录中登记新会话"""
+        db_writer.call(self._create_session, session_id)
+
+    @staticmethod
+    def _create_session(db: Session, session_id: str) -> None:
+        if db.get(ChatSession, session_id) is None:
+            now = datetime.utcnow()
+            db.add(ChatSession(session_id=session_id, created_at=now, last_active_at=now, message_count=0))
 
-    def get_history(self, session_id: str) -> SQLChatMessageHistory:
-        return SQLChatMessageHistory(session_id=session_id, connection_string=self.connection_string)
+    def get_messages(self, session_id: str) -> List[ChatMessage]:
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is not None:
+                self._cache.move_to_end(session_id)
+                return list(cached)
+            writes_before = self._writes
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(ChatMessageRecord.message)
+                .where(ChatMessageRecord.session_id == session_id)
+                .order_by(ChatMessageRecord.id)
+            ).scalars().all()
+        finally:
+            db.close()
+        messages = [ChatMessage.from_json(raw) for raw in rows]
+        self._put_cache(session_id, messages, writes_before)
+        return list(messages)
 
-    def get_messages(self, session_id: str) -> List[BaseMessage]:
-        return self.get_history(session_id).messages
+    def add_turn(self, session_id: str, user_content: str, ai_content: str) -> None:
+        """在同一事务中写入一轮问答（用户消息 + AI消息）"""
+        self._append(session_id, [ChatMessage("human", user_content), ChatMessage("ai", ai_content)])
 
     def add_user_message(self, session_id: str, content: str) -> None:
-        self.get_history(session_id).add_user_message(content)
+        self._append(session_id, [ChatMessage("human", content)])
 
     def add_ai_message(self, session_id: str, content: str) -> None:
-        self.get_history(session_id).add_ai_message(content)
+        self._append(session_id, [ChatMessage("ai", content)])
 
     def clear_session(self, session_id: str) -> None:
-        self.get_history(session_id).clear()
-
-    def list_sessions(self) -> List[str]:
-        """基于消息表的session_id去重列出会话；如无表则返回空。"""
-        import sqlite3
-        # 连接到SQLite数据库
-        if not self.connection_string.startswith("sqlite"):
-            return []
-        # 连接字符串格式为 sqlite:///./knowledge_qa.db
-        db_path = self.connection_string.replace("sqlite:///", "")
-        conn = sqlite3.connect(db_path)
+        self._delete_sessions([session_id])
+
+    def list_sessions(self, limit: int = 50, before: Optional[datetime] = None,
+                      before_id: Optional[str] = None) -> Tuple[List[ChatSession], Optional[Tuple[datetime, str]]]:
+        """按最近活跃时间倒序分页列出会话（基于索引的游标分页），返回(会话列表, 下一页游标)。
+        游标为(last_active_at, session_id)，活跃时间相同的会话在分页边界处不会被跳过。
+        """
+        db = SessionLocal()
         try:
-            cur = conn.cursor()
-            # 兼容可能的表名差异
-            sessions = set()
-            for table in ("message_store", "langchain_chat_messages"):
-                try:
-                    cur.execute(f"SELECT DISTINCT session_id FROM {table}")
-                    rows = cur.fetchall()
-                    for (sid,) in rows:
-                        if sid:
-                            sessions.add(sid)
-                except Exception:
-                    continue
-            return sorted(list(sessions))
+            query = db.query(ChatSession)
+            if before is not None:
+                if before_id is not None:
+                    query = query.filter(or_(
+                        ChatSession.last_active_at < before,
+                        and_(ChatSession.last_active_at == before, ChatSession.session_id < before_id),
+                    ))
+                else:
+                    query = query.filter(ChatSession.last_active_at < before)
+            rows = (
+                query.order_by(ChatSession.last_active_at.desc(), ChatSession.session_id.desc())
+                .limit(limit + 1)
+                .all()
+            )
+            db.expunge_all()
         finally:
-            conn.close()
\ No newline at end of file
+            db.close()
+        cursor = (rows[limit - 1].last_active_at, rows[limit - 1].session_id) if len(rows) > limit else None
+        return rows[:limit], cursor
+
+    def expire_idle_sessions(self, ttl_days: int = None) -> int:
+        """清理闲置超过TTL的会话（含消息与摘要），返回清理的会话数"""
+        ttl_days = Config.SESSION_TTL_DAYS if ttl_days is None else ttl_days
+        if ttl_days <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(days=ttl_days)
+        total = 0
+        while True:
+            db = SessionLocal()
+            try:
+                ids = db.execute(
+                    select(ChatSession.session_id)
+                    .where(ChatSession.last_active_at < cutoff)
+                    .limit(self.EXPIRE_BATCH_SIZE)
+                ).scalars().all()
+            finally:
+                db.close()
+            if not ids:
+                return total
+            self._delete_sessions(ids)
+            total += len(ids)
+
+    def _delete_sessions(self, session_ids: List[str]) -> None:
+        # 经串行写入器执行：批量清理过期会话不与问答写入争抢SQLite写锁
+        db_writer.call(self._delete_rows, session_ids)
+        with self._lock:
+            self._writes += 1
+            for sid in session_ids:
+                self._cache.pop(sid, None)
+
+    @staticmethod
+    def _delete_rows(db: Session, session_ids: List[str]) -> None:
+        """写函数：删除会话的消息、摘要与目录行"""
+        db.query(ChatMessageRecord).filter(ChatMessageRecord.session_id.in_(session_ids)).delete(synchronize_session=False)
+        db.query(SessionSummary).filter(SessionSummary.session_id.in_(session_ids)).delete(synchronize_session=False)
+        db.query(ChatSession).filter(ChatSession.session_id.in_(session_ids)).delete(synchronize_session=False)
+
+    def _touch_session(self, db: Session, session_id: str, messages: List[ChatMessage]) -> None:
+        """写消息时同步维护会话目录（与消息在同一事务中）"""
+        now = datetime.utcnow()
+        row = db.get(ChatSession, session_id)
+        if row is None:
+            row = ChatSession(session_id=session_id, created_at=now, message_count=0)
+            db.add(row)
+        row.last_active_at = now
+        row.message_count = (row.message_count or 0) + len(messages)
+        if not row.title:
+            first_user = next((m for m in messages if m.type == "human" and isinstance(m.content, str)), None)
+            if first_user:
+                row.title = first_user.content.strip()[:self.TITLE_MAX_CHARS]
+
+    def _write_messages(self, db: Session, session_id: str, messages: List[ChatMessage]) -> None:
+        db.add_all([ChatMessageRecord(session_id=session_id, message=m.to_json()) for m in messages])
+        self._touch_session(db, session_id, messages)
+
+    def _append(self, session_id: str, messages: List[ChatMessage]) -> None:
+        # 消息与会话目录在同一事务中写入，经串行写入器与其他写操作合并提交
+        db_writer.call(self._write_messages, session_id, messages)
+        # 写穿透：仅更新已缓存的会话，未缓存的会话下次读取时从库中加载
+        with self._lock:
+            self._writes += 1
+            cached = self._cache.get(session_id)
+            if cached is not None:
+                cached.extend(messages)
+                self._cache.move_to_end(session_id)
+
+    def _put_cache(self, session_id: str, messages: List[ChatMessage], writes_before: int) -> None:
+        if self.max_cached_sessions <= 0:
+            return
+        with self._lock:
+            if self._writes != writes_before:
+                return
+            self._cache[session_id] = messages
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_cached_sessions:
+                self._cache.popitem(last=False)
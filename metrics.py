@@ -0,0 +1,195 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Tuple
+
+LabelValues = Tuple[str, ...]
+
+class Counter:
+    """进程内单调递增计数器，可按标签区分"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> List[Tuple[Dict[str, str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        if not items and not self.labelnames:
+            # 无标签计数器从0开始导出
+            items = [((), 0)]
+        return [(dict(zip(self.labelnames, key)), value) for key, value in items]
+
+class Histogram:
+    """进程内直方图（累积桶 + 总和 + 计数），按Prometheus约定导出"""
+    # 默认桶（秒），覆盖几毫秒的缓存命中到数十秒的长回答
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS))
+        # 每组标签：[各桶计数..., +Inf计数], 总和
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[Tuple[Dict[str, str], List[int], float]]:
+        """返回[(标签, 累积桶计数, 总和)]"""
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        out = []
+        for key, counts, total in items:
+            cumulative, running = [], 0
+            for count in counts:
+                running += count
+                cumulative.append(running)
+            out.append((dict(zip(self.labelnames, key)), cumulative, total))
+        return out
+
+class CallbackMetric:
+    """导出时才从回调取值的指标（如当前排队深度、准入控制器的累计拒绝数）"""
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], List[Tuple[Dict[str, str], float]]], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.kind = kind
+
+class MetricsRegistry:
+    """指标注册表：同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Counter(name, documentation, labelnames)
+                self._metrics[name] = metric
+            return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = None) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Histogram(name, documentation, labelnames, buckets)
+                self._metrics[name] = metric
+            return metric
+
+    def callback(self, name: str, documentation: str, fn: Callable[[], List[Tuple[Dict[str, str], float]]], kind: str = "gauge") -> CallbackMetric:
+        with self._lock:
+            metric = CallbackMetric(name, documentation, fn, kind)
+            self._metrics[name] = metric
+            return metric
+
+    def metrics(self) -> List[object]:
+        with self._lock:
+            return list(self._metrics.values())
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+def render_prometheus(reg: MetricsRegistry = None) -> str:
+    """按Prometheus文本格式（0.0.4）导出全部指标"""
+    lines: List[str] = []
+    for metric in (reg or registry).metrics():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        if isinstance(metric, Counter):
+            lines.append(f"# TYPE {metric.name} counter")
+            for labels, value in metric.samples():
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+        elif isinstance(metric, Histogram):
+            lines.append(f"# TYPE {metric.name} histogram")
+            for labels, cumulative, total in metric.samples():
+                for bound, count in zip(metric.buckets + (float("inf"),), cumulative):
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{metric.name}_bucket{_format_labels(dict(labels, le=le))} {count}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {cumulative[-1]}")
+        elif isinstance(metric, CallbackMetric):
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                samples = metric.fn()
+            except Exception:
+                samples = []
+            for labels, value in samples:
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# LLM token用量（按模型）；cached为上游前缀缓存命中的提示词token
+LLM_PROMPT_TOKENS = registry.counter("llm_prompt_tokens_total", "LLM prompt tokens", ("model",))
+LLM_CACHED_PROMPT_TOKENS = registry.counter("llm_cached_prompt_tokens_total", "LLM prompt tokens served from the provider prefix cache", ("model",))
+LLM_COMPLETION_TOKENS = registry.counter("llm_completion_tokens_total", "LLM completion tokens", ("model",))
+LLM_REQUESTS_WITH_USAGE = registry.counter("llm_requests_with_usage_total", "LLM calls that reported token usage", ("model",))
+
+# 问答各阶段耗时（秒）与整体耗时
+QA_STAGE_SECONDS = registry.histogram("qa_stage_seconds", "Time spent in each QA pipeline stage", ("stage",))
+QA_REQUEST_SECONDS = registry.histogram("qa_request_seconds", "End-to-end QA request latency", ("endpoint", "status"))
+# 流式生成的首token耗时与生成速度
+LLM_TTFT_SECONDS = registry.histogram("llm_ttft_seconds", "Time to first token of streamed LLM answers", ("model",))
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "llm_tokens_per_second", "Decode speed of streamed LLM answers", ("model",),
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400),
+)
+# 语义答案缓存、检索回退与上游错误
+ANSWER_CACHE_LOOKUPS = registry.counter("answer_cache_lookups_total", "Semantic answer cache lookups", ("result",))
+RETRIEVAL_FALLBACKS = registry.counter("retrieval_lexical_fallback_total", "Retrievals that fell back to lexical search")
+UPSTREAM_ERRORS = registry.counter("upstream_errors_total", "Failed upstream calls", ("upstream", "endpoint"))
+# 串行写入器
+DB_WRITE_BATCH_SIZE = registry.histogram(
+    "db_write_batch_size", "Write operations committed per transaction by the serialized writer",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+DB_WRITE_COMMIT_SECONDS = registry.histogram("db_write_commit_seconds", "Serialized writer commit latency")
+QA_RECORD_SPILLED = registry.counter("qa_record_spilled_total", "Write-behind QA records/feedback written to the spill file")
+QA_RECORD_FLUSH_SECONDS = registry.histogram("qa_record_flush_seconds", "Write-behind flush latency per batch")
+DB_WRITE_RETRIES = registry.counter("db_write_isolated_retries_total", "Write batches re-run one operation at a time after a failure")
+
+def prompt_cache_stats() -> Dict[str, float]:
+    """提示词前缀缓存命中汇总"""
+    prompt = LLM_PROMPT_TOKENS.total()
+    cached = LLM_CACHED_PROMPT_TOKENS.total()
+    return {
+        "requests": LLM_REQUESTS_WITH_USAGE.total(),
+        "prompt_tokens": prompt,
+        "cached_prompt_tokens": cached,
+        "cached_ratio": round(cached / prompt, 4) if prompt else 0.0,
+    }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, LargeBinary
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Boolean, ForeignKey, JSON, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -24,7 +24,7 @@ class QARecord(Base):
     id = Column(Integer, primary_key=True, index=True)
     question = Column(Text)
     answer = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # 保留期归档按时间筛选
     model_used = Column(String)
     process_log = Column(JSON)  # JSON格式的过程日志记录
     人工介入 = Column(Boolean, default=False)
@@ -34,11 +34,36 @@ class Feedback(Base):
     __tablename__ = "feedback"
     
     id = Column(Integer, primary_key=True, index=True)
-    qa_record_id = Column(Integer, ForeignKey("qa_records.id"))
+    qa_record_id = Column(Integer, ForeignKey("qa_records.id"), index=True)
     is_useful = Column(Boolean)  # 点赞或点踩
     comment = Column(Text)  # 用户评论
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class IdBlock(Base):
+    """hi/lo主键分配：每次预留一段连续id，问答记录在写入数据库之前即可确定id"""
+    __tablename__ = "id_blocks"
+
+    name = Column(String, primary_key=True)  # 表名
+    next_value = Column(Integer, nullable=False)  # 下一段的起始id
+
+class DailyStat(Base):
+    """按天、模型与知识分类增量维护的问答统计（随问答记录与反馈写入更新，看板只读取聚合行）"""
+    __tablename__ = "daily_stats"
+
+    day = Column(Date, primary_key=True)  # UTC日期
+    model = Column(String, primary_key=True, default="")
+    category = Column(String, primary_key=True, default="")  # 排在首位的检索结果的分类，无检索结果时为空
+    questions = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    cache_hits = Column(Integer, default=0)
+    thumbs_up = Column(Integer, default=0)
+    thumbs_down = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_tokens = Column(Integer, default=0)
+    latency_sketch = Column(JSON)  # 请求耗时的对数分桶计数，用于估算分位数
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class AppSetting(Base):
     """应用设置模型：用于存储可变的系统提示词等配置"""
     __tablename__ = "app_settings"
@@ -46,4 +71,59 @@ class AppSetting(Base):
     id = Column(Integer, primary_key=True, index=True)
     key = Column(String, unique=True, index=True)
     value = Column(JSON)
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class SessionSummary(Base):
+    """会话滚动摘要：较早的对话轮次被折叠为摘要，按session_id存储"""
+    __tablename__ = "session_summaries"
+
+    session_id = Column(String, primary_key=True, index=True)
+    summary = Column(Text)
+    summarized_messages = Column(Integer, default=0)  # 已折叠进摘要的消息数
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ChatMessageRecord(Base):
+    """会话消息表（沿用LangChain SQLChatMessageHistory的message_store表结构，兼容已有数据）"""
+    __tablename__ = "message_store"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(Text, index=True)
+    message = Column(Text)  # JSON：{"type": "human"/"ai", "data": {"content": ..., "type": ...}}
+
+class ChatSession(Base):
+    """会话目录：随消息写入维护，用于按最近活跃时间分页列出会话"""
+    __tablename__ = "chat_sessions"
+    # 分页游标为(last_active_at, session_id)，同一时刻活跃的会话按session_id排序
+    __table_args__ = (Index("ix_chat_sessions_activity", "last_active_at", "session_id"),)
+
+    session_id = Column(String, primary_key=True)
+    title = Column(String, nullable=True)  # 取首条用户消息的前若干字
+    created_at = Column(DateTime(timezone=True))
+    last_active_at = Column(DateTime(timezone=True))
+    message_count = Column(Integer, default=0)
+
+class BatchJob(Base):
+    """批量问答任务：记录进度，中断后可继续执行未完成的问题"""
+    __tablename__ = "batch_jobs"
+
+    id = Column(String, primary_key=True)  # uuid
+    status = Column(String, default="pending")  # pending / running / completed / interrupted
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    concurrency = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class BatchJobItem(Base):
+    """批量问答任务中的单个问题"""
+    __tablename__ = "batch_job_items"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, ForeignKey("batch_jobs.id"), index=True)
+    position = Column(Integer)  # 在原问题列表中的序号
+    question = Column(Text)
+    status = Column(String, default="pending")  # pending / done / error
+    qa_record_id = Column(Integer, ForeignKey("qa_records.id"), nullable=True)
+    error_message = Column(Text, nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,256 @@
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 当前请求的剖析器；未开启剖析时为None，run_blocking/run_cpu_bound据此决定是否把线程池中的工作纳入采样
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+_PROFILE_ID = re.compile(r"^[0-9]{14}-[0-9a-f]{8}$")
+
+# 栈帧标识：(函数名, 文件名, 函数首行号)
+FrameKey = Tuple[str, str, int]
+
+
+def current_profile() -> Optional["RequestProfile"]:
+    return _current.get()
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    """校验管理员令牌（未配置ADMIN_TOKEN时一律拒绝）"""
+    if not Config.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), Config.ADMIN_TOKEN.encode("utf-8"))
+
+
+class RequestProfile:
+    """单个请求的采样剖析：后台线程按固定间隔读取被跟踪线程的调用栈并计数。
+
+    跟踪范围为处理该请求的事件循环线程，以及通过run_blocking/run_cpu_bound执行该请求工作的线程池线程；
+    事件循环线程的样本中也会包含同一时刻其他并发请求的协程，排查时以本请求的调用路径为准。
+    """
+
+    def __init__(self, endpoint: str, interval_ms: float):
+        self.id = f"{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.endpoint = endpoint
+        self.interval = max(interval_ms, 0.5) / 1000
+        self.started_at = datetime.utcnow()
+        self.duration = 0.0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        # 被跟踪线程：线程id -> [线程名, 嵌套计数]
+        self._threads: Dict[int, List[Any]] = {}
+        self._samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+
+    def start(self) -> "RequestProfile":
+        self._sampler.start()
+        return self
+
+    @contextmanager
+    def attach(self):
+        """把当前线程纳入采样"""
+        ident = threading.get_ident()
+        with self._lock:
+            entry = self._threads.setdefault(ident, [threading.current_thread().name, 0])
+            entry[1] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    self._threads.pop(ident, None)
+
+    @contextmanager
+    def activate(self):
+        """在当前上下文中启用本剖析器，并跟踪当前（事件循环）线程"""
+        token = _current.set(self)
+        try:
+            with self.attach():
+                yield self
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # 流式响应的生成器可能在其他上下文中被关闭（客户端断开），此时上下文已随之丢弃
+                pass
+
+    def wrap(self, func: Callable[[], Any]) -> Callable[[], Any]:
+        """包装提交到线程池的调用，使执行线程在调用期间被采样"""
+        def wrapped():
+            with self.attach():
+                return func()
+        return wrapped
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                tracked = [(ident, entry[0]) for ident, entry in self._threads.items() if ident != own]
+            if not tracked:
+                continue
+            frames = sys._current_frames()
+            for ident, name in tracked:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                if stack:
+                    stack.reverse()
+                    self._samples[(name, tuple(stack))] += 1
+
+    def stop(self) -> None:
+        if not self._stop.is_set():
+            self._stop.set()
+            self._sampler.join()
+            self.duration = time.perf_counter() - self._start
+
+    @staticmethod
+    def _frame_label(frame: FrameKey) -> str:
+        name, filename, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def collapsed(self) -> str:
+        """折叠栈格式（每行"线程;帧;帧 样本数"），可直接用于flamegraph.pl / speedscope"""
+        lines = []
+        for (thread, stack), count in self._samples.most_common():
+            frames = ";".join(self._frame_label(f).replace(";", ",") for f in stack)
+            lines.append(f"{thread};{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> Dict[str, Any]:
+        """speedscope采样格式：每个线程一个profile，样本权重为采样间隔（秒）"""
+        frame_index: Dict[FrameKey, int] = {}
+        frames: List[Dict[str, Any]] = []
+        by_thread: Dict[str, Dict[str, list]] = {}
+        for (thread, stack), count in self._samples.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_index[frame])
+            profile = by_thread.setdefault(thread, {"samples": [], "weights": []})
+            profile["samples"].append(indices)
+            profile["weights"].append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.endpoint} {self.id}",
+            "exporter": Config.APP_TITLE,
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": round(sum(data["weights"]), 6),
+                    "samples": data["samples"],
+                    "weights": data["weights"],
+                }
+                for thread, data in sorted(by_thread.items())
+            ],
+        }
+
+
+class ProfileStore:
+    """剖析结果的本地存储：每个剖析保存元数据、speedscope JSON与折叠栈三个文件，只保留最近的若干个"""
+
+    FORMATS = {"speedscope": ".speedscope.json", "collapsed": ".collapsed.txt"}
+
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def save(self, profile: RequestProfile, qa_record_id: Optional[int] = None, status: str = "ok") -> Dict[str, Any]:
+        """停止采样并写入剖析文件，返回元数据"""
+        profile.stop()
+        meta = {
+            "id": profile.id,
+            "endpoint": profile.endpoint,
+            "qa_record_id": qa_record_id,
+            "status": status,
+            "started_at": profile.started_at.isoformat() + "Z",
+            "duration_ms": round(profile.duration * 1000, 2),
+            "interval_ms": round(profile.interval * 1000, 3),
+            "samples": sum(profile._samples.values()),
+        }
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(profile.id, self.FORMATS["speedscope"]), "w", encoding="utf-8") as f:
+                json.dump(profile.speedscope(), f, ensure_ascii=False)
+            with open(self._path(profile.id, self.FORMATS["collapsed"]), "w", encoding="utf-8") as f:
+                f.write(profile.collapsed())
+            with open(self._path(profile.id, ".json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            self._prune()
+        logger.info(f"已保存请求剖析 {profile.id}（{profile.endpoint}，{meta['duration_ms']}ms，{meta['samples']}个样本）")
+        return meta
+
+    def _ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        # id以UTC时间开头，按字典序即时间序
+        return sorted((name[:-5] for name in os.listdir(self.directory)
+                       if name.endswith(".json") and _PROFILE_ID.match(name[:-5])), reverse=True)
+
+    def _prune(self) -> None:
+        for profile_id in self._ids()[self.max_profiles:]:
+            for suffix in (".json", *self.FORMATS.values()):
+                try:
+                    os.remove(self._path(profile_id, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list(self, limit: int = 50, qa_record_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按时间倒序列出剖析元数据"""
+        items = []
+        for profile_id in self._ids():
+            try:
+                with open(self._path(profile_id, ".json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if qa_record_id is not None and meta.get("qa_record_id") != qa_record_id:
+                continue
+            items.append(meta)
+            if len(items) >= limit:
+                break
+        return items
+
+    def artifact_path(self, profile_id: str, fmt: str) -> Optional[str]:
+        """剖析文件路径；id或格式非法、文件不存在时返回None"""
+        if fmt not in self.FORMATS or not _PROFILE_ID.match(profile_id):
+            return None
+        path = self._path(profile_id, self.FORMATS[fmt])
+        return path if os.path.exists(path) else None
+
+
+def start_profile(endpoint: str) -> RequestProfile:
+    return RequestProfile(endpoint, Config.PROFILE_INTERVAL_MS).start()
+
+
+profile_store = ProfileStore(Config.PROFILE_DIR, Config.PROFILE_MAX_ENTRIES)
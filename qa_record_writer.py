@@ -0,0 +1,396 @@
+"""问答记录异步落库（write-behind）：问答记录与反馈在请求路径上只分配id并入队，由后台线程批量写入。
+
+- 记录id按hi/lo方式预先分配（每次从id_blocks表预留一段），入队前即可返回给调用方并用于反馈
+- 记录与反馈进入同一个有界FIFO队列，反馈总在其问答记录之后写入，针对尚未落库的记录的反馈同样有效
+- 数据库不可用时批次追加到本地溢出文件（JSONL，落盘后才算写出），之后按顺序重放；重放期间的新数据继续追加到文件末尾
+- 应用退出时写完队列中的剩余数据，仍写不进数据库的部分留在溢出文件中，下次启动后重放
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from analytics_service import AnalyticsService
+from async_utils import run_blocking, submit_blocking
+from config import Config
+from db_writer import DBWriter, db_writer
+from metrics import QA_RECORD_FLUSH_SECONDS, QA_RECORD_SPILLED, registry
+from models import Feedback, IdBlock, QARecord
+
+logger = logging.getLogger(__name__)
+
+_DATETIME_FIELDS = ("created_at",)
+
+
+class IdAllocator:
+    """hi/lo主键分配：每次在一个写事务中从id_blocks表预留block_size个连续id，之后在内存中逐个分配。
+    当前段用掉一半时在后台预留下一段；锁只保护内存中的段，等待预留期间不持有锁，
+    事件循环中经allocate()分配，段内取id只需短暂持锁，段用完且下一段未就绪时才经I/O线程池等待。
+    多个进程共用数据库时各自预留互不重叠的段；进程退出时未用完的id会留下空缺。
+    不要在写函数（写入器线程）中调用next_id()，应在提交写操作之前分配好id。
+    """
+
+    def __init__(self, writer: DBWriter, model, block_size: int = 1000):
+        self._writer = writer
+        self._model = model
+        self.name = model.__tablename__
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._prefetch: Optional[Future] = None
+
+    def try_next_id(self) -> Optional[int]:
+        """不等待数据库地分配id：当前段用完且下一段尚未预留好时返回None（并确保预留已在后台进行）"""
+        with self._lock:
+            if self._next >= self._end:
+                future = self._prefetch
+                if future is None or not future.done() or future.exception() is not None:
+                    if not self._usable(future):
+                        self._prefetch = self._submit_reserve()
+                    return None
+                start = future.result()
+                self._prefetch = None
+                self._next, self._end = start, start + self.block_size
+            value = self._next
+            self._next += 1
+            if not self._usable(self._prefetch) and self._end - self._next <= self.block_size // 2:
+                self._prefetch = self._submit_reserve()
+            return value
+
+    def next_id(self) -> int:
+        """分配id，必要时等待预留完成（在线程中调用；等待期间不持有锁，不阻塞并发的try_next_id）；预留失败时抛出异常"""
+        while True:
+            value = self.try_next_id()
+            if value is not None:
+                return value
+            with self._lock:
+                future = self._prefetch
+            if future is None:
+                continue
+            try:
+                future.result()
+            except Exception:
+                with self._lock:
+                    if self._prefetch is future:
+                        self._prefetch = None
+                raise
+
+    async def allocate(self) -> int:
+        """在事件循环中分配id：段内取id只需短暂持锁，段用完时经I/O线程池等待预留，不在事件循环中等待数据库"""
+        value = self.try_next_id()
+        if value is None:
+            value = await run_blocking(self.next_id)
+        return value
+
+    def prefetch(self) -> None:
+        """预留第一段id（启动时调用，首个请求无需等待）"""
+        with self._lock:
+            if self._next >= self._end and not self._usable(self._prefetch):
+                self._prefetch = self._submit_reserve()
+
+    def _submit_reserve(self) -> Future:
+        """在后台预留下一段（调用方须持有self._lock）：串行写入器上只是入队；
+        非串行模式下写入器会在调用线程中直接执行，因此转到I/O线程池
+        """
+        if self._writer.serialized:
+            return self._writer.submit(self._reserve, self.block_size)
+        return submit_blocking(self._writer.call, self._reserve, self.block_size)
+
+    @staticmethod
+    def _usable(future: Optional[Future]) -> bool:
+        """预留请求仍在进行或已成功（失败的预留在下次需要时重新提交）"""
+        return future is not None and not (future.done() and future.exception() is not None)
+
+    def _reserve(self, db, size: int) -> int:
+        """写函数：预留[start, start+size)并返回start；起点不低于表中已有的最大id，兼容此前自增写入的数据"""
+        row = db.query(IdBlock).filter(IdBlock.name == self.name).with_for_update().first()
+        floor = (db.query(func.max(self._model.id)).scalar() or 0) + 1
+        if row is None:
+            row = IdBlock(name=self.name, next_value=floor)
+            db.add(row)
+        start = max(row.next_value, floor)
+        row.next_value = start + size
+        db.flush()
+        return start
+
+
+class QARecordWriter:
+    """问答记录与反馈的write-behind写入器。
+
+    write_behind=False时不入队，直接经写入器同步写入（与原有行为一致）。
+    队列满时请求在I/O线程池中等待队列腾出空间（背压），不丢弃数据。
+    """
+
+    def __init__(self, writer: DBWriter, ids: IdAllocator, spill_path: str, write_behind: bool = True,
+                 queue_max: int = 10000, flush_batch: int = 200, flush_interval_ms: float = 50.0,
+                 retry_seconds: float = 5.0):
+        self._writer = writer
+        self.ids = ids
+        self.spill_path = spill_path
+        self.rejected_path = os.path.splitext(spill_path)[0] + ".rejected.jsonl"
+        self.write_behind = write_behind
+        self.flush_batch = max(1, flush_batch)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000
+        self.retry_seconds = max(0.1, retry_seconds)
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max(1, queue_max))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._closed = False
+        self._retry_at = 0.0
+
+    async def save(self, question: str, answer: str, process_log: Dict[str, Any], model_used: Optional[str]) -> QARecord:
+        """分配id并入队，返回尚未落库的问答记录对象（字段与落库后一致）"""
+        record_id = await self.ids.allocate()
+        item = {
+            "kind": "qa_record",
+            "id": record_id,
+            "question": question,
+            "answer": answer,
+            "model_used": model_used,
+            "process_log": process_log,
+            "人工介入": False,
+            "created_at": datetime.utcnow(),
+        }
+        await self._enqueue(item)
+        return self._to_record(item)
+
+    async def add_feedback(self, qa_record_id: int, is_useful: bool, comment: Optional[str] = None) -> None:
+        item = {
+            "kind": "feedback",
+            "qa_record_id": qa_record_id,
+            "is_useful": is_useful,
+            "comment": comment,
+            "created_at": datetime.utcnow(),
+        }
+        await self._enqueue(item)
+
+    async def _enqueue(self, item: Dict[str, Any]) -> None:
+        if not self.write_behind or self._closed:
+            # 未启用或已关闭（应用退出过程中的写入）：同步写入
+            await self._writer.run(self._write_batch, [item])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            await run_blocking(self._queue.put, item)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """启动后台写线程：先重放上次遗留的溢出文件，并预留第一段id"""
+        if self.write_behind:
+            try:
+                self.ids.prefetch()
+            except Exception as e:
+                logger.warning(f"预留问答记录id失败: {e}")
+        if self.write_behind or self._has_spill():
+            self._ensure_started()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """停止入队，写完队列中的剩余数据（写不进数据库的留在溢出文件中）"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+            if not thread.is_alive():
+                # 与关闭同时入队、排在结束标记之后的数据
+                leftover = self._drain()
+                if leftover:
+                    self._flush(leftover)
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not None:
+                items.append(item)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._loop, name="qa-record-writer", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        stopping = False
+        while not stopping:
+            self._replay_spill()
+            try:
+                item = self._queue.get(timeout=self.retry_seconds if self._has_spill() else None)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        # 关闭：写完剩余数据，先尽量重放溢出文件以保持顺序
+        leftover = self._drain()
+        self._retry_at = 0.0
+        self._replay_spill()
+        for i in range(0, len(leftover), self.flush_batch):
+            self._flush(leftover[i:i + self.flush_batch])
+
+    def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        if self._has_spill():
+            # 溢出文件尚未重放完：追加到文件末尾，保持记录与反馈的先后顺序
+            self._spill(batch)
+            return
+        try:
+            self._write(batch)
+        except OperationalError as e:
+            logger.warning(f"问答记录写入失败，暂存到溢出文件（{len(batch)}条）: {e}")
+            self._spill(batch)
+            self._retry_at = time.monotonic() + self.retry_seconds
+
+    def _write(self, batch: List[Dict[str, Any]], replay: bool = False) -> None:
+        """写入一批数据；数据库不可用（OperationalError）时抛出，其他错误逐条重试，仍失败的记入rejected文件"""
+        start = time.perf_counter()
+        try:
+            self._writer.call(self._write_batch, batch, replay)
+        except OperationalError:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"问答记录写入失败，已记入{self.rejected_path}: {e}")
+                self._append_lines(self.rejected_path, batch)
+                return
+            for item in batch:
+                self._write([item], replay)
+            return
+        QA_RECORD_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _write_batch(db, items: List[Dict[str, Any]], replay: bool = False) -> None:
+        """写函数：按顺序写入问答记录与反馈并累加统计；重放时跳过已写入的数据（记录按id合并，反馈按内容去重）"""
+        records, feedback = [], []
+        for item in items:
+            fields = {k: v for k, v in item.items() if k != "kind"}
+            if item["kind"] == "qa_record":
+                record = QARecord(**fields)
+                if replay and db.get(QARecord, record.id) is not None:
+                    db.merge(record)
+                    continue
+                db.add(record)
+                records.append(record)
+            elif item["kind"] == "feedback":
+                if replay and db.query(Feedback.id).filter_by(**fields).first() is not None:
+                    continue
+                row = Feedback(**fields)
+                db.add(row)
+                feedback.append(row)
+        db.flush()
+        AnalyticsService.apply(db, records, feedback)
+
+    def _has_spill(self) -> bool:
+        return os.path.exists(self.spill_path) and os.path.getsize(self.spill_path) > 0
+
+    def _spill(self, batch: List[Dict[str, Any]]) -> None:
+        with self._spill_lock:
+            self._append_lines(self.spill_path, batch)
+        QA_RECORD_SPILLED.inc(len(batch))
+
+    @staticmethod
+    def _append_lines(path: str, items: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_spill(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.spill_path):
+            return []
+        items = []
+        with open(self.spill_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # 进程在追加过程中退出留下的半行
+                    logger.warning(f"溢出文件中有无法解析的行，已跳过: {line[:200]}")
+                    continue
+                for key in _DATETIME_FIELDS:
+                    if item.get(key):
+                        item[key] = datetime.fromisoformat(item[key])
+                items.append(item)
+        return items
+
+    def _replay_spill(self) -> None:
+        """按顺序重放溢出文件；全部写入后删除文件，中途失败则保留未写入的部分等待下次重试"""
+        if not self._has_spill() or time.monotonic() < self._retry_at:
+            return
+        with self._spill_lock:
+            items = self._read_spill()
+            done = 0
+            try:
+                for i in range(0, len(items), self.flush_batch):
+                    chunk = items[i:i + self.flush_batch]
+                    self._write(chunk, replay=True)
+                    done += len(chunk)
+            except OperationalError as e:
+                logger.warning(f"重放问答记录溢出文件失败，{self.retry_seconds}秒后重试: {e}")
+                self._retry_at = time.monotonic() + self.retry_seconds
+            if done >= len(items):
+                os.remove(self.spill_path)
+                if items:
+                    logger.info(f"已重放问答记录溢出文件（{len(items)}条）")
+                return
+            tmp = self.spill_path + ".tmp"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self._append_lines(tmp, items[done:])
+            os.replace(tmp, self.spill_path)
+
+    @staticmethod
+    def _to_record(item: Dict[str, Any]) -> QARecord:
+        return QARecord(**{k: v for k, v in item.items() if k != "kind"})
+
+
+qa_record_ids = IdAllocator(db_writer, QARecord, block_size=Config.QA_RECORD_ID_BLOCK)
+qa_record_writer = QARecordWriter(
+    db_writer,
+    qa_record_ids,
+    spill_path=Config.QA_RECORD_SPILL_PATH,
+    write_behind=Config.QA_RECORD_WRITE_BEHIND,
+    queue_max=Config.QA_RECORD_QUEUE_MAX,
+    flush_batch=Config.QA_RECORD_FLUSH_BATCH,
+    flush_interval_ms=Config.QA_RECORD_FLUSH_INTERVAL_MS,
+    retry_seconds=Config.QA_RECORD_RETRY_SECONDS,
+)
+
+registry.callback("qa_record_queue_depth", "QA records/feedback waiting for the write-behind writer", lambda: [({}, float(qa_record_writer.pending()))])
@@ -1,64 +1,181 @@
-import json
-import openai
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Tuple, Optional
 from config import Config
-from models import QARecord, Knowledge, Feedback
+from models import QARecord, Knowledge
 from knowledge_service import KnowledgeService
 from embedding_service import EmbeddingService
 from datetime import datetime
 import logging
-import base64
+import time
+import numpy as np
 
 from memory_service import MemoryService
 from settings_service import SettingsService
+from async_utils import run_blocking, run_cpu_bound
+from qa_record_writer import qa_record_writer
+from answer_cache import answer_cache
+from history_service import HistoryService
+from context_packer import ContextPacker
+from rerank_service import RerankService
+from singleflight import SingleFlight, StreamFlight
+from llm_router import LLMRouter
+from image_service import ImagePreprocessor
+from metrics import (
+    LLM_PROMPT_TOKENS, LLM_CACHED_PROMPT_TOKENS, LLM_COMPLETION_TOKENS, LLM_REQUESTS_WITH_USAGE,
+    LLM_TTFT_SECONDS, LLM_TOKENS_PER_SECOND, QA_REQUEST_SECONDS, ANSWER_CACHE_LOOKUPS, RETRIEVAL_FALLBACKS,
+)
+from tracing import Trace
+from admission import chat_admission, OverloadedError, PRIORITY_ASK, PRIORITY_STREAM
 
-# 配置日志
-logging.basicConfig(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 class QAService:
     """问答服务"""
+    # 流式推送缓存答案时每段的字符数
+    CACHED_STREAM_CHUNK_CHARS = 16
+    # 流式生成失败时error事件的提示
+    STREAM_ERROR_MESSAGE = "抱歉，暂时无法回答您的问题。"
+    # cache布局下系统消息中的固定回答说明
+    ANSWER_INSTRUCTIONS = "请根据用户消息中提供的背景信息回答问题。如果背景信息不包含足够信息来回答问题，请说明无法根据提供的信息回答该问题。"
     
-    def __init__(self):
-        """初始化OpenAI客户端"""
-        self.client = openai.OpenAI(
-            base_url=Config.BASE_URL,
-            api_key=Config.API_KEY
-        )
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None, knowledge_service: Optional[KnowledgeService] = None,
+                 memory_service: Optional[MemoryService] = None, settings_service: Optional[SettingsService] = None):
+        """初始化LLM路由（多端点）；图片问答与会话摘要使用首个端点的客户端。
+        依赖未传入时各自创建（应用内通过container与知识库管理共享同一实例）
+        """
+        self.router = LLMRouter()
+        self.client = self.router.primary.client
         self.model = Config.MODEL_NAME
         self.image_model = Config.IMAGE_MODEL_NAME
-        self.embedding_service = EmbeddingService()
-        self.knowledge_service = KnowledgeService()
-        self.memory_service = MemoryService()
-        self.settings_service = SettingsService()
+        self.embedding_service = embedding_service or EmbeddingService()
+        self.knowledge_service = knowledge_service or KnowledgeService(embedding_service=self.embedding_service)
+        self.memory_service = memory_service or MemoryService()
+        self.settings_service = settings_service or SettingsService()
+        self.answer_cache = answer_cache
+        self.history_service = HistoryService(self.memory_service, self.client)
+        # cache布局下检索片段按稳定顺序输出，相同检索结果得到逐字节相同的上下文
+        self.context_packer = ContextPacker(model=self.model, stable_order=Config.PROMPT_LAYOUT == "cache")
+        self.rerank_service = RerankService()
+        self.image_preprocessor = ImagePreprocessor()
+        # 并发合并：embedding、非流式生成与流式生成分别合并
+        self._embedding_flight = SingleFlight()
+        self._generation_flight = SingleFlight()
+        self._stream_flight = StreamFlight()
     
-    def search_knowledge(self, db: Session, query: str) -> List[Tuple[Knowledge, float]]:
+    async def search_knowledge(self, db: Session, query: str) -> List[Tuple[Knowledge, float]]:
         """在知识库中搜索相关条目，返回(knowledge, similarity)"""
+        _, similar_knowledges, _ = await self._retrieve(db, query)
+        return similar_knowledges
+
+    async def _retrieve(self, db: Session, query: str, priority: int = PRIORITY_ASK, trace: Optional[Trace] = None) -> Tuple[Optional[np.ndarray], List[Tuple[Knowledge, float]], Dict[str, Any]]:
+        """检索相关知识：embedding → 向量检索（启用重排时过量召回）→ 重排序。
+        返回(问题embedding（失败时为None）, [(knowledge, similarity)], 各阶段耗时日志)；
+        embedding上游过载时抛出OverloadedError，不回退到文本匹配
+        """
+        trace = trace or Trace()
+        retrieval_log: Dict[str, Any] = {"mode": "vector"}
+        query_embedding = None
         try:
             # 获取查询的embedding
-            query_embedding = self.embedding_service.get_embedding(query)
-            
-            # 基于embedding搜索相关知识
-            similar_knowledges = self.knowledge_service.search_knowledge_by_embedding(db, query_embedding, top_k=5)
+            start = time.perf_counter()
+            if Config.COALESCE_REQUESTS:
+                query_embedding, shared = await self._embedding_flight.do(
+                    ("embedding", self._normalize_question(query)), lambda: self.embedding_service.aget_embedding(query, priority)
+                )
+                retrieval_log["embedding_coalesced"] = shared
+            else:
+                query_embedding = await self.embedding_service.aget_embedding(query, priority)
+            elapsed = time.perf_counter() - start
+            retrieval_log["embedding_ms"] = round(elapsed * 1000, 2)
+            trace.add("embedding", elapsed)
             
-            # 返回(知识条目, 相似度)
-            return similar_knowledges
+            # 基于embedding搜索相关知识（pymilvus与SQLite为同步接口，放到线程池执行）
+            top_k = Config.RERANK_CANDIDATES if self.rerank_service.enabled else Config.RETRIEVAL_TOP_K
+            timings: Dict[str, float] = {}
+            start = time.perf_counter()
+            similar_knowledges = await run_blocking(self.knowledge_service.search_knowledge_by_embedding, db, query_embedding, top_k=top_k, timings=timings)
+            retrieval_log["vector_search_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            retrieval_log["db_fetch_ms"] = round(timings.get("db_fetch", 0.0) * 1000, 2)
+            for stage, seconds in timings.items():
+                trace.add(stage, seconds)
+        except OverloadedError:
+            raise
         except Exception as e:
             logger.warning(f"基于embedding的搜索失败，使用简单文本匹配: {str(e)}")
             # 如果embedding搜索失败，回退到简单的文本匹配（无相似度）
-            knowledges = db.query(Knowledge).filter(
-                Knowledge.content.contains(query) | Knowledge.title.contains(query)
-            ).all()
-            return [(k, 0.0) for k in knowledges]
+            retrieval_log["mode"] = "lexical_fallback"
+            retrieval_log["error_message"] = str(e)
+            RETRIEVAL_FALLBACKS.inc()
+            start = time.perf_counter()
+            similar_knowledges = await run_blocking(self._search_knowledge_by_text, db, query)
+            elapsed = time.perf_counter() - start
+            retrieval_log["text_search_ms"] = round(elapsed * 1000, 2)
+            trace.add("text_search", elapsed)
+            return query_embedding, similar_knowledges, retrieval_log
+        
+        # hybrid模式：词面检索结果与向量检索结果按RRF融合；词面检索失败时保留向量检索结果
+        if Config.RETRIEVAL_MODE == "hybrid":
+            retrieval_log["mode"] = "hybrid"
+            start = time.perf_counter()
+            try:
+                lexical_knowledges = await run_blocking(self.knowledge_service.search_knowledge_by_terms, db, query, top_k=top_k)
+            except Exception as e:
+                logger.warning(f"词面检索失败，仅使用向量检索结果: {str(e)}")
+                retrieval_log["lexical_error"] = str(e)
+            else:
+                similar_knowledges = self._fuse_rrf(similar_knowledges, lexical_knowledges, top_k)
+            elapsed = time.perf_counter() - start
+            retrieval_log["lexical_search_ms"] = round(elapsed * 1000, 2)
+            trace.add("lexical_search", elapsed)
+        
+        # 重排序：只保留最相关的K条
+        if self.rerank_service.enabled:
+            with trace.span("rerank"):
+                similar_knowledges, rerank_log = await self.rerank_service.rerank(query, similar_knowledges)
+            retrieval_log["rerank"] = rerank_log
+        
+        # 返回(知识条目, 相似度)
+        return query_embedding, similar_knowledges, retrieval_log
+
+    @staticmethod
+    def _fuse_rrf(vector_hits: List[Tuple[Knowledge, float]], lexical_hits: List[Tuple[Knowledge, float]], top_k: int) -> List[Tuple[Knowledge, float]]:
+        """倒数排名融合（RRF）：按各路排名的1/(k+rank)之和排序；
+        相似度沿用向量相似度，仅词面命中的条目以命中词项比例作为相似度
+        """
+        scores: Dict[int, float] = {}
+        knowledges: Dict[int, Knowledge] = {}
+        similarities: Dict[int, float] = {}
+        for hits in (vector_hits, lexical_hits):
+            for rank, (k, sim) in enumerate(hits, start=1):
+                scores[k.id] = scores.get(k.id, 0.0) + 1.0 / (Config.HYBRID_RRF_K + rank)
+                knowledges.setdefault(k.id, k)
+                similarities.setdefault(k.id, float(sim))
+        order = sorted(scores, key=lambda kid: scores[kid], reverse=True)[:top_k]
+        return [(knowledges[kid], similarities[kid]) for kid in order]
 
-    def _build_messages(self, db: Session, question: str, context: str, session_id: Optional[str]) -> List[Dict[str, Any]]:
-        """根据会话历史与提示词构建消息列表"""
+    def _search_knowledge_by_text(self, db: Session, query: str) -> List[Tuple[Knowledge, float]]:
+        """简单文本匹配检索（无相似度）"""
+        knowledges = db.query(Knowledge).filter(
+            Knowledge.content.contains(query) | Knowledge.title.contains(query)
+        ).all()
+        return [(k, 0.0) for k in knowledges]
+
+    def _build_messages(self, db: Session, question: str, context: str, session_id: Optional[str], trace: Optional[Trace] = None) -> List[Dict[str, Any]]:
+        """根据会话历史与提示词构建消息列表。
+        cache布局（默认）：系统提示词、回答要求与固定说明合并为逐字节稳定的系统消息，
+        其后是会话历史，易变的背景信息与问题放在最后一条消息中，便于上游自动前缀缓存命中；
+        legacy布局：背景信息、问题与回答要求一起放在最后一条用户消息中。
+        """
         prompts = self.settings_service.get_prompt_settings(db)
         system_prompt = prompts.get("system_prompt") or "你是一个专业的政策咨询助手，能够根据提供的材料准确回答问题。"
         answer_prompt = prompts.get("answer_prompt") or "请用中文回答，若信息不足请明确说明无法根据提供的信息回答。"
 
-        user_content = f"""
+        if Config.PROMPT_LAYOUT == "cache":
+            system_content = f"{system_prompt}\n\n{self.ANSWER_INSTRUCTIONS}\n{answer_prompt}"
+            user_content = f"背景信息：\n{context}\n\n问题：\n{question}"
+        else:
+            system_content = system_prompt
+            user_content = f"""
         根据以下背景信息回答问题。如果背景信息不包含足够信息来回答问题，请说明无法根据提供的信息回答该问题。
 
         背景信息：
@@ -71,46 +188,59 @@ class QAService:
         """.strip()
 
         messages: List[Dict[str, Any]] = []
-        messages.append({"role": "system", "content": system_prompt})
-        # 注入会话历史
+        messages.append({"role": "system", "content": system_content})
+        # 注入会话历史（滚动摘要 + 最近N轮，受token预算限制）
         if session_id:
-            for msg in self.memory_service.get_messages(session_id):
-                role = "user" if msg.type == "human" else ("assistant" if msg.type == "ai" else "system")
-                content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content)
-                messages.append({"role": role, "content": content})
+            with (trace or Trace()).span("history"):
+                messages.extend(self.history_service.build_history(db, session_id))
         # 当前轮次问题
         messages.append({"role": "user", "content": user_content})
         return messages
     
-    def generate_answer(self, db: Session, question: str, context: str, session_id: Optional[str] = None) -> Dict[str, Any]:
-        """调用LLM生成答案"""
-        messages = self._build_messages(db, question, context, session_id)
+    def _save_turn(self, session_id: str, question: str, answer: str) -> None:
+        """写入会话记忆（仅存原始问答）"""
+        self.memory_service.add_turn(session_id, question, answer)
+
+    async def _record_turn(self, session_id: str, question: str, answer: str) -> None:
+        """写入会话记忆，并在后台折叠超出最近N轮的历史"""
+        await run_blocking(self._save_turn, session_id, question, answer)
+        self.history_service.schedule_summary(session_id)
+    
+    async def generate_answer(self, db: Session, question: str, context: str, session_id: Optional[str] = None, priority: int = PRIORITY_ASK, trace: Optional[Trace] = None) -> Dict[str, Any]:
+        """调用LLM生成答案；chat上游过载时抛出OverloadedError"""
+        trace = trace or Trace()
+        with trace.span("prompt_build"):
+            messages = await run_blocking(self._build_messages, db, question, context, session_id, trace)
         process_log = {
             "model": self.model,
             "timestamp": str(datetime.now())
         }
         
+        routing: Dict[str, Any] = {}
+        process_log["routing"] = routing
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
+            queued = time.perf_counter()
+            async with chat_admission.slot(priority):
+                trace.add("chat_queue", time.perf_counter() - queued)
+                with trace.span("llm"):
+                    response, endpoint = await self.router.complete(
+                        messages,
+                        routing,
+                        temperature=0.7,
+                        max_tokens=1000
+                    )
+            process_log["model"] = endpoint.model
             
             answer = response.choices[0].message.content
-            usage = getattr(response, "usage", None)
-            if usage:
-                process_log["prompt_tokens"] = usage.prompt_tokens
-                process_log["response_tokens"] = usage.completion_tokens
-                process_log["total_tokens"] = usage.total_tokens
+            self._record_usage(process_log, getattr(response, "usage", None), process_log["model"])
             process_log["status"] = "success"
             
             # 写入会话记忆（仅存原始问答）
             if session_id:
-                self.memory_service.add_user_message(session_id, question)
-                self.memory_service.add_ai_message(session_id, answer)
+                await self._record_turn(session_id, question, answer)
             
+        except OverloadedError:
+            raise
         except Exception as e:
             logger.error(f"调用LLM时出错: {str(e)}")
             answer = "抱歉，暂时无法回答您的问题。"
@@ -122,115 +252,318 @@ class QAService:
             "process_log": process_log
         }
     
-    def generate_answer_stream(self, db: Session, question: str, context: str, session_id: Optional[str] = None):
-        """调用LLM流式生成答案"""
-        messages = self._build_messages(db, question, context, session_id)
+    async def generate_answer_stream(self, db: Session, question: str, context: str, session_id: Optional[str] = None, process_log: Optional[Dict[str, Any]] = None, priority: int = PRIORITY_STREAM, trace: Optional[Trace] = None):
+        """调用LLM流式生成答案，逐段产出文本；token用量、首token耗时与生成速度写入process_log。
+        整个流式过程占用一个chat并发名额。失败（含排队超时等过载）时不再产出文本，
+        只在process_log中记录status="error"，由调用方发送error事件
+        """
+        trace = trace or Trace()
+        with trace.span("prompt_build"):
+            messages = await run_blocking(self._build_messages, db, question, context, session_id, trace)
+        if process_log is None:
+            process_log = {}
+        process_log.setdefault("model", self.model)
+        process_log.setdefault("timestamp", str(datetime.now()))
+        routing: Dict[str, Any] = {}
+        process_log["routing"] = routing
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000,
-                stream=True
-            )
-            
             collected = []
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    collected.append(chunk.choices[0].delta.content)
-                    yield chunk.choices[0].delta.content
+            queued = time.perf_counter()
+            async with chat_admission.slot(priority):
+                trace.add("chat_queue", time.perf_counter() - queued)
+                start = time.perf_counter()
+                first_token_at = None
+                response = self.router.stream(
+                    messages,
+                    routing,
+                    temperature=0.7,
+                    max_tokens=1000,
+                    stream_options={"include_usage": True}
+                )
+                async for chunk in response:
+                    # 开启include_usage后，最后一个chunk的choices为空，仅携带usage
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            process_log["ttft_ms"] = round((first_token_at - start) * 1000, 2)
+                            trace.add("llm_ttft", first_token_at - start)
+                            LLM_TTFT_SECONDS.observe(first_token_at - start, model=routing.get("model", process_log["model"]))
+                        collected.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                    self._record_usage(process_log, getattr(chunk, "usage", None), routing.get("model", process_log["model"]))
+                finished_at = time.perf_counter()
+                trace.add("llm", finished_at - start)
+            process_log["model"] = routing.get("model", process_log["model"])
+            self._record_decode_rate(process_log, first_token_at, finished_at, len(collected))
+            process_log["status"] = "success"
             # 完成后写入会话记忆
             if session_id:
-                self.memory_service.add_user_message(session_id, question)
-                self.memory_service.add_ai_message(session_id, "".join(collected))
+                await self._record_turn(session_id, question, "".join(collected))
                     
+        except OverloadedError as e:
+            # 响应已经开始，无法再返回429，改为error事件告知客户端重试时间
+            logger.warning(f"流式生成被拒绝: {str(e)}")
+            process_log["status"] = "error"
+            process_log["error_message"] = str(e)
+            process_log["retry_after"] = e.retry_after
         except Exception as e:
             logger.error(f"调用LLM时出错: {str(e)}")
-            yield "抱歉，暂时无法回答您的问题。"
+            process_log["status"] = "error"
+            process_log["error_message"] = str(e)
+
+    @classmethod
+    def _error_event(cls, process_log: Dict[str, Any], message: Optional[str] = None) -> Dict[str, Any]:
+        """流式生成失败时的error事件（不计入答案文本）；过载时附带建议重试秒数"""
+        event = {"type": "error", "message": message or cls.STREAM_ERROR_MESSAGE, "detail": process_log.get("error_message")}
+        if process_log.get("retry_after") is not None:
+            event["retry_after"] = process_log["retry_after"]
+        return event
+
+    @staticmethod
+    def _record_usage(process_log: Dict[str, Any], usage: Any, model: str) -> None:
+        """将token用量（含上游前缀缓存命中的提示词token）写入process_log并计入指标"""
+        if not usage:
+            return
+        process_log["prompt_tokens"] = usage.prompt_tokens
+        process_log["response_tokens"] = usage.completion_tokens
+        process_log["total_tokens"] = usage.total_tokens
+        # OpenAI兼容接口为prompt_tokens_details.cached_tokens，DeepSeek为prompt_cache_hit_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+        if cached is None:
+            cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        process_log["cached_tokens"] = cached or 0
+        LLM_REQUESTS_WITH_USAGE.inc(model=model)
+        LLM_PROMPT_TOKENS.inc(usage.prompt_tokens or 0, model=model)
+        LLM_CACHED_PROMPT_TOKENS.inc(cached or 0, model=model)
+        LLM_COMPLETION_TOKENS.inc(usage.completion_tokens or 0, model=model)
+
+    @staticmethod
+    def _record_decode_rate(process_log: Dict[str, Any], first_token_at: Optional[float], finished_at: float, chunks: int) -> None:
+        """按首token之后的生成耗时计算tokens/s（上游未返回用量时以chunk数近似token数）"""
+        tokens = process_log.get("response_tokens") or chunks
+        decode_seconds = finished_at - first_token_at if first_token_at is not None else 0.0
+        if tokens > 1 and decode_seconds > 0:
+            rate = (tokens - 1) / decode_seconds
+            process_log["tokens_per_second"] = round(rate, 2)
+            LLM_TOKENS_PER_SECOND.observe(rate, model=process_log["model"])
+
+    def _build_context(self, similar_knowledges: List[Tuple[Knowledge, float]]) -> Tuple[str, Dict[str, Any]]:
+        """在token预算内将检索到的知识组装为上下文，返回(上下文, 组装日志)；需逐段计算token数，异步路径中经run_cpu_bound调用"""
+        return self.context_packer.pack(similar_knowledges)
+
+    @staticmethod
+    def _primary_category(similar_knowledges: List[Tuple[Knowledge, float]]) -> Optional[str]:
+        """问题所属分类：取排在首位的检索结果的分类（用于按分类统计）"""
+        return similar_knowledges[0][0].category if similar_knowledges else None
+
+    def _knowledge_details(self, similar_knowledges: List[Tuple[Knowledge, float]]) -> List[Dict[str, Any]]:
+        """检索结果转换为KnowledgeDetail结构"""
+        return [
+            {
+                "id": k.id,
+                "title": k.title,
+                "content": k.content,
+                "category": k.category,
+                "created_at": k.created_at,
+                "updated_at": k.updated_at,
+                "similarity": float(sim)
+            } for (k, sim) in similar_knowledges
+        ]
+
+    async def _save_qa_record(self, question: str, answer: str, process_log: Dict[str, Any]) -> QARecord:
+        """持久化问答记录：预先分配id后入队，由后台批量写入（见qa_record_writer）"""
+        return await qa_record_writer.save(question, answer, process_log, process_log.get("model", self.model))
+
+    def _record_to_dict(self, qa_record: QARecord) -> Dict[str, Any]:
+        return {
+            "id": qa_record.id,
+            "question": qa_record.question,
+            "answer": qa_record.answer,
+            "created_at": qa_record.created_at,
+            "model_used": qa_record.model_used,
+            "process_log": qa_record.process_log,
+            "人工介入": qa_record.人工介入,
+        }
     
-    def ask_question(self, db: Session, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+    def _cache_signature(self, db: Session, similar_knowledges: List[Tuple[Knowledge, float]], session_id: Optional[str]) -> Optional[Tuple[Any, str]]:
+        """计算与会话无关的上下文签名(检索知识签名, 提示词签名)，用于答案缓存与并发合并；
+        会话已有历史时答案依赖上下文，不参与缓存与合并（返回None）
+        """
+        if session_id and self.memory_service.get_messages(session_id):
+            return None
+        prompts = self.settings_service.get_prompt_settings(db)
+        return self.answer_cache.knowledge_key(similar_knowledges), self.answer_cache.prompt_key(prompts)
+
+    async def _lookup_cached_answer(self, db: Session, query_embedding: Optional[np.ndarray], similar_knowledges: List[Tuple[Knowledge, float]], session_id: Optional[str]) -> Tuple[Optional[Tuple[Any, str]], Optional[Dict[str, Any]]]:
+        """计算上下文签名并查询语义答案缓存，返回(签名, 缓存命中结果)"""
+        if not Config.ANSWER_CACHE_ENABLED and not Config.COALESCE_REQUESTS:
+            return None, None
+        signature = await run_blocking(self._cache_signature, db, similar_knowledges, session_id)
+        if signature is None or not Config.ANSWER_CACHE_ENABLED or query_embedding is None:
+            return signature, None
+        cached = self.answer_cache.lookup(query_embedding, *signature)
+        ANSWER_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+        return signature, cached
+
+    @staticmethod
+    def _normalize_question(question: str) -> str:
+        """规范化问题文本用于并发合并：去首尾空白与结尾标点、合并空白、转小写"""
+        text = " ".join((question or "").split()).lower()
+        return text.rstrip("？?。.!！~～ ")
+
+    def _coalesce_key(self, question: str, signature: Optional[Tuple[Any, str]]) -> Optional[Tuple[Any, ...]]:
+        if not Config.COALESCE_REQUESTS or signature is None:
+            return None
+        return (self._normalize_question(question), signature[0], signature[1])
+
+    def _cached_process_log(self, cached: Dict[str, Any]) -> Dict[str, Any]:
+        """命中缓存时的过程日志"""
+        return {
+            "model": self.model,
+            "timestamp": str(datetime.now()),
+            "status": "success",
+            "cache": {
+                "hit": True,
+                "similarity": cached["similarity"],
+                "source_qa_record_id": cached["source_qa_record_id"],
+            },
+        }
+
+    async def ask_question(self, db: Session, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """处理用户提问"""
+        trace = Trace()
         # 搜索相关知识
-        similar_knowledges = self.search_knowledge(db, question)  # List[(Knowledge, sim)]
-        knowledges_only = [k for k, _ in similar_knowledges]
+        query_embedding, similar_knowledges, retrieval_log = await self._retrieve(db, question, trace=trace)  # List[(Knowledge, sim)]
         
         # 构建上下文
-        context = "\n\n".join([f"标题: {k.title}\n内容: {k.content}" for k in knowledges_only])
-        if not context:
-            context = "未找到相关背景信息。"
+        with trace.span("context"):
+            context, context_log = await run_cpu_bound(self._build_context, similar_knowledges)
         
-        # 生成答案
-        result = self.generate_answer(db, question, context, session_id=session_id)
+        # 优先使用语义答案缓存
+        with trace.span("cache_lookup"):
+            signature, cached = await self._lookup_cached_answer(db, query_embedding, similar_knowledges, session_id)
+        coalesce_key = self._coalesce_key(question, signature)
+        if cached:
+            result = {"answer": cached["answer"], "process_log": self._cached_process_log(cached)}
+            if session_id:
+                await self._record_turn(session_id, question, cached["answer"])
+        elif coalesce_key is not None:
+            # 相同问题与上下文的并发请求共享一次生成，各自写入会话记忆与问答记录
+            start = time.perf_counter()
+            shared, coalesced = await self._generation_flight.do(
+                coalesce_key, lambda: self.generate_answer(db, question, context, trace=trace)
+            )
+            if coalesced:
+                trace.add("coalesced_wait", time.perf_counter() - start)
+            result = {"answer": shared["answer"], "process_log": dict(shared["process_log"], coalesced=coalesced)}
+            if session_id and result["process_log"].get("status") == "success":
+                await self._record_turn(session_id, question, result["answer"])
+        else:
+            # 生成答案
+            result = await self.generate_answer(db, question, context, session_id=session_id, trace=trace)
+        result["process_log"]["retrieval"] = retrieval_log
+        result["process_log"]["context"] = context_log
+        result["process_log"]["category"] = self._primary_category(similar_knowledges)
+        result["process_log"]["timings"] = trace.to_dict()
         
         # 记录问答过程
-        qa_record = QARecord(
-            question=question,
-            answer=result["answer"],
-            model_used=self.model,
-            process_log=result["process_log"]
-        )
-        
-        db.add(qa_record)
-        db.commit()
-        db.refresh(qa_record)
+        with trace.span("save_record"):
+            qa_record = await self._save_qa_record(question, result["answer"], result["process_log"])
+        QA_REQUEST_SECONDS.observe(trace.elapsed(), endpoint="ask", status="cache_hit" if cached else result["process_log"].get("status", "unknown"))
+        if signature is not None and Config.ANSWER_CACHE_ENABLED and query_embedding is not None \
+                and not cached and not result["process_log"].get("coalesced") and result["process_log"].get("status") == "success":
+            self.answer_cache.store(query_embedding, *signature, result["answer"], qa_record_id=qa_record.id)
         
         # 准备返回数据，包括检索到的知识与相似度
-        response_data = {
-            "id": qa_record.id,
-            "question": qa_record.question,
-            "answer": qa_record.answer,
-            "created_at": qa_record.created_at,
-            "model_used": qa_record.model_used,
-            "process_log": qa_record.process_log,
-            "人工介入": qa_record.人工介入,
-            "retrieved_knowledges": [
-                {
-                    "id": k.id,
-                    "title": k.title,
-                    "content": k.content,
-                    "category": k.category,
-                    "created_at": k.created_at,
-                    "updated_at": k.updated_at,
-                    "similarity": float(sim)
-                } for (k, sim) in similar_knowledges
-            ]
-        }
+        response_data = self._record_to_dict(qa_record)
+        response_data["retrieved_knowledges"] = self._knowledge_details(similar_knowledges)
         
         return response_data
     
-    def ask_question_stream(self, db: Session, question: str, session_id: Optional[str] = None):
-        """流式处理用户提问"""
+    async def ask_question_stream(self, db: Session, question: str, session_id: Optional[str] = None):
+        """流式处理用户提问，依次产出结构化事件：
+        - {"type": "retrieval", "retrieved_knowledges": [...]}：检索结果（含相似度）
+        - {"type": "delta", "content": "..."}：答案增量
+        - {"type": "error", "message", "detail"}：生成失败（仅失败时，位于done之前；已推送的增量即为记录的部分答案）
+        - {"type": "done", ...}：已持久化的问答记录（id、process_log含token用量）
+        """
+        trace = Trace()
         # 搜索相关知识
-        similar_knowledges = self.search_knowledge(db, question)
-        knowledges_only = [k for k, _ in similar_knowledges]
+        query_embedding, similar_knowledges, retrieval_log = await self._retrieve(db, question, PRIORITY_STREAM, trace=trace)
         
         # 构建上下文
-        context = "\n\n".join([f"标题: {k.title}\n内容: {k.content}" for k in knowledges_only])
-        if not context:
-            context = "未找到相关背景信息。"
+        with trace.span("context"):
+            context, context_log = await run_cpu_bound(self._build_context, similar_knowledges)
         
-        # 流式生成答案
-        for chunk in self.generate_answer_stream(db, question, context, session_id=session_id):
-            yield chunk
-    
-    def add_feedback(self, db: Session, qa_record_id: int, is_useful: bool, comment: str = None) -> Feedback:
-        """添加用户反馈"""
-        feedback = Feedback(
-            qa_record_id=qa_record_id,
-            is_useful=is_useful,
-            comment=comment
-        )
-        
-        db.add(feedback)
-        db.commit()
-        db.refresh(feedback)
+        collected = []
+        with trace.span("cache_lookup"):
+            signature, cached = await self._lookup_cached_answer(db, query_embedding, similar_knowledges, session_id)
+        coalesce_key = self._coalesce_key(question, signature)
+        if not cached:
+            # 产出首个事件（响应开始）之前预检chat上游排队，过载时可直接返回429
+            chat_admission.check()
+        yield {"type": "retrieval", "retrieved_knowledges": self._knowledge_details(similar_knowledges)}
+        coalesced = False
+        if cached:
+            # 命中缓存：按固定大小分段推送缓存答案
+            process_log = self._cached_process_log(cached)
+            answer = cached["answer"]
+            for i in range(0, len(answer), self.CACHED_STREAM_CHUNK_CHARS):
+                chunk = answer[i:i + self.CACHED_STREAM_CHUNK_CHARS]
+                trace.mark("first_delta")
+                collected.append(chunk)
+                yield {"type": "delta", "content": chunk}
+            if session_id:
+                await self._record_turn(session_id, question, answer)
+        elif coalesce_key is not None:
+            # 相同问题与上下文的并发流式请求订阅同一个上游token流
+            def start_upstream():
+                shared_log: Dict[str, Any] = {}
+                return self.generate_answer_stream(db, question, context, process_log=shared_log, trace=trace), shared_log
+            stream, shared_log, coalesced = self._stream_flight.subscribe(coalesce_key, start_upstream)
+            async for chunk in stream:
+                trace.mark("first_delta")
+                collected.append(chunk)
+                yield {"type": "delta", "content": chunk}
+            process_log = dict(shared_log, coalesced=coalesced)
+            if session_id and process_log.get("status") == "success":
+                await self._record_turn(session_id, question, "".join(collected))
+        else:
+            # 流式生成答案
+            process_log: Dict[str, Any] = {}
+            async for chunk in self.generate_answer_stream(db, question, context, session_id=session_id, process_log=process_log, trace=trace):
+                trace.mark("first_delta")
+                collected.append(chunk)
+                yield {"type": "delta", "content": chunk}
+        if process_log.get("status") == "error":
+            yield self._error_event(process_log)
+        process_log["retrieval"] = retrieval_log
+        process_log["context"] = context_log
+        process_log["category"] = self._primary_category(similar_knowledges)
+        process_log["timings"] = trace.to_dict()
         
-        return feedback
+        # 记录问答过程
+        answer = "".join(collected)
+        with trace.span("save_record"):
+            qa_record = await self._save_qa_record(question, answer, process_log)
+        QA_REQUEST_SECONDS.observe(trace.elapsed(), endpoint="ask_stream", status="cache_hit" if cached else process_log.get("status", "unknown"))
+        if signature is not None and Config.ANSWER_CACHE_ENABLED and query_embedding is not None \
+                and not cached and not coalesced and process_log.get("status") == "success":
+            self.answer_cache.store(query_embedding, *signature, answer, qa_record_id=qa_record.id)
+        done = self._record_to_dict(qa_record)
+        done["type"] = "done"
+        yield done
+    
+    async def add_feedback(self, qa_record_id: int, is_useful: bool, comment: str = None) -> None:
+        """添加用户反馈：与问答记录进入同一写入队列，问答记录尚未落库时同样有效"""
+        await qa_record_writer.add_feedback(qa_record_id, is_useful, comment)
 
-    def ask_image_question(self, db: Session, question: str, image_bytes: bytes, session_id: Optional[str] = None) -> Dict[str, Any]:
-        """图片理解问答：将图片与问题一起发送给多模态模型"""
-        prompts = self.settings_service.get_prompt_settings(db)
+    async def _build_image_messages(self, db: Session, question: str, image_bytes: bytes) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """预处理图片（识别格式、缩放压缩，按内容哈希复用）并构建多模态消息，返回(消息列表, 预处理日志)"""
+        prompts = await run_blocking(self.settings_service.get_prompt_settings, db)
         system_prompt = prompts.get("system_prompt") or "你是一个专业的政策咨询助手，能够根据提供的材料准确回答问题。"
+        data_url, image_log = await run_cpu_bound(self.image_preprocessor.prepare, image_bytes)
         messages = [
             {"role": "system", "content": system_prompt},
             {
@@ -239,35 +572,106 @@ class QAService:
                     {"type": "text", "text": question},
                     {
                         "type": "image_url",
-                        "image_url": {"url": "data:image/png;base64," + base64.b64encode(image_bytes).decode("utf-8")}
+                        "image_url": {"url": data_url}
                     }
                 ]
             }
         ]
+        return messages, image_log
+
+    async def ask_image_question(self, db: Session, question: str, image_bytes: bytes, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """图片理解问答：将预处理后的图片与问题一起发送给多模态模型"""
+        messages, image_log = await self._build_image_messages(db, question, image_bytes)
         process_log = {
             "model": self.image_model,
-            "timestamp": str(datetime.now())
+            "timestamp": str(datetime.now()),
+            "image": image_log
         }
         try:
-            response = self.client.chat.completions.create(
-                model=self.image_model,
-                messages=messages,
-                temperature=0.2,
-                max_tokens=800
-            )
+            async with chat_admission.slot(PRIORITY_ASK):
+                response = await self.client.chat.completions.create(
+                    model=self.image_model,
+                    messages=messages,
+                    temperature=0.2,
+                    max_tokens=800
+                )
             answer = response.choices[0].message.content
-            usage = getattr(response, "usage", None)
-            if usage:
-                process_log["prompt_tokens"] = usage.prompt_tokens
-                process_log["response_tokens"] = usage.completion_tokens
-                process_log["total_tokens"] = usage.total_tokens
+            self._record_usage(process_log, getattr(response, "usage", None), process_log["model"])
             process_log["status"] = "success"
             if session_id:
-                self.memory_service.add_user_message(session_id, f"[图片问答] {question}")
-                self.memory_service.add_ai_message(session_id, answer)
+                await self._record_turn(session_id, f"[图片问答] {question}", answer)
+        except OverloadedError:
+            raise
         except Exception as e:
             logger.error(f"多模态模型调用出错: {str(e)}")
             answer = "抱歉，图片理解暂时不可用。"
             process_log["status"] = "error"
             process_log["error_message"] = str(e)
-        return {"answer": answer, "process_log": process_log}
\ No newline at end of file
+        return {"answer": answer, "process_log": process_log}
+
+    async def ask_image_question_stream(self, db: Session, question: str, image_bytes: bytes, session_id: Optional[str] = None):
+        """流式图片理解问答，依次产出事件：
+        - {"type": "image", ...}：图片预处理结果（格式、压缩前后体积、是否复用缓存）
+        - {"type": "delta", "content": "..."}：答案增量
+        - {"type": "error", "message", "detail"}：调用失败（仅失败时，位于done之前）
+        - {"type": "done", "answer", "model_used", "process_log"}：完整（或失败前的部分）答案与过程日志
+        """
+        messages, image_log = await self._build_image_messages(db, question, image_bytes)
+        # 产出首个事件之前预检chat上游排队，过载时可直接返回429
+        chat_admission.check()
+        yield {"type": "image", **image_log}
+        process_log: Dict[str, Any] = {
+            "model": self.image_model,
+            "timestamp": str(datetime.now()),
+            "image": image_log
+        }
+        collected = []
+        try:
+            async with chat_admission.slot(PRIORITY_STREAM):
+                start = time.perf_counter()
+                response = await self.client.chat.completions.create(
+                    model=self.image_model,
+                    messages=messages,
+                    temperature=0.2,
+                    max_tokens=800,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if not collected:
+                            process_log["ttft_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                        collected.append(chunk.choices[0].delta.content)
+                        yield {"type": "delta", "content": chunk.choices[0].delta.content}
+                    self._record_usage(process_log, getattr(chunk, "usage", None), self.image_model)
+            process_log["status"] = "success"
+            answer = "".join(collected)
+            if session_id:
+                await self._record_turn(session_id, f"[图片问答] {question}", answer)
+        except OverloadedError as e:
+            logger.warning(f"流式图片问答被拒绝: {str(e)}")
+            process_log["status"] = "error"
+            process_log["error_message"] = str(e)
+            process_log["retry_after"] = e.retry_after
+        except Exception as e:
+            logger.error(f"多模态模型调用出错: {str(e)}")
+            process_log["status"] = "error"
+            process_log["error_message"] = str(e)
+        if process_log["status"] == "error":
+            answer = "".join(collected)
+            yield self._error_event(process_log, "抱歉，图片理解暂时不可用。")
+        yield {"type": "done", "question": question, "answer": answer, "model_used": self.image_model, "process_log": process_log}
+
+    def coalescing_stats(self) -> Dict[str, int]:
+        """当前正在进行中的合并调用数"""
+        return {
+            "embedding_inflight": self._embedding_flight.inflight(),
+            "generation_inflight": self._generation_flight.inflight(),
+            "stream_inflight": self._stream_flight.inflight(),
+        }
+
+    async def aclose(self) -> None:
+        """关闭异步客户端连接"""
+        await self.router.aclose()
+        await self.embedding_service.aclose()
+        await self.rerank_service.aclose()
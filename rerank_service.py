@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from async_utils import run_blocking, run_cpu_bound
+from config import Config
+from metrics import UPSTREAM_ERRORS
+from models import Knowledge
+
+logger = logging.getLogger(__name__)
+
+Candidates = List[Tuple[Knowledge, float]]
+
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]|[a-zA-Z0-9]+")
+
+def lexical_terms(text: str) -> set:
+    """词面匹配用的词项：中文单字与相邻二元组、英文单词与数字"""
+    tokens = _TOKEN_PATTERN.findall((text or "").lower())
+    return set(tokens) | {a + b for a, b in zip(tokens, tokens[1:])}
+
+def _document_text(knowledge: Knowledge) -> str:
+    return f"{knowledge.title or ''}\n{knowledge.content or ''}"
+
+class Reranker(ABC):
+    """重排序器基类：为(问题, 候选知识)打分，分数越高越相关"""
+    name = "none"
+
+    @property
+    def ready(self) -> bool:
+        """打分所需的资源（如本地模型）是否已加载"""
+        return True
+
+    def load(self) -> None:
+        """加载打分所需的资源（在启动预热时于后台线程调用，不占用请求的延迟预算）"""
+
+    @abstractmethod
+    async def ascore(self, query: str, candidates: Candidates) -> List[float]:
+        """为候选打分，返回与candidates等长的分数列表"""
+
+    async def aclose(self) -> None:
+        pass
+
+class SyncReranker(Reranker):
+    """同步打分器：在CPU线程池中执行score"""
+
+    @abstractmethod
+    def score(self, query: str, candidates: Candidates) -> List[float]:
+        """为候选打分，返回与candidates等长的分数列表"""
+
+    async def ascore(self, query: str, candidates: Candidates) -> List[float]:
+        return await run_cpu_bound(self.score, query, candidates)
+
+class LexicalReranker(SyncReranker):
+    """轻量词面重叠打分：字符二元组重叠率与向量相似度加权，适合中文，无需额外依赖"""
+    name = "lexical"
+
+    def __init__(self, lexical_weight: float = 0.5):
+        self.lexical_weight = lexical_weight
+
+    @classmethod
+    def _terms(cls, text: str) -> set:
+        return lexical_terms(text)
+
+    def score(self, query: str, candidates: Candidates) -> List[float]:
+        query_terms = self._terms(query)
+        if not query_terms:
+            return [float(sim) for _, sim in candidates]
+        scores = []
+        for knowledge, sim in candidates:
+            overlap = len(query_terms & self._terms(_document_text(knowledge))) / len(query_terms)
+            scores.append(self.lexical_weight * overlap + (1 - self.lexical_weight) * float(sim))
+        return scores
+
+class CrossEncoderReranker(SyncReranker):
+    """本地CPU交叉编码器（需安装sentence-transformers），模型在预热时加载一次"""
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str, batch_size: int):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> None:
+        # 加锁保证并发的首次调用只加载一次模型
+        with self._load_lock:
+            if self._model is None:
+                start = time.perf_counter()
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, device="cpu")
+                logger.info(f"已加载交叉编码器 {self.model_name}（{(time.perf_counter() - start) * 1000:.0f}ms）")
+
+    def score(self, query: str, candidates: Candidates) -> List[float]:
+        if self._model is None:
+            self.load()
+        pairs = [(query, _document_text(k)) for k, _ in candidates]
+        return [float(s) for s in self._model.predict(pairs, batch_size=self.batch_size)]
+
+class HTTPReranker(Reranker):
+    """OpenAI兼容风格的rerank接口（POST {base_url}/rerank，Jina/Cohere/vLLM等均支持），按批并发请求"""
+    name = "http"
+
+    def __init__(self, base_url: str, api_key: str, model_name: str, batch_size: int):
+        self.url = f"{base_url.rstrip('/')}/rerank"
+        self.api_key = api_key
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def _score_batch(self, query: str, documents: List[str]) -> List[float]:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=30.0)
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        response = await self._http.post(
+            self.url,
+            json={"model": self.model_name, "query": query, "documents": documents, "top_n": len(documents)},
+            headers=headers,
+        )
+        response.raise_for_status()
+        scores = [0.0] * len(documents)
+        for item in response.json().get("results", []):
+            scores[int(item["index"])] = float(item.get("relevance_score", item.get("score", 0.0)))
+        return scores
+
+    async def ascore(self, query: str, candidates: Candidates) -> List[float]:
+        documents = [_document_text(k) for k, _ in candidates]
+        batches = [documents[i:i + self.batch_size] for i in range(0, len(documents), self.batch_size)]
+        results = await asyncio.gather(*[self._score_batch(query, batch) for batch in batches])
+        return [score for batch in results for score in batch]
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+def create_reranker(name: str) -> Optional[Reranker]:
+    """根据配置创建重排序器；"none"或未知类型返回None（不重排）"""
+    name = (name or "none").lower()
+    if name == "lexical":
+        return LexicalReranker()
+    if name == "cross-encoder":
+        return CrossEncoderReranker(Config.RERANKER_MODEL, Config.RERANK_BATCH_SIZE)
+    if name == "http":
+        return HTTPReranker(Config.RERANKER_BASE_URL, Config.RERANKER_API_KEY, Config.RERANKER_MODEL, Config.RERANK_BATCH_SIZE)
+    if name != "none":
+        logger.warning(f"未知的重排序器类型: {name}，不启用重排")
+    return None
+
+class RerankService:
+    """重排序阶段：对向量检索的过量候选重新打分，只保留前K条。
+    超出延迟预算或打分失败时回退到向量检索顺序。
+    """
+
+    def __init__(self, reranker_name: str = None, top_k: int = None, timeout_ms: int = None):
+        self.reranker = create_reranker(Config.RERANKER if reranker_name is None else reranker_name)
+        self.top_k = Config.RERANK_TOP_K if top_k is None else top_k
+        self.timeout_ms = Config.RERANK_TIMEOUT_MS if timeout_ms is None else timeout_ms
+        # 回退到向量检索顺序的次数（评估时据此判断重排是否真正生效）
+        self.fallbacks = 0
+        self._load_task: Optional[asyncio.Task] = None
+        self._load_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.reranker is not None
+
+    def warm_up(self) -> Optional[str]:
+        """加载重排序器所需的资源（阻塞，在后台线程中调用）；返回加载失败的原因"""
+        if self.reranker is None or self.reranker.ready:
+            return None
+        try:
+            self.reranker.load()
+            self._load_error = None
+        except Exception as e:
+            self._load_error = str(e)
+            logger.warning(f"加载重排序器 {self.reranker.name} 失败，重排将回退到向量检索顺序: {e}")
+        return self._load_error
+
+    def _ensure_loading(self) -> None:
+        """预热尚未完成时在后台加载，当前请求不等待"""
+        if self._load_error is None and (self._load_task is None or self._load_task.done()):
+            self._load_task = asyncio.get_running_loop().create_task(run_blocking(self.warm_up))
+
+    async def rerank(self, query: str, candidates: Candidates) -> Tuple[Candidates, Dict[str, Any]]:
+        """返回(重排后的前K条, 日志)"""
+        log: Dict[str, Any] = {"reranker": self.reranker.name if self.reranker else "none", "candidates": len(candidates)}
+        if not self.reranker or not candidates:
+            return candidates[:self.top_k], log
+        if not self.reranker.ready:
+            # 模型加载不计入请求的延迟预算：加载完成前直接使用向量检索顺序
+            self._ensure_loading()
+            self.fallbacks += 1
+            log["fallback"] = True
+            log["fallback_reason"] = self._load_error or "loading"
+            return candidates[:self.top_k], log
+        start = time.perf_counter()
+        try:
+            scores = await asyncio.wait_for(self.reranker.ascore(query, candidates), timeout=self.timeout_ms / 1000)
+            order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)[:self.top_k]
+            log["fallback"] = False
+            log["scores"] = {candidates[i][0].id: round(float(scores[i]), 4) for i in order}
+            return [candidates[i] for i in order], log
+        except asyncio.TimeoutError:
+            logger.warning(f"重排序超出延迟预算({self.timeout_ms}ms)，回退到向量检索顺序")
+            self.fallbacks += 1
+            log["fallback"] = True
+            log["fallback_reason"] = "timeout"
+            UPSTREAM_ERRORS.inc(upstream="rerank", endpoint=self.reranker.name)
+        except Exception as e:
+            logger.warning(f"重排序失败，回退到向量检索顺序: {e}")
+            self.fallbacks += 1
+            log["fallback"] = True
+            log["fallback_reason"] = str(e)
+            UPSTREAM_ERRORS.inc(upstream="rerank", endpoint=self.reranker.name)
+        finally:
+            log["rerank_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return candidates[:self.top_k], log
+
+    async def aclose(self) -> None:
+        if self.reranker is not None:
+            await self.reranker.aclose()
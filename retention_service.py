@@ -0,0 +1,306 @@
+"""问答记录的保留与归档：超过保留期且无反馈的记录按日期分区写入压缩JSONL归档后从热表删除，并增量回收空间。
+
+用法：
+    python retention_service.py run                       # 立即执行一轮归档与空间回收
+    python retention_service.py status
+    python retention_service.py export --start 2025-01-01 --end 2025-03-31 --output q1.jsonl
+    python retention_service.py enable-incremental-vacuum # 已有数据库一次性切换为增量回收（执行VACUUM，期间锁库）
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import exists
+
+from config import Config, setup_logging
+from database import SessionLocal, engine, is_sqlite
+from db_writer import db_writer
+from models import Feedback, QARecord
+
+try:
+    import zstandard
+except ImportError:  # zstandard为可选依赖，缺失时归档使用gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_PARTITION = re.compile(r"^(\d{4}-\d{2}-\d{2})\.jsonl\.(zst|gz)$")
+
+
+class ArchiveStore:
+    """按日期分区的压缩JSONL归档：<dir>/qa_records/YYYY/MM/YYYY-MM-DD.jsonl.zst（或.gz）。
+    每次归档向当天的文件追加一个独立的压缩帧（zstd多帧、gzip多成员均可顺序解压），已有文件无需重写。
+    """
+
+    def __init__(self, directory: str, compression: str = "zstd"):
+        self.directory = os.path.join(directory, "qa_records")
+        self.extension = "zst" if compression == "zstd" and zstandard is not None else "gz"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("未安装zstandard，问答记录归档使用gzip压缩")
+        self._lock = threading.Lock()
+
+    def _path(self, day: date, extension: str) -> str:
+        return os.path.join(self.directory, f"{day:%Y}", f"{day:%m}", f"{day:%Y-%m-%d}.jsonl.{extension}")
+
+    def append(self, day: date, records: List[Dict[str, Any]]) -> int:
+        """追加一批记录到当天分区，写入并落盘后返回压缩后的字节数"""
+        payload = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records).encode("utf-8")
+        if self.extension == "zst":
+            data = zstandard.ZstdCompressor(level=10).compress(payload)
+        else:
+            data = gzip.compress(payload)
+        path = self._path(day, self.extension)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        return len(data)
+
+    def partitions(self, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """按日期升序列出分区文件"""
+        items = []
+        if not os.path.isdir(self.directory):
+            return items
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                match = _PARTITION.match(name)
+                if not match:
+                    continue
+                day = date.fromisoformat(match.group(1))
+                if (start and day < start) or (end and day > end):
+                    continue
+                path = os.path.join(root, name)
+                items.append({"date": day.isoformat(), "path": path, "bytes": os.path.getsize(path)})
+        return sorted(items, key=lambda p: (p["date"], p["path"]))
+
+    @staticmethod
+    def _open(path: str):
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"读取 {path} 需要安装zstandard")
+            raw = open(path, "rb")
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+            return io.TextIOWrapper(reader, encoding="utf-8")
+        return gzip.open(path, "rt", encoding="utf-8")
+
+    def iter_records(self, start: Optional[date] = None, end: Optional[date] = None,
+                     keyword: Optional[str] = None, record_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """按日期顺序读取归档记录；同一天内按id去重（归档后删除前中断会导致重复追加）"""
+        by_day: Dict[str, List[str]] = defaultdict(list)
+        for partition in self.partitions(start, end):
+            by_day[partition["date"]].append(partition["path"])
+        for day in sorted(by_day):
+            seen = set()
+            for path in by_day[day]:
+                with self._open(path) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        if record.get("id") in seen:
+                            continue
+                        seen.add(record.get("id"))
+                        if record_id is not None and record.get("id") != record_id:
+                            continue
+                        if keyword and keyword not in (record.get("question") or "") and keyword not in (record.get("answer") or ""):
+                            continue
+                        yield record
+
+
+class RetentionService:
+    """问答记录保留：把超过QA_RETENTION_DAYS天且没有反馈的记录移入归档，热表只保留近期与有反馈的记录"""
+
+    def __init__(self, store: Optional[ArchiveStore] = None):
+        self.retention_days = Config.QA_RETENTION_DAYS
+        self.batch_size = max(1, Config.RETENTION_BATCH_SIZE)
+        self.vacuum_pages = Config.RETENTION_VACUUM_PAGES
+        self.store = store or ArchiveStore(Config.ARCHIVE_DIR, Config.ARCHIVE_COMPRESSION)
+        self._run_lock = threading.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.retention_days > 0
+
+    @staticmethod
+    def ensure_indexes() -> None:
+        """为已有数据库补建按时间筛选与反馈关联所需的索引（新库由create_all创建）"""
+        for table in (QARecord.__table__, Feedback.__table__):
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+
+    @staticmethod
+    def _to_dict(record: QARecord) -> Dict[str, Any]:
+        return {
+            "id": record.id,
+            "question": record.question,
+            "answer": record.answer,
+            "created_at": record.created_at.isoformat() if record.created_at else None,
+            "model_used": record.model_used,
+            "process_log": record.process_log,
+            "人工介入": record.人工介入,
+        }
+
+    @staticmethod
+    def _delete_archived(db, ids: List[int]) -> int:
+        """删除已归档的记录；归档期间新增了反馈的记录保留在热表中"""
+        return (
+            db.query(QARecord)
+            .filter(QARecord.id.in_(ids), ~exists().where(Feedback.qa_record_id == QARecord.id))
+            .delete(synchronize_session=False)
+        )
+
+    def archive_expired(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """按批把过期记录写入归档并从热表删除，返回归档统计"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        stats = {"cutoff": cutoff.isoformat(), "archived": 0, "deleted": 0, "bytes": 0, "partitions": set()}
+        after_id = 0
+        while True:
+            db = SessionLocal()
+            try:
+                rows = (
+                    db.query(QARecord)
+                    .filter(QARecord.created_at < cutoff, QARecord.id > after_id,
+                            ~exists().where(Feedback.qa_record_id == QARecord.id))
+                    .order_by(QARecord.id)
+                    .limit(self.batch_size)
+                    .all()
+                )
+                records = [self._to_dict(r) for r in rows]
+            finally:
+                db.close()
+            if not records:
+                break
+            by_day: Dict[date, List[Dict[str, Any]]] = defaultdict(list)
+            for record in records:
+                by_day[date.fromisoformat(record["created_at"][:10])].append(record)
+            # 先落盘归档，再删除热表中的记录
+            for day, items in by_day.items():
+                stats["bytes"] += self.store.append(day, items)
+                stats["partitions"].add(day.isoformat())
+            stats["deleted"] += db_writer.call(self._delete_archived, [r["id"] for r in records])
+            stats["archived"] += len(records)
+            after_id = records[-1]["id"]
+        stats["partitions"] = sorted(stats["partitions"])
+        return stats
+
+    @staticmethod
+    def auto_vacuum_mode() -> Optional[str]:
+        if not is_sqlite(Config.DATABASE_URL):
+            return None
+        with engine.connect() as conn:
+            mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        return {0: "none", 1: "full", 2: "incremental"}.get(mode, str(mode))
+
+    @staticmethod
+    def freelist_pages() -> Optional[int]:
+        if not is_sqlite(Config.DATABASE_URL):
+            return None
+        with engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+    @staticmethod
+    def _incremental_vacuum(db, pages: int) -> None:
+        # pysqlite对PRAGMA只执行一步（即只回收一页），因此逐页执行
+        conn = db.connection()
+        free = conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+        for _ in range(min(int(pages), free)):
+            conn.exec_driver_sql("PRAGMA incremental_vacuum(1)")
+
+    def vacuum_step(self) -> int:
+        """经串行写入器回收最多vacuum_pages个空闲页，返回回收的页数（非增量回收模式下为0）"""
+        if self.vacuum_pages <= 0 or self.auto_vacuum_mode() != "incremental":
+            return 0
+        before = self.freelist_pages() or 0
+        if before == 0:
+            return 0
+        db_writer.call(self._incremental_vacuum, self.vacuum_pages)
+        # WAL模式下文件在检查点时才截短
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+        return before - (self.freelist_pages() or 0)
+
+    def run_once(self) -> Dict[str, Any]:
+        """执行一轮归档与空间回收"""
+        with self._run_lock:
+            started = datetime.utcnow()
+            result = self.archive_expired(started) if self.enabled else {"archived": 0}
+            result["vacuumed_pages"] = self.vacuum_step()
+            result["started_at"] = started.isoformat()
+            result["duration_ms"] = round((datetime.utcnow() - started).total_seconds() * 1000, 2)
+            self.last_run = result
+        if result["archived"]:
+            logger.info(f"已归档问答记录 {result['archived']} 条（{len(result['partitions'])}个分区），回收 {result['vacuumed_pages']} 页")
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        partitions = self.store.partitions()
+        return {
+            "enabled": self.enabled,
+            "retention_days": self.retention_days,
+            "archive_dir": self.store.directory,
+            "compression": self.store.extension,
+            "partitions": len(partitions),
+            "archive_bytes": sum(p["bytes"] for p in partitions),
+            "oldest_partition": partitions[0]["date"] if partitions else None,
+            "newest_partition": partitions[-1]["date"] if partitions else None,
+            "auto_vacuum": self.auto_vacuum_mode(),
+            "freelist_pages": self.freelist_pages(),
+            "last_run": self.last_run,
+        }
+
+
+def enable_incremental_vacuum() -> str:
+    """把已有SQLite数据库切换为增量回收模式（需要一次完整VACUUM，期间数据库被锁定）"""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    return RetentionService.auto_vacuum_mode()
+
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="问答记录保留与归档")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="立即执行一轮归档与空间回收")
+    sub.add_parser("status", help="查看归档与空间状态")
+    sub.add_parser("enable-incremental-vacuum", help="已有数据库切换为增量回收（执行一次VACUUM）")
+    export = sub.add_parser("export", help="导出归档记录为JSONL")
+    export.add_argument("--start", type=date.fromisoformat)
+    export.add_argument("--end", type=date.fromisoformat)
+    export.add_argument("--keyword")
+    export.add_argument("--output", default="-", help="输出文件（默认标准输出）")
+    args = parser.parse_args()
+
+    service = RetentionService()
+    if args.command == "run":
+        service.ensure_indexes()
+        print(json.dumps(service.run_once(), ensure_ascii=False, indent=2))
+    elif args.command == "status":
+        print(json.dumps(service.status(), ensure_ascii=False, indent=2))
+    elif args.command == "enable-incremental-vacuum":
+        print(f"auto_vacuum: {enable_incremental_vacuum()}")
+    else:
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            for record in service.store.iter_records(args.start, args.end, keyword=args.keyword):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    db_writer.close()
+
+
+if __name__ == "__main__":
+    main()
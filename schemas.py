@@ -81,10 +81,28 @@ class ChunksImportRequest(BaseModel):
 class SessionResponse(BaseModel):
     session_id: str
 
+class SessionInfo(BaseModel):
+    session_id: str
+    title: Optional[str] = None
+    created_at: Optional[datetime] = None
+    last_active_at: Optional[datetime] = None
+    message_count: int = 0
+
+    class Config:
+        from_attributes = True
+
 class SessionListResponse(BaseModel):
     sessions: List[str]
+    items: List[SessionInfo] = []
+    next_before: Optional[datetime] = None  # 下一页游标（按最近活跃时间倒序）
+    next_before_id: Optional[str] = None  # 与next_before一起传回，区分活跃时间相同的会话
 
 # Prompt设置
 class PromptSettings(BaseModel):
     system_prompt: Optional[str] = None
-    answer_prompt: Optional[str] = None
\ No newline at end of file
+    answer_prompt: Optional[str] = None
+
+# 批量问答
+class BatchQARequest(BaseModel):
+    questions: List[str]
+    concurrency: Optional[int] = None  # 生成并发数，默认BATCH_QA_CONCURRENCY
@@ -1,35 +1,92 @@
+import threading
+import time
 from sqlalchemy.orm import Session
 from typing import Optional, Dict, Any
+from config import Config
+from db_writer import db_writer
 from models import AppSetting
+from answer_cache import answer_cache
 
 class SettingsService:
-    """应用设置服务，用于管理Prompt等可变配置。"""
+    """应用设置服务，用于管理Prompt等可变配置。
+    设置值缓存在进程内存中；每次写入都会递增版本行，
+    其他工作进程只需定期读取这一行即可发现变更，无需逐个重读设置项。
+    """
     SYSTEM_PROMPT_KEY = "system_prompt"
     ANSWER_PROMPT_KEY = "answer_prompt"
+    VERSION_KEY = "__settings_version__"
+    PROMPT_KEYS = (SYSTEM_PROMPT_KEY, ANSWER_PROMPT_KEY)
+
+    # 进程内共享缓存（所有实例共用）
+    _cache_lock = threading.Lock()
+    _cached_version: Optional[int] = None
+    _cached_values: Dict[str, Any] = {}
+    _checked_at: float = 0.0
 
     def get_prompt_settings(self, db: Session) -> Dict[str, Optional[str]]:
-        system_prompt = self._get_value(db, self.SYSTEM_PROMPT_KEY)
-        answer_prompt = self._get_value(db, self.ANSWER_PROMPT_KEY)
+        values = self._get_cached_values(db)
+        system_prompt = values.get(self.SYSTEM_PROMPT_KEY)
+        answer_prompt = values.get(self.ANSWER_PROMPT_KEY)
         return {
             "system_prompt": system_prompt if isinstance(system_prompt, str) else None,
             "answer_prompt": answer_prompt if isinstance(answer_prompt, str) else None,
         }
 
     def update_prompt_settings(self, db: Session, system_prompt: Optional[str], answer_prompt: Optional[str]) -> Dict[str, Optional[str]]:
-        self._upsert_value(db, self.SYSTEM_PROMPT_KEY, system_prompt)
-        self._upsert_value(db, self.ANSWER_PROMPT_KEY, answer_prompt)
+        values = {self.SYSTEM_PROMPT_KEY: system_prompt, self.ANSWER_PROMPT_KEY: answer_prompt}
+        version = db_writer.call(self._write_prompt_settings, values)
+
+        cls = type(self)
+        with cls._cache_lock:
+            cls._cached_values = values
+            cls._cached_version = version
+            cls._checked_at = time.monotonic()
+        # 提示词变化后缓存答案全部失效
+        answer_cache.clear()
         return self.get_prompt_settings(db)
 
-    def _get_value(self, db: Session, key: str) -> Optional[Any]:
-        setting = db.query(AppSetting).filter(AppSetting.key == key).first()
-        return setting.value if setting else None
+    def _write_prompt_settings(self, db: Session, values: Dict[str, Optional[str]]) -> int:
+        """写函数：两个设置项与版本号在同一事务中写入，返回新版本号"""
+        rows = {
+            s.key: s for s in db.query(AppSetting).filter(AppSetting.key.in_(self.PROMPT_KEYS + (self.VERSION_KEY,))).all()
+        }
+        for key, value in values.items():
+            self._set_row(db, rows, key, value)
+        current = rows[self.VERSION_KEY].value if self.VERSION_KEY in rows else 0
+        version = (current if isinstance(current, int) else 0) + 1
+        self._set_row(db, rows, self.VERSION_KEY, version)
+        return version
+
+    def _get_cached_values(self, db: Session) -> Dict[str, Any]:
+        """返回缓存的设置值；超过检查间隔时读取版本行，版本变化才重新加载"""
+        cls = type(self)
+        now = time.monotonic()
+        with cls._cache_lock:
+            if cls._cached_version is not None and now - cls._checked_at < Config.SETTINGS_VERSION_CHECK_SECONDS:
+                return cls._cached_values
+        version = self._get_version(db)
+        with cls._cache_lock:
+            if version == cls._cached_version:
+                cls._checked_at = now
+                return cls._cached_values
+        settings = db.query(AppSetting).filter(AppSetting.key.in_(self.PROMPT_KEYS)).all()
+        values = {s.key: s.value for s in settings}
+        with cls._cache_lock:
+            cls._cached_values = values
+            cls._cached_version = version
+            cls._checked_at = now
+        return values
+
+    def _get_version(self, db: Session) -> int:
+        row = db.query(AppSetting.value).filter(AppSetting.key == self.VERSION_KEY).first()
+        value = row[0] if row else 0
+        return value if isinstance(value, int) else 0
 
-    def _upsert_value(self, db: Session, key: str, value: Optional[Any]) -> None:
-        setting = db.query(AppSetting).filter(AppSetting.key == key).first()
+    def _set_row(self, db: Session, rows: Dict[str, AppSetting], key: str, value: Optional[Any]) -> None:
+        setting = rows.get(key)
         if setting:
             setting.value = value
         else:
             setting = AppSetting(key=key, value=value)
             db.add(setting)
-        db.commit()
-        db.refresh(setting)
\ No newline at end of file
+            rows[key] = setting
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+class SingleFlight:
+    """并发请求合并：相同key的并发调用共享同一次上游执行。
+    上游调用在独立任务中运行，发起者断开不会影响其他等待者。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """返回(结果, 是否复用了他人发起的调用)"""
+        task = self._inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+class TokenBroadcast:
+    """将一个上游token流扇出给多个订阅者；晚加入的订阅者会先收到已产生的内容"""
+
+    def __init__(self, source: AsyncIterator[str]):
+        self._chunks: List[str] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                async with self._changed:
+                    self._chunks.append(chunk)
+                    self._changed.notify_all()
+        except BaseException as e:
+            self._error = e
+        finally:
+            async with self._changed:
+                self._done = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            async with self._changed:
+                while position >= len(self._chunks) and not self._done:
+                    await self._changed.wait()
+                pending = self._chunks[position:]
+                finished = self._done
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if finished and position >= len(self._chunks):
+                if self._error is not None and not isinstance(self._error, asyncio.CancelledError):
+                    raise self._error
+                return
+
+class StreamFlight:
+    """流式请求合并：相同key的并发流式请求订阅同一个上游token流"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, Tuple[TokenBroadcast, Any]] = {}
+
+    def subscribe(self, key: Hashable, factory: Callable[[], Tuple[AsyncIterator[str], Any]]) -> Tuple[AsyncIterator[str], Any, bool]:
+        """factory返回(上游token流, 附带状态)；返回(订阅流, 附带状态, 是否复用)。
+        附带状态（如共享的process_log）由所有订阅者共享，上游结束后可读取。
+        """
+        entry = self._inflight.get(key)
+        if entry is not None:
+            broadcast, state = entry
+            return broadcast.subscribe(), state, True
+        source, state = factory()
+        broadcast = TokenBroadcast(source)
+        self._inflight[key] = (broadcast, state)
+        broadcast.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return broadcast.subscribe(), state, False
+
+    def inflight(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 模块级的默认引擎与客户端只在导入时创建，不会连接；测试各自使用临时数据库，
+# 默认引擎与各文件路径指向本次测试的临时目录，不触碰工作目录中的数据
+_TMP_DIR = tempfile.mkdtemp(prefix="knowhub-tests-")
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("EMBEDDING_API_KEY", "test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP_DIR, 'app.db')}")
+os.environ.setdefault("QA_RECORD_SPILL_PATH", os.path.join(_TMP_DIR, "qa_records.spill.jsonl"))
+os.environ.setdefault("ARCHIVE_DIR", os.path.join(_TMP_DIR, "archive"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_TMP_DIR, "profiles"))
+
+from database import create_db_engine  # noqa: E402
+from db_writer import DBWriter  # noqa: E402
+from models import Base  # noqa: E402
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+def writer(session_factory):
+    writer = DBWriter(session_factory, serialized=True, immediate=True)
+    yield writer
+    writer.close()
+
+
+@pytest.fixture(scope="session")
+def app_tables():
+    """在默认引擎（本次测试的临时数据库）上建表，供使用模块级写入器与SessionLocal的服务"""
+    from database import engine as default_engine
+    Base.metadata.create_all(bind=default_engine)
+    return default_engine
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import PRIORITY_ASK, PRIORITY_BATCH, PRIORITY_STREAM, AdmissionController, OverloadedError
+
+
+def test_released_slot_goes_to_highest_priority_waiter():
+    controller = AdmissionController("t", limit=1, max_queue=10, max_wait_ms=2000)
+    order = []
+
+    async def waiter(name, priority):
+        async with controller.slot(priority):
+            order.append(name)
+
+    async def run():
+        await controller.acquire(PRIORITY_ASK)
+        tasks = [asyncio.create_task(waiter("batch", PRIORITY_BATCH))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(waiter("ask", PRIORITY_ASK)))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(waiter("stream", PRIORITY_STREAM)))
+        await asyncio.sleep(0.01)
+        controller._release(0.0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+    assert order == ["stream", "ask", "batch"]
+    assert controller.stats()["active"] == 0
+
+
+def test_rejects_when_queue_is_full():
+    controller = AdmissionController("t", limit=1, max_queue=1, max_wait_ms=2000)
+
+    async def run():
+        await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0.01)
+        with pytest.raises(OverloadedError) as exc:
+            controller.check()
+        assert exc.value.reason == "queue_full"
+        with pytest.raises(OverloadedError):
+            await controller.acquire()
+        controller._release(0.0)
+        await queued
+        controller._release(0.0)
+
+    asyncio.run(run())
+
+    assert controller.stats()["rejected"] == 2
+
+
+def test_async_wait_times_out_and_leaves_no_queued_waiter():
+    controller = AdmissionController("t", limit=1, max_queue=10, max_wait_ms=50)
+
+    async def run():
+        await controller.acquire()
+        with pytest.raises(OverloadedError) as exc:
+            await controller.acquire()
+        assert exc.value.reason == "wait_timeout"
+        controller._release(0.0)
+
+    asyncio.run(run())
+
+    stats = controller.stats()
+    assert stats["queue_depth"] == 0 and stats["active"] == 0
+
+
+def test_blocking_acquire_times_out_instead_of_holding_the_thread():
+    controller = AdmissionController("t", limit=1, max_queue=10, max_wait_ms=50)
+    controller.acquire_blocking()
+
+    start = time.perf_counter()
+    with pytest.raises(OverloadedError) as exc:
+        with controller.blocking_slot(PRIORITY_BATCH):
+            pass
+    assert exc.value.reason == "wait_timeout"
+    assert time.perf_counter() - start < 1.0
+    assert controller.stats()["queue_depth"] == 0
+
+    controller._release(0.0)
+    assert controller.stats()["active"] == 0
+
+
+def test_blocking_acquire_gets_slot_released_by_another_thread():
+    controller = AdmissionController("t", limit=1, max_queue=10, max_wait_ms=50)
+    controller.acquire_blocking()
+    threading.Timer(0.05, controller._release, args=(0.0,)).start()
+
+    # 显式超时长于默认的max_wait
+    with controller.blocking_slot(PRIORITY_BATCH, timeout=2.0):
+        assert controller.stats()["active"] == 1
+
+    assert controller.stats()["active"] == 0
@@ -0,0 +1,69 @@
+import random
+from datetime import date, datetime
+
+from analytics_service import AnalyticsService, LatencySketch
+from database import SessionLocal
+from models import Feedback, QARecord
+
+
+def _exact(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def test_sketch_quantiles_within_relative_accuracy():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(6, 1) for _ in range(5000)]
+    sketch = LatencySketch(relative_accuracy=0.02)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.9, 0.99):
+        assert abs(sketch.quantile(q) - _exact(values, q)) / _exact(values, q) <= 0.02
+    assert LatencySketch().quantile(0.5) is None
+
+
+def test_merged_sketches_match_single_sketch_and_survive_json():
+    rng = random.Random(3)
+    values = [rng.uniform(5, 5000) for _ in range(2000)]
+    whole, left, right = LatencySketch(), LatencySketch(), LatencySketch()
+    for i, value in enumerate(values):
+        whole.add(value)
+        (left if i % 2 else right).add(value)
+
+    left.merge(right)
+    restored = LatencySketch.from_json(left.to_json())
+
+    assert restored.buckets == whole.buckets and restored.count == 2000
+    assert restored.quantile(0.99) == whole.quantile(0.99)
+
+
+def test_apply_accumulates_records_and_feedback_per_day_and_model(app_tables):
+    day = datetime(2001, 5, 1, 12)
+
+    def record(status, total_ms, cache_hit=False):
+        return QARecord(question="问题", answer="答", created_at=day, model_used="stats-model",
+                        process_log={"status": status, "category": "补偿", "cache": {"hit": cache_hit},
+                                     "prompt_tokens": 10, "response_tokens": 5, "total_tokens": 15,
+                                     "timings": {"total_ms": total_ms}})
+
+    db = SessionLocal()
+    records = [record("success", 100), record("success", 200, cache_hit=True), record("error", 4000)]
+    db.add_all(records)
+    db.flush()
+    AnalyticsService.apply(db, records=records)
+    # 反馈与问答记录不在同一批写入：维度从问答记录中查得
+    feedback = [Feedback(qa_record_id=records[0].id, is_useful=True, created_at=day),
+                Feedback(qa_record_id=records[2].id, is_useful=False, created_at=day)]
+    db.add_all(feedback)
+    AnalyticsService.apply(db, feedback=feedback)
+    db.commit()
+    db.close()
+
+    totals = AnalyticsService().summary(days=1, end=date(2001, 5, 1), model="stats-model")["totals"]
+
+    assert (totals["questions"], totals["errors"], totals["cache_hits"]) == (3, 1, 1)
+    assert (totals["thumbs_up"], totals["thumbs_down"], totals["total_tokens"]) == (1, 1, 45)
+    assert totals["satisfaction"] == 0.5
+    assert totals["latency_ms"]["count"] == 3
+    assert abs(totals["latency_ms"]["p50"] - 200) <= 200 * 0.02
@@ -0,0 +1,78 @@
+import time
+from datetime import datetime
+
+import numpy as np
+
+from answer_cache import AnswerCache
+from models import Knowledge
+
+PROMPTS = {"system_prompt": "S", "answer_prompt": "A"}
+
+
+def _hits(*versions):
+    return [(Knowledge(id=i + 1, title="t", content="c", updated_at=datetime(2026, 1, 1, v)), 0.9) for i, v in enumerate(versions)]
+
+
+def _cache(**kwargs):
+    return AnswerCache(**{"threshold": 0.95, "max_entries": 100, "ttl_seconds": 0, **kwargs})
+
+
+def test_hits_similar_question_with_same_signature():
+    cache = _cache()
+    kkey, pkey = AnswerCache.knowledge_key(_hits(1, 1)), AnswerCache.prompt_key(PROMPTS)
+    cache.store(np.array([1.0, 0.0, 0.0]), kkey, pkey, "答案", qa_record_id=7)
+
+    hit = cache.lookup(np.array([0.99, 0.05, 0.0]), kkey, pkey)
+
+    assert hit["answer"] == "答案" and hit["source_qa_record_id"] == 7
+    assert hit["similarity"] > 0.95
+    assert cache.lookup(np.array([0.0, 1.0, 0.0]), kkey, pkey) is None
+
+
+def test_signature_changes_when_knowledge_or_prompt_changes():
+    cache = _cache()
+    kkey, pkey = AnswerCache.knowledge_key(_hits(1, 1)), AnswerCache.prompt_key(PROMPTS)
+    cache.store(np.array([1.0, 0.0]), kkey, pkey, "答案")
+
+    # 知识条目更新后版本不同，签名不同，旧答案不会命中
+    updated = AnswerCache.knowledge_key(_hits(1, 2))
+    assert updated != kkey
+    assert cache.lookup(np.array([1.0, 0.0]), updated, pkey) is None
+    changed_prompt = AnswerCache.prompt_key({**PROMPTS, "answer_prompt": "B"})
+    assert cache.lookup(np.array([1.0, 0.0]), kkey, changed_prompt) is None
+
+
+def test_invalidate_knowledge_removes_entries_that_reference_it():
+    cache = _cache()
+    pkey = AnswerCache.prompt_key(PROMPTS)
+    with_one = AnswerCache.knowledge_key(_hits(1))
+    with_both = AnswerCache.knowledge_key(_hits(1, 1))
+    other = ((5, "v"),)
+    for key in (with_one, with_both, other):
+        cache.store(np.array([1.0, 0.0]), key, pkey, "答案")
+
+    cache.invalidate_knowledge(2)
+
+    assert cache.lookup(np.array([1.0, 0.0]), with_both, pkey) is None
+    assert cache.lookup(np.array([1.0, 0.0]), with_one, pkey) is not None
+    assert cache.stats()["entries"] == 2
+
+
+def test_evicts_least_recently_used_and_expires_by_ttl(monkeypatch):
+    cache = _cache(max_entries=2)
+    pkey = AnswerCache.prompt_key(PROMPTS)
+    keys = [((i, "v"),) for i in range(3)]
+    cache.store(np.array([1.0, 0.0]), keys[0], pkey, "a0")
+    cache.store(np.array([1.0, 0.0]), keys[1], pkey, "a1")
+    assert cache.lookup(np.array([1.0, 0.0]), keys[0], pkey) is not None
+    cache.store(np.array([1.0, 0.0]), keys[2], pkey, "a2")
+
+    assert cache.lookup(np.array([1.0, 0.0]), keys[1], pkey) is None
+    assert cache.lookup(np.array([1.0, 0.0]), keys[0], pkey)["answer"] == "a0"
+
+    ttl_cache = _cache(ttl_seconds=10)
+    ttl_cache.store(np.array([1.0, 0.0]), keys[0], pkey, "a0")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert ttl_cache.lookup(np.array([1.0, 0.0]), keys[0], pkey) is None
+    assert ttl_cache.stats()["entries"] == 0
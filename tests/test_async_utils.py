@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from async_utils import run_blocking, run_cpu_bound
+from config import Config
+from embedding_service import EmbeddingService
+
+
+def test_blocking_calls_run_in_bounded_pools_without_blocking_the_loop():
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        io_thread = await run_blocking(lambda: (time.sleep(0.2), threading.current_thread().name)[1])
+        cpu_thread = await run_cpu_bound(lambda: threading.current_thread().name)
+        task.cancel()
+        return io_thread, cpu_thread, ticks
+
+    io_thread, cpu_thread, ticks = asyncio.run(run())
+
+    assert io_thread.startswith("blocking-io")
+    assert cpu_thread.startswith("cpu-bound")
+    # 阻塞调用期间事件循环仍在调度其他任务
+    assert ticks >= 5
+
+
+class FakeEmbeddings:
+    """按输入返回embedding，且故意打乱返回顺序"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def create(self, model, input):
+        self.batches.append(list(input))
+        data = [SimpleNamespace(index=i, embedding=[float(len(text)), float(i)]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+def test_batch_embeddings_are_split_and_keep_input_order(monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_BATCH_SIZE", 2)
+    service = EmbeddingService()
+    service.base_url = "http://embedding.test/v1"
+    fake = FakeEmbeddings()
+    service._async_client = SimpleNamespace(embeddings=fake, close=lambda: asyncio.sleep(0))
+
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    vectors = asyncio.run(service.aget_embeddings(texts))
+
+    assert fake.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+    assert [int(v[0]) for v in vectors] == [1, 2, 3, 4, 5]
+    assert all(isinstance(v, np.ndarray) and v.dtype == np.float32 for v in vectors)
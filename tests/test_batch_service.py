@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+import main
+from batch_service import BatchQAService
+from database import SessionLocal
+from models import BatchJob, BatchJobItem
+from qa_service import QAService
+
+
+class FakeEmbedding:
+    async def aget_embeddings(self, texts, priority):
+        # 触发批量检索的文本匹配回退，无需向量库
+        raise RuntimeError("embedding unavailable")
+
+
+class FakeQA:
+    """批量任务用到的问答服务接口：生成时对fail中的问题返回失败"""
+
+    def __init__(self):
+        self.embedding_service = FakeEmbedding()
+        self.rerank_service = type("Rerank", (), {"enabled": False})()
+        self.fail = set()
+        self.asked = []
+
+    def _search_knowledge_by_text(self, db, question):
+        return []
+
+    def _build_context(self, similar):
+        return "ctx", {"tokens": 0}
+
+    def _primary_category(self, similar):
+        return None
+
+    def _record_to_dict(self, qa_record):
+        return QAService._record_to_dict(self, qa_record)
+
+    async def generate_answer(self, db, question, context, priority=None):
+        self.asked.append(question)
+        if question in self.fail:
+            return {"answer": "", "process_log": {"status": "error", "model": "m", "error_message": "upstream down"}}
+        return {"answer": f"答：{question}", "process_log": {"status": "success", "model": "m"}}
+
+
+@pytest.fixture
+def service(app_tables):
+    return BatchQAService(FakeQA())
+
+
+def _run(service, job_id):
+    async def run():
+        return [event async for event in service.run_job(job_id)]
+    return asyncio.run(run())
+
+
+def _job(job_id):
+    db = SessionLocal()
+    try:
+        job = db.query(BatchJob).filter(BatchJob.id == job_id).one()
+        items = db.query(BatchJobItem).filter(BatchJobItem.job_id == job_id).order_by(BatchJobItem.position).all()
+        return job.status, job.completed, [it.status for it in items]
+    finally:
+        db.close()
+
+
+def test_claim_is_exclusive_until_released(service):
+    assert service.claim("j1")
+    assert not service.claim("j1")
+    service.release("j1")
+    assert service.claim("j1")
+
+
+def test_run_requires_claim(service):
+    job = service.create_job(["q1"])
+    with pytest.raises(RuntimeError):
+        _run(service, job.id)
+
+
+def test_resume_reruns_only_unfinished_questions(service):
+    service.qa_service.fail = {"q2"}
+    job = service.create_job(["q1", "q2", "  ", "q3"], concurrency=2)
+    assert job.total == 3
+
+    assert service.claim(job.id)
+    events = _run(service, job.id)
+    service.release(job.id)
+
+    assert events[0]["type"] == "job" and events[0]["pending"] == 3
+    assert sorted(e["status"] for e in events if e["type"] == "result") == ["done", "done", "error"]
+    assert events[-1]["type"] == "done" and events[-1]["status"] == "interrupted"
+
+    service.qa_service.fail = set()
+    service.qa_service.asked.clear()
+    assert service.claim(job.id)
+    events = _run(service, job.id)
+    service.release(job.id)
+
+    assert service.qa_service.asked == ["q2"]
+    assert events[-1]["status"] == "completed"
+    assert _job(job.id) == ("completed", 3, ["done", "done", "done"])
+
+
+class _Disconnect(OSError):
+    pass
+
+
+def _call_response(response, fail_after):
+    """以ASGI方式执行响应；第fail_after次send时模拟客户端已断开"""
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if len(sent) >= fail_after:
+            raise _Disconnect("client disconnected")
+        sent.append(message)
+
+    async def run():
+        with pytest.raises((_Disconnect, ClientDisconnect)):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    asyncio.run(run())
+    return sent
+
+
+def test_disconnect_before_stream_starts_releases_claim(service, monkeypatch):
+    monkeypatch.setitem(main.container.__dict__, "batch_service", service)
+    job = service.create_job(["q1"])
+    assert service.claim(job.id)
+
+    response = main.BatchStreamingResponse(job.id)
+    _call_response(response, fail_after=0)
+
+    # 事件流从未开始：任务未执行，占用已释放，可以继续执行
+    assert not service.is_running(job.id)
+    assert _job(job.id) == ("pending", 0, ["pending"])
+
+
+def test_disconnect_mid_stream_marks_interrupted_and_releases_claim(service, monkeypatch):
+    monkeypatch.setitem(main.container.__dict__, "batch_service", service)
+    job = service.create_job(["q1", "q2"], concurrency=1)
+    assert service.claim(job.id)
+
+    sent = _call_response(main.BatchStreamingResponse(job.id), fail_after=2)
+
+    assert json.loads(sent[1]["body"])["type"] == "job"
+    assert not service.is_running(job.id)
+    status, _, _ = _job(job.id)
+    assert status == "interrupted"
@@ -0,0 +1,50 @@
+import io
+
+import numpy as np
+import pytest
+
+from benchmarks.e2e_bench import compare, make_policy_pdf, percentiles
+from vector_store import InMemoryVectorStore
+
+
+def test_in_memory_store_ranks_by_cosine_similarity():
+    store = InMemoryVectorStore()
+    store.index(1, np.array([1.0, 0.0]))
+    store.index(2, np.array([3.0, 3.0]))
+    store.index(3, np.array([0.0, 2.0]))
+
+    results = store.search(np.array([2.0, 0.1]), top_k=2)
+    assert [i for i, _ in results] == [1, 2]
+    assert abs(results[0][1] - 0.9988) < 1e-3
+
+    store.delete_by_id(1)
+    store.index(3, np.array([1.0, 0.0]))
+    assert [i for i, _ in store.search(np.array([2.0, 0.1]), top_k=5)] == [3, 2]
+    assert InMemoryVectorStore().search_batch([np.array([1.0, 0.0])]) == [[]]
+
+
+def test_generated_pdf_is_readable():
+    pdfplumber = pytest.importorskip("pdfplumber")
+    with pdfplumber.open(io.BytesIO(make_policy_pdf(articles=20, lines_per_page=30))) as pdf:
+        text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+        assert len(pdf.pages) == 2
+    assert "Article 1 " in text and "Article 20 " in text
+
+
+def _result(ttft_p50, rss):
+    level = {"concurrency": 4, "ttft": {"p50_ms": ttft_p50, "p99_ms": 100}, "latency": {"p50_ms": 200, "p99_ms": 400}}
+    return {"ingest": {"chunks_per_s": 50}, "ask": [], "stream": [level], "memory": {"peak_rss_mb": rss}}
+
+
+def test_compare_reports_only_regressions_beyond_tolerance():
+    baseline = _result(ttft_p50=50, rss=100)
+
+    assert compare(_result(ttft_p50=55, rss=80), baseline, tolerance=0.2) == []
+    regressions = compare(_result(ttft_p50=80, rss=100), baseline, tolerance=0.2)
+    assert len(regressions) == 1 and regressions[0].startswith("stream.c4.ttft.p50_ms")
+
+
+def test_percentiles_in_milliseconds():
+    stats = percentiles([0.001 * i for i in range(1, 101)])
+    assert stats == {"p50_ms": 51.0, "p90_ms": 91.0, "p99_ms": 100.0, "max_ms": 100.0}
+    assert percentiles([])["p50_ms"] is None
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+import llm_router
+import main
+from config import Config
+from container import Container, ServiceUnavailableError
+
+
+@pytest.fixture
+def container(app_tables, monkeypatch):
+    container = Container()
+    monkeypatch.setattr(main, "container", container)
+    yield container
+    asyncio.run(container.aclose())
+
+
+def test_missing_embedding_key_does_not_prevent_startup(container, monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_API_KEY", "")
+
+    container.create_services()
+
+    assert container._warm_up_error is None
+    assert container.initialized("qa_service")
+    # 缺少凭据只在调用时失败（问答检索据此回退为文本匹配）
+    with pytest.raises(openai.OpenAIError):
+        container.embedding_service.get_embedding("补偿标准")
+
+
+def test_failed_service_is_cached_and_not_rebuilt(container, monkeypatch):
+    calls = []
+
+    def load_endpoints():
+        calls.append(1)
+        raise openai.OpenAIError("Missing credentials")
+    monkeypatch.setattr(llm_router, "_load_endpoints", load_endpoints)
+
+    container.create_services()
+
+    assert "qa_service" in container._warm_up_error and "Missing credentials" in container._warm_up_error
+    # 不依赖问答服务的服务照常创建
+    assert container.initialized("memory_service") and container.initialized("retention_service")
+    for _ in range(3):
+        with pytest.raises(ServiceUnavailableError) as exc:
+            container.qa_service
+    assert exc.value.service == "qa_service"
+    assert len(calls) == 1
+    readiness = container.readiness()
+    assert not readiness["ready"] and readiness["checks"]["services"]["status"] == "error"
+
+
+def test_endpoints_return_503_for_a_failed_service(container, monkeypatch):
+    def load_endpoints():
+        raise openai.OpenAIError("Missing credentials")
+    monkeypatch.setattr(llm_router, "_load_endpoints", load_endpoints)
+    container.create_services()
+
+    client = TestClient(main.app)
+
+    response = client.get("/llm/endpoints")
+    assert response.status_code == 503
+    assert "Missing credentials" in response.json()["detail"]
+    assert client.get("/sessions").status_code == 200
+    assert client.get("/healthz").status_code == 200
+
+
+def test_created_service_is_read_without_the_container_lock(container):
+    settings = container.settings_service
+    acquired = threading.Event()
+    done = threading.Event()
+
+    def hold_lock():
+        with container._lock:
+            acquired.set()
+            done.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    acquired.wait(5)
+    try:
+        start = time.perf_counter()
+        assert container.settings_service is settings
+        assert Container.settings_service.__get__(container) is settings
+        assert time.perf_counter() - start < 0.1
+    finally:
+        done.set()
+        holder.join()
@@ -0,0 +1,50 @@
+from context_packer import ContextPacker
+from models import Knowledge
+from token_counter import count_tokens
+
+
+def _k(id, title, content):
+    return Knowledge(id=id, title=title, content=content, category="c")
+
+
+def test_drops_hits_below_similarity_floor_and_duplicates():
+    packer = ContextPacker(token_budget=1000, min_similarity=0.5, model="m")
+    hits = [(_k(1, "a", "补偿标准为每平方米100元"), 0.9), (_k(2, "b", "补偿标准"), 0.8), (_k(3, "c", "无关内容"), 0.2)]
+
+    context, log = packer.pack(hits)
+
+    assert "每平方米100元" in context and "无关内容" not in context
+    reasons = {d["id"]: d["reason"] for d in log["dropped"]}
+    assert reasons == {2: "duplicate", 3: "below_similarity_floor"}
+
+
+def test_merges_adjacent_chunks_and_strips_overlap():
+    packer = ContextPacker(token_budget=1000, min_similarity=0.0, model="m")
+    hits = [(_k(11, "政策.pdf - 段落 2", "第二段内容。重叠部分"), 0.7), (_k(12, "政策.pdf - 段落 3", "重叠部分之后的第三段"), 0.9)]
+
+    context, log = packer.pack(hits)
+
+    assert "政策.pdf - 段落 2-3" in context
+    assert context.count("重叠部分") == 1
+    assert log["included"][0]["ids"] == [11, 12]
+
+
+def test_stays_within_token_budget():
+    packer = ContextPacker(token_budget=120, min_similarity=0.0, model="m")
+    hits = [(_k(i, f"t{i}", f"第{i}条" + "补偿" * 60), 1.0 - i / 10) for i in range(1, 4)]
+
+    context, log = packer.pack(hits)
+
+    assert log["tokens"] <= 120
+    assert count_tokens(context, "m") <= 120 + 2
+    assert any(d["reason"] == "over_budget" for d in log["dropped"])
+
+
+def test_stable_order_ignores_similarity_order():
+    packer = ContextPacker(token_budget=1000, min_similarity=0.0, model="m", stable_order=True)
+    a, b = _k(1, "a", "甲"), _k(2, "b", "乙")
+
+    first, _ = packer.pack([(a, 0.9), (b, 0.8)])
+    second, _ = packer.pack([(b, 0.9), (a, 0.8)])
+
+    assert first == second
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from models import AppSetting
+
+
+def _put(db, key, value):
+    db.add(AppSetting(key=key, value=value))
+    return key
+
+
+def _fail(db):
+    db.add(AppSetting(key="broken", value=1))
+    raise ValueError("bad write")
+
+
+def test_group_commit_returns_results(writer, session_factory):
+    assert writer.call(_put, "a", 1) == "a"
+    db = session_factory()
+    try:
+        assert db.query(AppSetting).filter_by(key="a").one().value == 1
+    finally:
+        db.close()
+
+
+def test_bad_write_in_batch_is_retried_item_by_item(writer, session_factory):
+    # 第一个写操作阻塞写线程，使后续写操作排队并在同一批中提交
+    release = threading.Event()
+    blocker = writer.submit(lambda db: release.wait(5))
+    futures = [writer.submit(_put, "a", 1), writer.submit(_fail), writer.submit(_put, "b", 2)]
+    release.set()
+    blocker.result(5)
+
+    assert futures[0].result(5) == "a"
+    assert futures[2].result(5) == "b"
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    db = session_factory()
+    try:
+        assert {s.key for s in db.query(AppSetting)} == {"a", "b"}
+    finally:
+        db.close()
+
+
+def test_close_drains_queued_writes(writer, session_factory):
+    release = threading.Event()
+    writer.submit(lambda db: release.wait(5))
+    futures = [writer.submit(_put, f"k{i}", i) for i in range(20)]
+    closer = threading.Thread(target=writer.close)
+    closer.start()
+    release.set()
+    closer.join(5)
+
+    assert [f.result(0) for f in futures] == [f"k{i}" for i in range(20)]
+    db = session_factory()
+    try:
+        assert db.query(AppSetting).count() == 20
+    finally:
+        db.close()
+
+
+def test_submit_after_close_does_not_hang(writer, session_factory):
+    writer.call(_put, "before", 1)
+    writer.close()
+    assert writer.call(_put, "after", 2, timeout=5) == "after"
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+import token_counter
+from history_service import HistoryService
+from memory_service import ChatMessage
+from models import SessionSummary
+from token_counter import MESSAGE_OVERHEAD_TOKENS, count_tokens, truncate_to_tokens
+
+
+class FakeMemory:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def get_messages(self, session_id):
+        return list(self.messages)
+
+
+def _turns(n):
+    messages = []
+    for i in range(n):
+        messages.append(ChatMessage("human", f"问题{i}"))
+        messages.append(ChatMessage("ai", f"回答{i}"))
+    return messages
+
+
+def _cost(text, model):
+    return count_tokens(text, model) + MESSAGE_OVERHEAD_TOKENS
+
+
+@pytest.fixture
+def db(session_factory):
+    db = session_factory()
+    yield db
+    db.close()
+
+
+def test_history_keeps_newest_messages_within_budget(db):
+    history = HistoryService(FakeMemory(_turns(5)), client=None)
+    # 预算只够最近三条消息：最早保留的一条是助手回复，应被丢弃以保证以用户消息开头
+    history.token_budget = sum(_cost(text, history.model) for text in ("回答3", "问题4", "回答4"))
+
+    messages = history.build_history(db, "s1")
+
+    assert [m["content"] for m in messages] == ["问题4", "回答4"]
+    assert messages[0]["role"] == "user"
+
+
+def test_history_keeps_unsummarized_messages_when_summary_lags(db):
+    db.add(SessionSummary(session_id="s1", summary="用户询问了补偿标准", summarized_messages=2))
+    db.commit()
+    history = HistoryService(FakeMemory(_turns(4)), client=None)
+    history.recent_messages = 2
+    history.token_budget = 10_000
+
+    messages = history.build_history(db, "s1")
+
+    assert messages[0]["role"] == "system" and "用户询问了补偿标准" in messages[0]["content"]
+    # 已折叠的第0轮不再以原文出现；超出最近N轮但尚未摘要的第1、2轮仍保留
+    assert [m["content"] for m in messages[1:]] == ["问题1", "回答1", "问题2", "回答2", "问题3", "回答3"]
+
+
+def test_token_estimate_without_tokenizer(monkeypatch):
+    monkeypatch.setattr(token_counter, "tiktoken", None)
+    token_counter._get_encoding.cache_clear()
+    try:
+        # 中日韩字符按1个token计，其余字符约4个一个token
+        assert count_tokens("补偿标准", "m") == 4
+        assert count_tokens("abcdefgh", "m") == 2
+        truncated = truncate_to_tokens("补偿标准" * 10, 6, "m")
+        assert truncated == "补偿标准补偿"
+    finally:
+        token_counter._get_encoding.cache_clear()
+
+
+def test_tokenizer_load_failure_falls_back_to_estimate(monkeypatch):
+    def offline(*args, **kwargs):
+        raise ConnectionError("offline")
+    monkeypatch.setattr(token_counter, "tiktoken", SimpleNamespace(get_encoding=offline, encoding_for_model=offline))
+    token_counter._get_encoding.cache_clear()
+    try:
+        assert token_counter._get_encoding("gpt-4o") is None
+        assert count_tokens("补偿标准", "gpt-4o") == 4
+    finally:
+        token_counter._get_encoding.cache_clear()
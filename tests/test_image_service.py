@@ -0,0 +1,61 @@
+import base64
+import io
+
+import pytest
+
+from image_service import ImagePreprocessor, detect_mime
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _decode(data_url):
+    header, payload = data_url.split(",", 1)
+    return header, Image.open(io.BytesIO(base64.b64decode(payload)))
+
+
+def test_detect_mime_uses_magic_numbers():
+    assert detect_mime(b"\x89PNG\r\n\x1a\n....") == "image/png"
+    assert detect_mime(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert detect_mime(b"not an image") is None
+
+
+def test_small_supported_image_is_sent_unchanged():
+    data = _encode(Image.new("RGB", (32, 32), (200, 10, 10)), "PNG")
+
+    data_url, info = ImagePreprocessor(max_edge=64, target_bytes=100_000).prepare(data)
+
+    assert data_url == "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+    assert info["prepared_bytes"] == len(data) and info["cache_hit"] is False
+
+
+def test_large_transparent_image_is_resized_and_compressed_to_jpeg():
+    noise = Image.effect_noise((400, 200), 80).convert("RGBA")
+    data = _encode(noise, "PNG")
+
+    data_url, info = ImagePreprocessor(max_edge=100, target_bytes=20_000).prepare(data)
+
+    header, prepared = _decode(data_url)
+    assert header == "data:image/jpeg;base64"
+    assert max(prepared.size) <= 100 and prepared.mode == "RGB"
+    assert info["original_size"] == [400, 200] and info["prepared_bytes"] <= 20_000
+
+
+def test_repeated_image_hits_content_hash_cache():
+    preprocessor = ImagePreprocessor(max_edge=64, target_bytes=100_000, cache_entries=1)
+    first = _encode(Image.new("RGB", (8, 8), (0, 0, 0)), "PNG")
+    second = _encode(Image.new("RGB", (8, 8), (255, 255, 255)), "PNG")
+
+    url, _ = preprocessor.prepare(first)
+    cached_url, info = preprocessor.prepare(first)
+    assert cached_url == url and info["cache_hit"] is True
+
+    # 容量为1：新图片挤掉旧条目
+    preprocessor.prepare(second)
+    assert preprocessor.prepare(first)[1]["cache_hit"] is False
+    assert preprocessor.stats()["entries"] == 1
@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from config import Config
+from llm_router import LLMEndpoint, LLMRouter
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class _FakeStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            yield _chunk(chunk)
+
+    async def close(self):
+        self.closed = True
+
+
+def _endpoint(name, delay=0.0, fail=False, answer="答案"):
+    """端点的client替换为假实现：等待delay秒后失败或返回固定回答"""
+    endpoint = LLMEndpoint(name, "http://127.0.0.1:1/v1", "test-key", "m", window=10)
+    endpoint.calls = 0
+
+    async def create(model, messages, stream=False, **kwargs):
+        endpoint.calls += 1
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(f"{name} down")
+        if stream:
+            return _FakeStream([answer[:1], answer[1:]])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    endpoint.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return endpoint
+
+
+def _collect(router, route_log):
+    async def run():
+        return "".join([c.choices[0].delta.content async for c in router.stream([], route_log)])
+    return asyncio.run(run())
+
+
+def test_stream_hedges_slow_primary_and_abandons_it():
+    slow, fast = _endpoint("slow", delay=0.5, answer="慢的"), _endpoint("fast", answer="快的")
+    router = LLMRouter([slow, fast])
+    router.hedge_after = 0.02
+    route_log = {}
+
+    assert _collect(router, route_log) == "快的"
+
+    assert route_log["hedged"] is True and route_log["endpoint"] == "fast"
+    statuses = {(a["endpoint"], a.get("status")) for a in route_log["attempts"]}
+    assert ("slow", "abandoned") in statuses and ("fast", "success") in statuses
+    # 对冲落败方结果未知，不计入健康窗口
+    assert slow.stats()["requests"] == 0 and slow.stats()["abandoned"] == 1
+
+
+def test_complete_fails_over_without_hedging():
+    slow, spare = _endpoint("slow", delay=0.05), _endpoint("spare")
+    router = LLMRouter([slow, spare])
+    router.hedge_after = 0.01
+    route_log = {}
+
+    response, endpoint = asyncio.run(router.complete([], route_log))
+    # 非流式调用耗时取决于回答长度，不做对冲
+    assert endpoint is slow and spare.calls == 0 and "hedged" not in route_log
+    assert response.choices[0].message.content == "答案"
+
+    broken = _endpoint("broken", fail=True)
+    route_log = {}
+    _, endpoint = asyncio.run(LLMRouter([broken, spare]).complete([], route_log))
+    assert endpoint is spare
+    assert [a.get("reason") or a.get("status") for a in route_log["attempts"]] == ["primary", "error", "failover", "success"]
+
+
+def test_all_endpoints_failing_raises_last_error():
+    router = LLMRouter([_endpoint("a", fail=True), _endpoint("b", fail=True)])
+    with pytest.raises(RuntimeError, match="b down"):
+        asyncio.run(router.complete([], {}))
+
+
+def test_consecutive_failures_open_circuit_and_demote_endpoint(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_BREAKER_FAILURES", 2)
+    flaky, healthy = _endpoint("flaky"), _endpoint("healthy")
+    healthy.record_success(5.0)
+    router = LLMRouter([flaky, healthy])
+    assert router.ordered()[0] is flaky
+
+    flaky.record_failure(0.1)
+    assert not flaky.circuit_open
+    flaky.record_failure(0.1)
+
+    assert flaky.circuit_open and flaky.stats()["error_rate"] == 1.0
+    assert router.ordered()[0] is healthy
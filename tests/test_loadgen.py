@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import httpx
+import pytest
+
+# loadgen按脚本方式导入同目录的e2e_bench
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from loadgen import LoadGenerator, load_questions, parse_mix, run_open  # noqa: E402
+
+
+def _generator(handler, mix, turns=(1, 1)):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://loadgen.test")
+    gen = LoadGenerator(client, ["补偿标准？"], [1.0], mix, turns, think_time_ms=0, import_articles=3, seed=1)
+    gen.recording = True
+    return gen
+
+
+def test_multi_turn_conversation_reuses_one_session():
+    requests = []
+
+    def handler(request):
+        requests.append((request.url.path, json.loads(request.content or b"{}")))
+        if request.url.path == "/sessions":
+            return httpx.Response(200, json={"session_id": "s-1"})
+        return httpx.Response(200, json={"answer": "答"})
+
+    gen = _generator(handler, {"ask": 1}, turns=(3, 3))
+    asyncio.run(gen.conversation())
+
+    assert [path for path, _ in requests] == ["/sessions", "/qa/ask", "/qa/ask", "/qa/ask"]
+    assert {body["session_id"] for _, body in requests[1:]} == {"s-1"}
+    assert gen.stats["ask"].summary(1.0)["requests"] == 3
+
+
+def test_stream_records_ttft_and_errors_by_status():
+    def ok(request):
+        lines = [{"type": "retrieval"}, {"type": "delta", "content": "答"}, {"type": "done"}]
+        return httpx.Response(200, content="\n".join(json.dumps(line) for line in lines).encode())
+
+    gen = _generator(ok, {"stream": 1})
+    asyncio.run(gen.conversation())
+    summary = gen.stats["stream"].summary(1.0)
+    assert summary["errors"] == 0 and summary["ttft"]["p50_ms"] is not None
+
+    gen = _generator(lambda request: httpx.Response(503, json={"detail": "busy"}), {"stream": 1})
+    asyncio.run(gen.conversation())
+    assert gen.stats["stream"].summary(1.0)["errors_by_kind"] == {"http_503": 1}
+
+
+def test_open_loop_drops_arrivals_over_inflight_limit():
+    async def slow(request):
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"items": []})
+
+    gen = _generator(slow, {"sessions": 1})
+
+    report = asyncio.run(run_open(gen, rate=200, deadline=time.monotonic() + 0.1, max_inflight=2, drain_timeout=1))
+
+    assert report["arrivals"] > 2 and report["dropped"] == report["arrivals"] - 2
+    assert gen.stats["sessions"].requests == 2
+
+
+def test_questions_weighted_by_frequency_in_logs(tmp_path):
+    path = tmp_path / "qa.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE qa_records (id INTEGER PRIMARY KEY, question TEXT)")
+    conn.executemany("INSERT INTO qa_records (question) VALUES (?)",
+                     [("常见问题",)] * 3 + [("少见问题",), ("[图片问答] 图片",)])
+    conn.commit()
+    conn.close()
+
+    assert load_questions(None, f"sqlite:///{path}", 10) == (["常见问题", "少见问题"], [3.0, 1.0])
+
+
+def test_parse_mix_rejects_unknown_operations():
+    assert parse_mix("ask=3,stream,import=0") == {"ask": 3.0, "stream": 1.0}
+    with pytest.raises(SystemExit):
+        parse_mix("delete=1")
@@ -0,0 +1,122 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from database import SessionLocal
+from memory_service import ChatMessage, MemoryService
+from models import ChatSession
+
+
+@pytest.fixture
+def memory(app_tables):
+    return MemoryService()
+
+
+@pytest.fixture
+def queries(app_tables):
+    """统计默认引擎上执行的SELECT数"""
+    count = []
+
+    def before_execute(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            count.append(statement)
+    event.listen(app_tables, "before_cursor_execute", before_execute)
+    yield count
+    event.remove(app_tables, "before_cursor_execute", before_execute)
+
+
+def _sid():
+    return f"s-{uuid.uuid4()}"
+
+
+def test_turns_are_cached_and_written_through(memory, queries):
+    sid = _sid()
+    memory.add_turn(sid, "补偿标准是多少？", "每平方米100元")
+    assert [(m.type, m.content) for m in memory.get_messages(sid)] == [("human", "补偿标准是多少？"), ("ai", "每平方米100元")]
+
+    queries.clear()
+    memory.add_turn(sid, "什么时候发放？", "三个月内")
+    messages = memory.get_messages(sid)
+
+    # 已缓存的会话写穿透更新，读取不再查询消息表
+    assert [m.content for m in messages][-2:] == ["什么时候发放？", "三个月内"]
+    assert not any("FROM message_store" in q for q in queries)
+    db = SessionLocal()
+    try:
+        row = db.get(ChatSession, sid)
+        assert row.message_count == 4 and row.title == "补偿标准是多少？"
+    finally:
+        db.close()
+
+
+def test_messages_are_stored_in_langchain_format(memory):
+    raw = ChatMessage("human", "你好").to_json()
+    assert json.loads(raw) == {"type": "human", "data": {"content": "你好", "type": "human"}}
+    assert ChatMessage.from_json(raw).content == "你好"
+
+
+def test_cache_is_bounded_and_cleared_with_the_session(memory):
+    memory.max_cached_sessions = 1
+    first, second = _sid(), _sid()
+    memory.add_turn(first, "q1", "a1")
+    memory.add_turn(second, "q2", "a2")
+    memory.get_messages(first)
+    memory.get_messages(second)
+    assert list(memory._cache) == [second]
+
+    memory.clear_session(second)
+
+    assert memory.get_messages(second) == []
+    assert [m.content for m in memory.get_messages(first)] == ["q1", "a1"]
+
+
+def _add_sessions(rows):
+    db = SessionLocal()
+    try:
+        db.add_all(ChatSession(session_id=sid, created_at=at, last_active_at=at, message_count=0) for sid, at in rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_cursor_pages_do_not_skip_sessions_with_equal_activity(memory):
+    # 远期时间戳使这些会话排在最前，活跃时间相同的会话跨越分页边界
+    tied, earlier = datetime(2099, 1, 1, 12), datetime(2099, 1, 1, 11)
+    prefix = uuid.uuid4().hex[:8]
+    rows = [(f"{prefix}-{c}", tied) for c in "abc"] + [(f"{prefix}-{c}", earlier) for c in "de"]
+    _add_sessions(rows)
+
+    seen, before, before_id = [], None, None
+    while len(seen) < len(rows):
+        page, cursor = memory.list_sessions(limit=2, before=before, before_id=before_id)
+        assert len(page) <= 2
+        seen.extend(s.session_id for s in page)
+        assert cursor is not None
+        before, before_id = cursor
+
+    assert seen[:len(rows)] == [f"{prefix}-{c}" for c in "cbaed"]
+
+
+def test_expire_idle_sessions_removes_sessions_and_messages(memory):
+    stale, active = _sid(), _sid()
+    memory.add_turn(stale, "q", "a")
+    memory.add_turn(active, "q", "a")
+    db = SessionLocal()
+    try:
+        db.get(ChatSession, stale).last_active_at = datetime(2000, 1, 1)
+        db.commit()
+    finally:
+        db.close()
+
+    assert memory.expire_idle_sessions(ttl_days=30) >= 1
+
+    assert memory.get_messages(stale) == []
+    assert len(memory.get_messages(active)) == 2
+    db = SessionLocal()
+    try:
+        assert db.get(ChatSession, stale) is None
+    finally:
+        db.close()
@@ -0,0 +1,52 @@
+from metrics import MetricsRegistry, render_prometheus
+from tracing import Trace
+
+
+def test_render_prometheus_counters_histograms_and_callbacks():
+    reg = MetricsRegistry()
+    requests = reg.counter("requests_total", "Requests", ("status",))
+    requests.inc(status="ok")
+    requests.inc(2, status='bad "quote"')
+    reg.counter("idle_total", "Never incremented")
+    latency = reg.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    reg.callback("queue_depth", "Queue depth", lambda: [({"queue": "chat"}, 3)])
+    reg.callback("broken", "Failing callback", lambda: 1 / 0)
+
+    lines = render_prometheus(reg).splitlines()
+
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{status="ok"} 1' in lines
+    assert 'requests_total{status="bad \\"quote\\""} 2' in lines
+    assert "idle_total 0" in lines
+    # 直方图的桶是累积计数
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines and "latency_seconds_count 3" in lines
+    assert 'queue_depth{queue="chat"} 3' in lines
+    # 回调出错时只导出HELP/TYPE，不影响其他指标
+    assert "# TYPE broken gauge" in lines
+
+
+def test_registry_returns_existing_metric_for_same_name():
+    reg = MetricsRegistry()
+    assert reg.counter("a_total", "A") is reg.counter("a_total", "A")
+
+
+def test_trace_accumulates_repeated_spans_and_keeps_first_mark():
+    trace = Trace()
+    trace.add("llm", 0.010)
+    trace.add("llm", 0.005)
+    with trace.span("retrieval"):
+        pass
+    trace.mark("first_delta")
+    first = trace.marks["first_delta"]
+    trace.mark("first_delta")
+
+    result = trace.to_dict()
+    assert result["spans_ms"]["llm"] == 15.0
+    assert "retrieval" in result["spans_ms"]
+    assert result["marks_ms"] == {"first_delta": first}
+    assert result["total_ms"] >= first
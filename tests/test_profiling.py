@@ -0,0 +1,60 @@
+import asyncio
+import json
+import time
+
+from async_utils import run_blocking
+from config import Config
+from profiling import ProfileStore, RequestProfile, admin_token_valid
+
+
+def _busy_loop(seconds=0.1):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def _profile_blocking_work():
+    async def scenario():
+        profile = RequestProfile("qa.ask", interval_ms=1).start()
+        with profile.activate():
+            await run_blocking(_busy_loop)
+        return profile
+    return asyncio.run(scenario())
+
+
+def test_profile_samples_pool_threads_running_request_work(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=5)
+
+    meta = store.save(_profile_blocking_work(), qa_record_id=7)
+
+    assert meta["samples"] > 0 and meta["qa_record_id"] == 7
+    with open(store.artifact_path(meta["id"], "collapsed"), encoding="utf-8") as f:
+        collapsed = f.read()
+    assert any(line.startswith("blocking-io") and "_busy_loop" in line for line in collapsed.splitlines())
+    with open(store.artifact_path(meta["id"], "speedscope"), encoding="utf-8") as f:
+        speedscope = json.load(f)
+    assert any(frame["name"] == "_busy_loop" for frame in speedscope["shared"]["frames"])
+
+
+def test_store_keeps_newest_profiles_and_rejects_bad_ids(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=2)
+    saved = []
+    for qa_record_id in (1, 2, 3):
+        profile = RequestProfile("qa.ask", interval_ms=1).start()
+        # id以时间开头、按字典序排序；固定id以确定先后
+        profile.id = f"20260101000000-0000000{qa_record_id}"
+        saved.append(store.save(profile, qa_record_id=qa_record_id)["id"])
+
+    assert [m["qa_record_id"] for m in store.list()] == [3, 2]
+    assert store.list(qa_record_id=2)[0]["id"] == saved[1]
+    assert store.artifact_path(saved[0], "collapsed") is None
+    assert store.artifact_path("../" + saved[2], "collapsed") is None
+    assert store.artifact_path(saved[2], "pprof") is None
+
+
+def test_admin_token_required_and_compared_exactly(monkeypatch):
+    monkeypatch.setattr(Config, "ADMIN_TOKEN", "")
+    assert not admin_token_valid("")
+    monkeypatch.setattr(Config, "ADMIN_TOKEN", "secret")
+    assert admin_token_valid("secret")
+    assert not admin_token_valid("secret2") and not admin_token_valid(None)
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from config import Config
+from qa_service import QAService
+
+HISTORY = [{"role": "user", "content": "上一轮问题"}, {"role": "assistant", "content": "上一轮回答"}]
+
+
+@pytest.fixture
+def qa(monkeypatch):
+    qa = QAService()
+    monkeypatch.setattr(qa.settings_service, "get_prompt_settings", lambda db: {"system_prompt": "S", "answer_prompt": "A"})
+    monkeypatch.setattr(qa.history_service, "build_history", lambda db, session_id: list(HISTORY))
+    yield qa
+    asyncio.run(qa.aclose())
+
+
+def test_cache_layout_keeps_prefix_stable_across_questions(qa, monkeypatch):
+    monkeypatch.setattr(Config, "PROMPT_LAYOUT", "cache")
+
+    first = qa._build_messages(None, "问题一", "背景一", "s1")
+    second = qa._build_messages(None, "问题二", "背景二", "s1")
+
+    # 系统消息与历史逐字节相同，易变内容只出现在最后一条消息
+    assert first[:-1] == second[:-1]
+    assert first[0]["role"] == "system" and "A" in first[0]["content"]
+    assert first[1:-1] == HISTORY
+    assert "背景一" in first[-1]["content"] and "问题一" in first[-1]["content"]
+    assert "背景一" not in first[0]["content"]
+
+
+def test_legacy_layout_puts_answer_prompt_in_user_message(qa, monkeypatch):
+    monkeypatch.setattr(Config, "PROMPT_LAYOUT", "legacy")
+
+    messages = qa._build_messages(None, "问题一", "背景一", None)
+
+    assert messages[0] == {"role": "system", "content": "S"}
+    assert len(messages) == 2 and messages[-1]["content"].endswith("A")
+
+
+def test_usage_records_cached_prompt_tokens():
+    process_log = {}
+    openai_usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120,
+                                   prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+    QAService._record_usage(process_log, openai_usage, "m")
+    assert process_log["cached_tokens"] == 64 and process_log["total_tokens"] == 120
+
+    deepseek_usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120, prompt_cache_hit_tokens=32)
+    QAService._record_usage(process_log, deepseek_usage, "m")
+    assert process_log["cached_tokens"] == 32
@@ -0,0 +1,253 @@
+import asyncio
+import concurrent.futures
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from models import DailyStat, Feedback, QARecord
+from db_writer import DBWriter
+from qa_record_writer import IdAllocator, QARecordWriter
+
+_LOG = {"status": "success", "model": "m1", "timings": {"total_ms": 120.0}}
+
+
+class FlakyWriter:
+    """在down为True时以OperationalError模拟数据库不可用，其余情况转交真实写入器"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.down = False
+
+    def call(self, func, *args, **kwargs):
+        if self.down:
+            raise OperationalError("INSERT", {}, sqlite3.OperationalError("database is locked"))
+        return self.writer.call(func, *args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        return await asyncio.to_thread(self.call, func, *args, **kwargs)
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def flaky(writer):
+    return FlakyWriter(writer)
+
+
+@pytest.fixture
+def make_record_writer(writer, flaky, tmp_path):
+    created = []
+
+    def make(**kwargs):
+        options = dict(write_behind=True, flush_batch=50, flush_interval_ms=0, retry_seconds=0.1)
+        options.update(kwargs)
+        record_writer = QARecordWriter(flaky, IdAllocator(writer, QARecord, block_size=10),
+                                       spill_path=str(tmp_path / "spill.jsonl"), **options)
+        created.append(record_writer)
+        return record_writer
+
+    yield make
+    for record_writer in created:
+        record_writer.close(5)
+
+
+def _stats(session_factory):
+    db = session_factory()
+    try:
+        rows = db.query(DailyStat.model, func.sum(DailyStat.questions), func.sum(DailyStat.thumbs_up)).group_by(DailyStat.model).all()
+        return {model: (questions, thumbs_up) for model, questions, thumbs_up in rows}
+    finally:
+        db.close()
+
+
+def test_spill_on_operational_error_then_replay_in_order(make_record_writer, flaky, session_factory):
+    record_writer = make_record_writer()
+    record_writer.start()
+    flaky.down = True
+
+    async def produce():
+        first = await record_writer.save("q1", "a1", dict(_LOG), "m1")
+        await record_writer.add_feedback(first.id, True)
+        second = await record_writer.save("q2", "a2", dict(_LOG), "m1")
+        return first.id, second.id
+
+    first_id, second_id = asyncio.run(produce())
+    _wait_until(lambda: record_writer._has_spill() and record_writer.pending() == 0)
+    with open(record_writer.spill_path, encoding="utf-8") as f:
+        kinds = [json.loads(line)["kind"] for line in f]
+    assert kinds == ["qa_record", "feedback", "qa_record"]
+
+    flaky.down = False
+    _wait_until(lambda: not record_writer._has_spill())
+    db = session_factory()
+    try:
+        assert [r.id for r in db.query(QARecord).order_by(QARecord.id)] == [first_id, second_id]
+        assert [f.qa_record_id for f in db.query(Feedback)] == [first_id]
+    finally:
+        db.close()
+    # 反馈在其问答记录之后重放，计入记录所属的模型
+    assert _stats(session_factory) == {"m1": (2, 1)}
+
+
+def test_replaying_already_written_items_does_not_double_count(make_record_writer, session_factory):
+    record_writer = make_record_writer()
+
+    async def produce():
+        record = await record_writer.save("q1", "a1", dict(_LOG), "m1")
+        await record_writer.add_feedback(record.id, True)
+
+    asyncio.run(produce())
+    record_writer.close(5)
+    assert _stats(session_factory) == {"m1": (1, 1)}
+
+    # 模拟重放写入成功、但删除溢出文件前进程退出：同一批数据再次重放
+    db = session_factory()
+    try:
+        record = db.query(QARecord).one()
+        feedback = db.query(Feedback).one()
+        items = [
+            {"kind": "qa_record", "id": record.id, "question": record.question, "answer": record.answer,
+             "model_used": record.model_used, "process_log": record.process_log, "人工介入": False, "created_at": record.created_at},
+            {"kind": "feedback", "qa_record_id": feedback.qa_record_id, "is_useful": True, "comment": None, "created_at": feedback.created_at},
+        ]
+    finally:
+        db.close()
+    record_writer._append_lines(record_writer.spill_path, items)
+    record_writer._replay_spill()
+
+    assert not record_writer._has_spill()
+    db = session_factory()
+    try:
+        assert db.query(QARecord).count() == 1
+        assert db.query(Feedback).count() == 1
+    finally:
+        db.close()
+    assert _stats(session_factory) == {"m1": (1, 1)}
+
+
+def test_feedback_on_record_not_yet_flushed(make_record_writer, session_factory):
+    # 较长的凑批间隔：反馈入队时问答记录仍在队列中
+    record_writer = make_record_writer(flush_interval_ms=200)
+
+    async def produce():
+        record = await record_writer.save("q1", "a1", dict(_LOG), "m1")
+        db = session_factory()
+        try:
+            assert db.get(QARecord, record.id) is None
+        finally:
+            db.close()
+        await record_writer.add_feedback(record.id, False, "不准确")
+        return record.id
+
+    record_id = asyncio.run(produce())
+    record_writer.close(5)
+    db = session_factory()
+    try:
+        feedback = db.query(Feedback).one()
+        assert feedback.qa_record_id == record_id
+        assert feedback.comment == "不准确"
+        row = db.query(DailyStat).one()
+        assert (row.model, row.questions, row.thumbs_down) == ("m1", 1, 1)
+    finally:
+        db.close()
+
+
+def test_close_drains_queue(make_record_writer, session_factory):
+    record_writer = make_record_writer(flush_batch=7, flush_interval_ms=20)
+
+    async def produce():
+        return [(await record_writer.save(f"q{i}", "a", dict(_LOG), "m1")).id for i in range(40)]
+
+    ids = asyncio.run(produce())
+    record_writer.close(5)
+    assert record_writer.pending() == 0
+    assert not record_writer._has_spill()
+    db = session_factory()
+    try:
+        assert sorted(r.id for r in db.query(QARecord)) == sorted(ids)
+    finally:
+        db.close()
+    assert _stats(session_factory) == {"m1": (40, 0)}
+
+
+def test_bad_item_in_batch_is_rejected_alone(make_record_writer, session_factory):
+    record_writer = make_record_writer()
+    good = {"kind": "qa_record", "id": 1, "question": "q1", "answer": "a", "model_used": "m1",
+            "process_log": dict(_LOG), "人工介入": False, "created_at": None}
+    duplicate = dict(good, question="dup")
+    other = dict(good, id=2, question="q2")
+
+    record_writer._write([good, duplicate, other])
+
+    db = session_factory()
+    try:
+        assert {r.id: r.question for r in db.query(QARecord)} == {1: "q1", 2: "q2"}
+    finally:
+        db.close()
+    with open(record_writer.rejected_path, encoding="utf-8") as f:
+        assert [json.loads(line)["question"] for line in f] == ["dup"]
+    assert _stats(session_factory) == {"m1": (2, 0)}
+
+
+def test_id_allocator_blocks_do_not_overlap(writer):
+    first = IdAllocator(writer, QARecord, block_size=5)
+    second = IdAllocator(writer, QARecord, block_size=5)
+    ids = [first.next_id() for _ in range(12)] + [second.next_id() for _ in range(12)]
+    assert len(set(ids)) == len(ids)
+
+
+def test_try_next_id_does_not_wait_while_another_thread_waits_for_a_block(writer):
+    allocator = IdAllocator(writer, QARecord, block_size=5)
+    gate = threading.Event()
+    reserve = allocator._reserve
+
+    def slow_reserve(db, size):
+        gate.wait(5)
+        return reserve(db, size)
+    allocator._reserve = slow_reserve
+
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    waiter = executor.submit(allocator.next_id)
+    time.sleep(0.05)
+    start = time.perf_counter()
+    # 另一个线程正在等待预留：事件循环侧的分配立即返回，而不是在锁上等待数据库
+    assert allocator.try_next_id() is None
+    assert time.perf_counter() - start < 0.1
+
+    gate.set()
+    first = waiter.result(5)
+    executor.shutdown()
+    ids = [first] + [asyncio.run(allocator.allocate()) for _ in range(11)]
+    assert len(set(ids)) == 12
+
+
+def test_allocate_never_reserves_on_the_event_loop_thread(session_factory):
+    # 非串行写入器在调用线程中直接执行写操作，预留须转到I/O线程池
+    direct = DBWriter(session_factory, serialized=False)
+    allocator = IdAllocator(direct, QARecord, block_size=3)
+    threads = []
+    reserve = allocator._reserve
+
+    def recording_reserve(db, size):
+        threads.append(threading.current_thread())
+        return reserve(db, size)
+    allocator._reserve = recording_reserve
+
+    async def run():
+        return [await allocator.allocate() for _ in range(10)], threading.current_thread()
+
+    ids, loop_thread = asyncio.run(run())
+
+    assert ids == sorted(set(ids))
+    assert threads and loop_thread not in threads
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from admission import OverloadedError
+from qa_service import QAService
+
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+
+
+@pytest.fixture
+def qa(monkeypatch):
+    qa = QAService()
+    saved = []
+
+    async def retrieve(db, query, priority=None, trace=None):
+        return None, [], {"mode": "test"}
+
+    async def lookup(db, query_embedding, similar_knowledges, session_id):
+        return None, None
+
+    async def save(question, answer, process_log):
+        saved.append((question, answer, process_log))
+        return SimpleNamespace(id=len(saved), question=question, answer=answer, created_at=None,
+                               model_used=process_log.get("model"), process_log=process_log, 人工介入=False)
+
+    monkeypatch.setattr(qa, "_retrieve", retrieve)
+    monkeypatch.setattr(qa, "_lookup_cached_answer", lookup)
+    monkeypatch.setattr(qa, "_build_messages", lambda *args: [{"role": "user", "content": "q"}])
+    monkeypatch.setattr(qa, "_save_qa_record", save)
+    qa.saved = saved
+    yield qa
+    asyncio.run(qa.aclose())
+
+
+def _collect(qa):
+    async def run():
+        return [event async for event in qa.ask_question_stream(None, "补偿标准？")]
+    return asyncio.run(run())
+
+
+def test_stream_events_in_order(qa, monkeypatch):
+    async def stream(messages, routing, **kwargs):
+        routing["model"] = "m1"
+        for content in ("补偿", "标准"):
+            yield _chunk(content)
+    monkeypatch.setattr(qa.router, "stream", stream)
+
+    events = _collect(qa)
+
+    assert [e["type"] for e in events] == ["retrieval", "delta", "delta", "done"]
+    assert events[-1]["answer"] == "补偿标准"
+    assert events[-1]["process_log"]["status"] == "success"
+
+
+def test_stream_failure_sends_error_event_and_keeps_partial_answer(qa, monkeypatch):
+    async def stream(messages, routing, **kwargs):
+        yield _chunk("部分")
+        raise RuntimeError("connection reset")
+    monkeypatch.setattr(qa.router, "stream", stream)
+
+    events = _collect(qa)
+
+    assert [e["type"] for e in events] == ["retrieval", "delta", "error", "done"]
+    assert "".join(e["content"] for e in events if e["type"] == "delta") == "部分"
+    assert events[2]["message"] == QAService.STREAM_ERROR_MESSAGE
+    question, answer, process_log = qa.saved[0]
+    # 提示语不写入答案，记录为失败前已推送的部分答案
+    assert answer == "部分"
+    assert process_log["status"] == "error"
+    assert "connection reset" in process_log["error_message"]
+
+
+def test_stream_overload_after_response_start_is_an_error_event(qa, monkeypatch):
+    async def stream(messages, routing, **kwargs):
+        raise OverloadedError("chat", 3, "排队超时")
+        yield  # pragma: no cover
+    monkeypatch.setattr(qa.router, "stream", stream)
+
+    events = _collect(qa)
+
+    assert [e["type"] for e in events] == ["retrieval", "error", "done"]
+    assert events[1]["retry_after"] == 3
+    assert qa.saved[0][1] == ""
+    assert qa.saved[0][2]["status"] == "error"
+
+
+def test_context_is_packed_off_the_event_loop(qa, monkeypatch):
+    threads = []
+    pack = qa.context_packer.pack
+
+    def recording_pack(similar_knowledges):
+        threads.append(threading.current_thread().name)
+        return pack(similar_knowledges)
+
+    async def stream(messages, routing, **kwargs):
+        yield _chunk("答")
+    monkeypatch.setattr(qa.context_packer, "pack", recording_pack)
+    monkeypatch.setattr(qa.router, "stream", stream)
+
+    _collect(qa)
+
+    assert threads and threads[0].startswith("cpu-bound")
@@ -0,0 +1,82 @@
+import asyncio
+
+from models import Knowledge
+from rerank_service import LexicalReranker, RerankService, Reranker
+
+
+def _candidates():
+    return [
+        (Knowledge(id=1, title="拆迁补偿", content="补偿标准按面积计算"), 0.9),
+        (Knowledge(id=2, title="宅基地", content="宅基地使用权变更流程"), 0.8),
+        (Knowledge(id=3, title="规划政策", content="城市规划调整"), 0.7),
+    ]
+
+
+class _SlowReranker(Reranker):
+    name = "slow"
+
+    async def ascore(self, query, candidates):
+        await asyncio.sleep(1)
+        return [0.0] * len(candidates)
+
+
+class _UnloadedReranker(Reranker):
+    name = "unloaded"
+
+    def __init__(self):
+        self.loads = 0
+
+    @property
+    def ready(self):
+        return False
+
+    def load(self):
+        self.loads += 1
+        raise RuntimeError("no model")
+
+    async def ascore(self, query, candidates):
+        raise AssertionError("未加载时不应打分")
+
+
+def test_lexical_reranker_promotes_term_overlap():
+    service = RerankService("lexical", top_k=2, timeout_ms=1000)
+
+    ranked, log = asyncio.run(service.rerank("宅基地使用权怎么变更", _candidates()))
+
+    assert [k.id for k, _ in ranked] == [2, 1]
+    assert log["fallback"] is False and set(log["scores"]) == {1, 2}
+    assert service.fallbacks == 0
+
+
+def test_lexical_reranker_keeps_vector_scores_without_query_terms():
+    assert LexicalReranker().score("？？", _candidates()) == [0.9, 0.8, 0.7]
+
+
+def test_timeout_falls_back_to_vector_order():
+    service = RerankService("none", top_k=2, timeout_ms=20)
+    service.reranker = _SlowReranker()
+
+    ranked, log = asyncio.run(service.rerank("补偿", _candidates()))
+
+    assert [k.id for k, _ in ranked] == [1, 2]
+    assert log["fallback"] is True and log["fallback_reason"] == "timeout"
+    assert service.fallbacks == 1
+
+
+def test_unready_reranker_falls_back_and_loads_in_background():
+    service = RerankService("none", top_k=1, timeout_ms=1000)
+    service.reranker = reranker = _UnloadedReranker()
+
+    async def scenario():
+        first = await service.rerank("补偿", _candidates())
+        await service._load_task
+        second = await service.rerank("补偿", _candidates())
+        return first, second
+
+    (ranked, log), (_, second_log) = asyncio.run(scenario())
+
+    assert [k.id for k, _ in ranked] == [1]
+    assert log["fallback_reason"] == "loading"
+    # 加载失败后记录原因，不再反复尝试加载
+    assert second_log["fallback_reason"] == "no model"
+    assert reranker.loads == 1 and service.fallbacks == 2
@@ -0,0 +1,48 @@
+from datetime import date, datetime
+
+from database import SessionLocal
+from models import Feedback, QARecord
+from retention_service import ArchiveStore, RetentionService
+
+
+def test_archives_expired_records_without_feedback(app_tables, tmp_path):
+    db = SessionLocal()
+    old = [QARecord(question=f"旧问题{i}", answer="答", created_at=datetime(2000, 1, 1 + i % 2, 8)) for i in range(3)]
+    recent = QARecord(question="近期问题", answer="答", created_at=datetime(2000, 1, 30))
+    db.add_all(old + [recent])
+    db.flush()
+    db.add(Feedback(qa_record_id=old[2].id, is_useful=True))
+    db.commit()
+    ids = [r.id for r in old] + [recent.id]
+    db.close()
+
+    service = RetentionService(ArchiveStore(str(tmp_path), "gzip"))
+    service.retention_days = 10
+    service.batch_size = 1
+    stats = service.archive_expired(now=datetime(2000, 2, 1))
+
+    assert (stats["archived"], stats["deleted"]) == (2, 2)
+    assert stats["partitions"] == ["2000-01-01", "2000-01-02"]
+    db = SessionLocal()
+    remaining = {r.id for r in db.query(QARecord.id).filter(QARecord.id.in_(ids))}
+    db.close()
+    # 有反馈的记录与未过期的记录留在热表
+    assert remaining == {old[2].id, recent.id}
+    archived = list(service.store.iter_records())
+    assert [r["question"] for r in archived] == ["旧问题0", "旧问题1"]
+    assert service.archive_expired(now=datetime(2000, 2, 1))["archived"] == 0
+
+
+def test_archive_reads_back_appended_frames_once_per_id(tmp_path):
+    for compression in ("zstd", "gzip"):
+        store = ArchiveStore(str(tmp_path / compression), compression)
+        day = date(2026, 3, 1)
+        store.append(day, [{"id": 1, "question": "拆迁补偿", "answer": "a"}])
+        # 归档后删除前中断：同一批记录被再次追加
+        store.append(day, [{"id": 1, "question": "拆迁补偿", "answer": "a"}, {"id": 2, "question": "安置", "answer": "b"}])
+        store.append(date(2026, 3, 5), [{"id": 3, "question": "租金", "answer": "c"}])
+
+        assert [p["date"] for p in store.partitions()] == ["2026-03-01", "2026-03-05"]
+        assert [r["id"] for r in store.iter_records()] == [1, 2, 3]
+        assert [r["id"] for r in store.iter_records(keyword="补偿")] == [1]
+        assert [r["id"] for r in store.iter_records(start=date(2026, 3, 2))] == [3]
@@ -0,0 +1,63 @@
+import numpy as np
+
+from config import Config
+from evaluate import EmbeddingDiskCache, override_config
+from knowledge_service import KnowledgeService
+from models import Knowledge
+from qa_service import QAService
+from vector_store import InMemoryVectorStore
+
+
+def _knowledge(kid):
+    return Knowledge(id=kid, title=f"k{kid}", content="")
+
+
+def test_lexical_search_keeps_best_matches_beyond_candidate_limit(session_factory, monkeypatch):
+    db = session_factory()
+    # 大量只命中一个词项的条目排在最相关条目之前
+    db.add_all([Knowledge(title=f"补偿说明{i}", content="补偿") for i in range(10)])
+    db.add(Knowledge(title="宅基地补偿标准", content="宅基地补偿标准按面积计算"))
+    db.commit()
+    monkeypatch.setattr(Config, "HYBRID_LEXICAL_CANDIDATES", 3)
+
+    results = KnowledgeService(vector_store=InMemoryVectorStore()).search_knowledge_by_terms(db, "宅基地补偿标准", top_k=2)
+    db.close()
+
+    assert results[0][0].title == "宅基地补偿标准" and results[0][1] == 1.0
+    assert results[1][1] < 1.0
+
+
+def test_rrf_fusion_rewards_agreement_between_rankings():
+    vector = [(_knowledge(1), 0.9), (_knowledge(2), 0.8), (_knowledge(3), 0.7)]
+    lexical = [(_knowledge(3), 1.0), (_knowledge(4), 0.5)]
+
+    fused = QAService._fuse_rrf(vector, lexical, top_k=3)
+
+    # 3号同时出现在两路中，排名第一；相似度沿用向量相似度
+    assert [(k.id, sim) for k, sim in fused] == [(3, 0.7), (1, 0.9), (2, 0.8)]
+
+
+def test_embedding_disk_cache_is_keyed_by_model(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    cache = EmbeddingDiskCache(path, "model-a")
+    cache.put_many(["问题"], [np.array([0.5, 1.5])])
+    cache.close()
+
+    reopened = EmbeddingDiskCache(path, "model-a")
+    assert reopened.get("问题").tolist() == [0.5, 1.5]
+    assert reopened.get("其他") is None and (reopened.hits, reopened.misses) == (1, 1)
+    reopened.close()
+    other_model = EmbeddingDiskCache(path, "model-b")
+    assert other_model.get("问题") is None
+    other_model.close()
+
+
+def test_override_config_restores_values_after_error():
+    original = Config.RETRIEVAL_TOP_K
+    try:
+        with override_config(RETRIEVAL_TOP_K=original + 7):
+            assert Config.RETRIEVAL_TOP_K == original + 7
+            raise ValueError
+    except ValueError:
+        pass
+    assert Config.RETRIEVAL_TOP_K == original
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from answer_cache import answer_cache
+from config import Config
+from database import SessionLocal
+from models import AppSetting
+from settings_service import SettingsService
+
+
+@pytest.fixture
+def db(app_tables, monkeypatch):
+    # 缓存为类属性（进程内共享），每个测试从空缓存开始
+    monkeypatch.setattr(SettingsService, "_cached_version", None)
+    monkeypatch.setattr(SettingsService, "_cached_values", {})
+    monkeypatch.setattr(SettingsService, "_checked_at", 0.0)
+    db = SessionLocal()
+    yield db
+    db.close()
+
+
+def _write_as_other_process(db, system_prompt):
+    """模拟另一个工作进程更新设置：改写设置项并递增版本行"""
+    rows = {s.key: s for s in db.query(AppSetting).all()}
+    rows[SettingsService.SYSTEM_PROMPT_KEY].value = system_prompt
+    rows[SettingsService.VERSION_KEY].value = rows[SettingsService.VERSION_KEY].value + 1
+    db.commit()
+
+
+def test_update_is_visible_and_clears_answer_cache(db):
+    answer_cache.store(np.array([1.0]), ((1, "v"),), "p", "旧答案")
+    service = SettingsService()
+
+    result = service.update_prompt_settings(db, "系统", "回答")
+
+    assert result == {"system_prompt": "系统", "answer_prompt": "回答"}
+    assert answer_cache.stats()["entries"] == 0
+
+
+def test_reads_are_served_from_cache_until_the_version_changes(db, monkeypatch):
+    monkeypatch.setattr(Config, "SETTINGS_VERSION_CHECK_SECONDS", 3600)
+    service = SettingsService()
+    service.update_prompt_settings(db, "v1", "a")
+    version_reads = []
+    get_version = service._get_version
+    monkeypatch.setattr(service, "_get_version", lambda db: version_reads.append(1) or get_version(db))
+
+    _write_as_other_process(db, "v2")
+    # 检查间隔内不读数据库
+    assert service.get_prompt_settings(db)["system_prompt"] == "v1"
+    assert version_reads == []
+
+    # 超过检查间隔后只读版本行，版本变化才重新加载
+    monkeypatch.setattr(Config, "SETTINGS_VERSION_CHECK_SECONDS", 0)
+    assert service.get_prompt_settings(db)["system_prompt"] == "v2"
+    assert service.get_prompt_settings(db)["system_prompt"] == "v2"
+    assert len(version_reads) == 2
@@ -0,0 +1,88 @@
+import asyncio
+
+from singleflight import SingleFlight, StreamFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "结果"
+
+    async def scenario():
+        results = await asyncio.gather(*[flight.do("k", fetch) for _ in range(5)])
+        return results, flight.inflight()
+
+    results, inflight = asyncio.run(scenario())
+
+    assert len(calls) == 1 and inflight == 0
+    assert [value for value, _ in results] == ["结果"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return 42
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == (42, True)
+
+
+def test_stream_subscribers_share_upstream_and_replay_earlier_chunks():
+    flight = StreamFlight()
+    factories = []
+
+    async def upstream():
+        for chunk in ("你", "好", "！"):
+            await asyncio.sleep(0.005)
+            yield chunk
+
+    def factory():
+        factories.append(1)
+        return upstream(), {"status": "streaming"}
+
+    async def collect(stream):
+        return "".join([chunk async for chunk in stream])
+
+    async def scenario():
+        stream, state, shared = flight.subscribe("k", factory)
+        first = asyncio.ensure_future(collect(stream))
+        await asyncio.sleep(0.008)
+        late, late_state, late_shared = flight.subscribe("k", factory)
+        assert (shared, late_shared) == (False, True) and late_state is state
+        return await first, await collect(late)
+
+    assert asyncio.run(scenario()) == ("你好！", "你好！")
+    assert len(factories) == 1 and flight.inflight() == 0
+
+
+def test_stream_error_reaches_every_subscriber():
+    flight = StreamFlight()
+
+    async def upstream():
+        yield "部分"
+        raise RuntimeError("upstream down")
+
+    async def collect(stream):
+        return [chunk async for chunk in stream]
+
+    async def scenario():
+        first, _, _ = flight.subscribe("k", lambda: (upstream(), None))
+        second, _, _ = flight.subscribe("k", lambda: (upstream(), None))
+        return await asyncio.gather(collect(first), collect(second), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
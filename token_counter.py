@@ -0,0 +1,79 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken为可选依赖，缺失时使用估算
+    tiktoken = None
+
+# 中日韩字符大致按1个token计
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+@lru_cache(maxsize=16)
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    # 编码文件需联网下载或已在本地缓存，离线时加载失败则回退为估算
+    try:
+        if Config.TOKENIZER_ENCODING:
+            return tiktoken.get_encoding(Config.TOKENIZER_ENCODING)
+        try:
+            # 兼容 "provider/model" 形式的模型名
+            return tiktoken.encoding_for_model(model.split("/")[-1])
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"加载tokenizer失败，使用估算: {e}")
+        return None
+
+def warm_up(*models: str) -> None:
+    """预先加载各模型的tokenizer编码（首次加载可能需要下载并解析编码文件），避免首个请求承担加载耗时"""
+    for model in models or (Config.MODEL_NAME,):
+        _get_encoding(model)
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """统计文本的token数；无可用tokenizer时按字符估算"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model or Config.MODEL_NAME)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: Optional[str] = None) -> int:
+    """统计消息列表的token数（仅计算文本内容）"""
+    total = 0
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content, model)
+        elif isinstance(content, list):
+            total += sum(count_tokens(part.get("text", ""), model) for part in content if isinstance(part, dict))
+        total += MESSAGE_OVERHEAD_TOKENS
+    return total
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """将文本截断到不超过max_tokens个token"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model or Config.MODEL_NAME)
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    # 估算模式下二分查找截断位置
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid], model) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
@@ -0,0 +1,38 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from metrics import QA_STAGE_SECONDS
+
+class Trace:
+    """单次问答请求的分阶段计时：各阶段耗时（同名阶段累加）写入process_log["timings"]，
+    同时计入qa_stage_seconds直方图
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        # 相对请求开始的时间点（如首个答案增量）
+        self.marks: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.spans[stage] = round(self.spans.get(stage, 0.0) + seconds * 1000, 2)
+        QA_STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def mark(self, name: str) -> None:
+        if name not in self.marks:
+            self.marks[name] = round(self.elapsed() * 1000, 2)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"spans_ms": dict(self.spans), "marks_ms": dict(self.marks), "total_ms": round(self.elapsed() * 1000, 2)}
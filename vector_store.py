@@ -1,21 +1,16 @@
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 from config import Config
 import numpy as np
 import logging
-
-from pymilvus import (
-    connections,
-    FieldSchema,
-    CollectionSchema,
-    DataType,
-    Collection,
-    utility,
-)
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 class MilvusVectorStore:
-    """Milvus向量存储封装"""
+    """Milvus向量存储封装：pymilvus在首次使用时导入，连接延迟到首次检索或写入时建立；
+    连接失败后MILVUS_RETRY_SECONDS秒内直接报错（调用方回退为文本匹配），不在每个请求上等待连接超时
+    """
 
     def __init__(self):
         self.host = Config.MILVUS_HOST
@@ -23,20 +18,54 @@ class MilvusVectorStore:
         self.collection_name = Config.MILVUS_COLLECTION
         self.metric_type = Config.MILVUS_METRIC_TYPE
         self.index_type = Config.MILVUS_INDEX_TYPE
-        self._collection: Optional[Collection] = None
-        self._connect()
+        self.search_ef = Config.MILVUS_SEARCH_EF
+        self.search_nprobe = Config.MILVUS_SEARCH_NPROBE
+        self._collection = None
+        self._connected = False
+        self._connect_lock = threading.Lock()
+        self._retry_at = 0.0
+        self._last_error: Optional[str] = None
 
-    def _connect(self):
+    def _connect(self, blocking: bool = True) -> bool:
+        """连接Milvus；blocking=False时若其他线程正在连接则直接返回False"""
+        if self._connected:
+            return True
+        if not self._connect_lock.acquire(blocking=blocking):
+            return False
         try:
-            connections.connect(alias="default", host=self.host, port=self.port)
+            if self._connected:
+                return True
+            if time.monotonic() < self._retry_at:
+                raise ConnectionError(f"Milvus不可用（{self._last_error}），稍后重试")
+            try:
+                from pymilvus import connections
+                connections.connect(alias="default", host=self.host, port=self.port, timeout=Config.MILVUS_CONNECT_TIMEOUT)
+            except Exception as e:
+                self._last_error = str(e)
+                self._retry_at = time.monotonic() + Config.MILVUS_RETRY_SECONDS
+                logger.error(f"连接 Milvus 失败: {e}")
+                raise
+            self._connected = True
+            self._last_error = None
             logger.info(f"Connected to Milvus at {self.host}:{self.port}")
+            return True
+        finally:
+            self._connect_lock.release()
+
+    def ping(self) -> Dict[str, Any]:
+        """连接状态（未连接时尝试连接，连接失败后的重试间隔内不再尝试；正在连接时不等待）"""
+        try:
+            if not self._connect(blocking=False):
+                return {"status": "connecting", "host": f"{self.host}:{self.port}"}
         except Exception as e:
-            logger.error(f"连接 Milvus 失败: {e}")
-            raise
+            return {"status": "unavailable", "error": str(e)}
+        return {"status": "ok", "host": f"{self.host}:{self.port}"}
 
-    def _get_collection(self) -> Optional[Collection]:
+    def _get_collection(self):
         if self._collection is not None:
             return self._collection
+        self._connect()
+        from pymilvus import Collection, utility
         if utility.has_collection(self.collection_name):
             self._collection = Collection(self.collection_name)
             try:
@@ -47,8 +76,9 @@ class MilvusVectorStore:
             return self._collection
         return None
 
-    def ensure_collection(self, dim: int) -> Collection:
+    def ensure_collection(self, dim: int):
         """确保集合存在，若不存在则创建。"""
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema
         col = self._get_collection()
         if col:
             # 校验维度是否匹配
@@ -122,26 +152,89 @@ class MilvusVectorStore:
 
     def search(self, query_embedding: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
         """在Milvus中搜索最相似的向量，返回(knowledge_id, similarity)。"""
+        results = self.search_batch([query_embedding], top_k=top_k)
+        return results[0] if results else []
+
+    def search_batch(self, query_embeddings: List[np.ndarray], top_k: int = 5) -> List[List[Tuple[int, float]]]:
+        """一次请求搜索多个查询向量，按输入顺序返回每个查询的[(knowledge_id, similarity)]。"""
         col = self._get_collection()
-        if col is None:
-            return []
+        if col is None or not query_embeddings:
+            return [[] for _ in query_embeddings]
         try:
-            query = query_embedding.astype(np.float32)
-            search_params = {"metric_type": self.metric_type, "params": {"ef": 128} if self.index_type == "HNSW" else {"nprobe": 16}}
+            # HNSW要求ef不小于返回条数
+            params = {"ef": max(self.search_ef, top_k)} if self.index_type == "HNSW" else {"nprobe": self.search_nprobe}
+            search_params = {"metric_type": self.metric_type, "params": params}
             results = col.search(
-                data=[query.tolist()],
+                data=[q.astype(np.float32).tolist() for q in query_embeddings],
                 anns_field="embedding",
                 param=search_params,
                 limit=top_k,
                 output_fields=["knowledge_id"],
             )
-            hits = results[0]
-            out: List[Tuple[int, float]] = []
-            for h in hits:
-                kid = int(h.entity.get("knowledge_id"))
-                score = float(h.distance)
-                out.append((kid, score))
-            return out
+            return [
+                [(int(h.entity.get("knowledge_id")), float(h.distance)) for h in hits]
+                for hits in results
+            ]
         except Exception as e:
             logger.error(f"Milvus搜索失败: {e}")
-            return []
\ No newline at end of file
+            return [[] for _ in query_embeddings]
+
+
+class InMemoryVectorStore:
+    """进程内向量存储（余弦相似度暴力检索），接口与MilvusVectorStore一致；
+    不持久化，用于离线基准测试与无Milvus的本地调试
+    """
+
+    def __init__(self):
+        self._vectors: Dict[int, np.ndarray] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[int] = []
+        self._lock = threading.Lock()
+
+    def ping(self) -> Dict[str, Any]:
+        return {"status": "ok", "backend": "memory"}
+
+    def index(self, knowledge_id: int, embedding: np.ndarray):
+        """插入或覆盖向量。"""
+        if embedding is None:
+            return
+        vector = embedding.astype(np.float32)
+        norm = np.linalg.norm(vector)
+        with self._lock:
+            self._vectors[int(knowledge_id)] = vector / norm if norm > 0 else vector
+            self._matrix = None
+
+    def delete_by_id(self, knowledge_id: int):
+        with self._lock:
+            if self._vectors.pop(int(knowledge_id), None) is not None:
+                self._matrix = None
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
+        results = self.search_batch([query_embedding], top_k=top_k)
+        return results[0] if results else []
+
+    def search_batch(self, query_embeddings: List[np.ndarray], top_k: int = 5) -> List[List[Tuple[int, float]]]:
+        with self._lock:
+            if self._matrix is None and self._vectors:
+                self._ids = list(self._vectors.keys())
+                self._matrix = np.stack([self._vectors[i] for i in self._ids])
+            matrix, ids = self._matrix, self._ids
+        if matrix is None or not query_embeddings:
+            return [[] for _ in query_embeddings]
+        queries = np.stack([q.astype(np.float32) for q in query_embeddings])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        scores = (queries / np.where(norms > 0, norms, 1.0)) @ matrix.T
+        k = min(top_k, len(ids))
+        out = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            out.append([(ids[i], float(row[i])) for i in top])
+        return out
+
+def create_vector_store():
+    """按VECTOR_STORE配置创建向量存储"""
+    if Config.VECTOR_STORE == "memory":
+        logger.info("使用进程内向量存储（VECTOR_STORE=memory）")
+        return InMemoryVectorStore()
+    return MilvusVectorStore()